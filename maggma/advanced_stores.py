@@ -1,4 +1,6 @@
-from maggma.stores import Store, MongoStore
+from maggma.stores import Store, MongoStore, Mongolike
+from maggma.memory_engine import MemoryCollection
+from pymongo.collection import Collection
 from pydash.objects import set_, get, has
 from pydash.utilities import to_path
 import pydash.objects
@@ -77,19 +79,47 @@ class AliasingStore(Store):
         self.reverse_aliases = {v: k for k, v in aliases.items()}
         self.kwargs = kwargs
 
+        # alias paths are split once here rather than for every document
+        self._external_paths = _compile_aliases(self.aliases)
+        self._internal_paths = _compile_aliases(self.reverse_aliases)
+        # longest aliases first, so "a.b.c" is renamed by "a.b" before "a"
+        self._prefix_aliases = sorted(self.aliases.items(), key=lambda a: -len(a[0]))
+        self._prefix_reverse_aliases = sorted(self.reverse_aliases.items(), key=lambda a: -len(a[0]))
+
         kwargs.update({"lu_field": store.lu_field, "lu_type": store.lu_type})
         super(AliasingStore, self).__init__(**kwargs)
 
     def query(self, properties=None, criteria=None, **kwargs):
-
+        """
+        Queries the wrapped store with aliased fields. When properties are
+        given and the wrapped store is backed by MongoDB or the native
+        MemoryStore engine, fields are renamed by the server in an
+        aggregation $project. Otherwise, documents are renamed as they are
+        returned.
+
+        Args:
+            properties (list or dict): fields to return, using aliases
+            criteria (dict): filter for query, using aliases
+            **kwargs (kwargs): further kwargs to the wrapped store's query
+        """
         if isinstance(properties, list):
             properties = {p: 1 for p in properties}
 
-        criteria = criteria if criteria else {}
-        substitute(properties, self.reverse_aliases)
-        lazy_substitute(criteria, self.reverse_aliases)
-        for d in self.store.query(properties, criteria, **kwargs):
-            substitute(d, self.aliases)
+        criteria = self._internal_criteria(criteria) if criteria else {}
+        if "sort" in kwargs and kwargs["sort"]:
+            kwargs["sort"] = [(self._internal_field(k), v) for k, v in kwargs["sort"]]
+
+        pipeline = self._pipeline(properties, criteria, **kwargs)
+        if pipeline is not None:
+            # a generator like the other paths, rather than a CommandCursor
+            return (d for d in self.store.collection.aggregate(pipeline))
+
+        properties = self._internal_properties(properties)
+        return self._substituted(self.store.query(properties, criteria, **kwargs))
+
+    def _substituted(self, docs):
+        for d in docs:
+            _substitute_paths(d, self._external_paths)
             yield d
 
     def query_one(self, properties=None, criteria=None, **kwargs):
@@ -97,35 +127,31 @@ class AliasingStore(Store):
         if isinstance(properties, list):
             properties = {p: 1 for p in properties}
 
-        criteria = criteria if criteria else {}
-        substitute(properties, self.reverse_aliases)
-        lazy_substitute(criteria, self.reverse_aliases)
+        criteria = self._internal_criteria(criteria) if criteria else {}
+        properties = self._internal_properties(properties)
         d = self.store.query_one(properties, criteria, **kwargs)
-        substitute(d, self.aliases)
+        _substitute_paths(d, self._external_paths)
         return d
 
     def distinct(self, key, criteria=None, **kwargs):
-        if key in self.aliases:
-            key = self.aliases[key]
-        criteria = criteria if criteria else {}
-        lazy_substitute(criteria, self.aliases)
+        key = self._internal_field(key)
+        criteria = self._internal_criteria(criteria) if criteria else {}
         return self.store.distinct(key, criteria, **kwargs)
 
-    def update(self, docs, update_lu=True, key=None):
+    def update(self, docs, update_lu=True, key=None, **kwargs):
         key = key if key else self.key
 
         for d in docs:
-            substitute(d, self.reverse_aliases)
+            _substitute_paths(d, self._internal_paths)
 
         if key in self.aliases:
             key = self.aliases[key]
 
-        self.store.update(docs, update_lu=update_lu, key=key)
+        self._last_updated = None
+        return self.store.update(docs, update_lu=update_lu, key=key, **kwargs)
 
     def ensure_index(self, key, unique=False):
-        if key in self.aliases:
-            key = self.aliases
-        return self.store.ensure_index(key, unique)
+        return self.store.ensure_index(self._internal_field(key), unique)
 
     def close(self):
         self.store.close()
@@ -135,8 +161,96 @@ class AliasingStore(Store):
         return self.store.collection
 
     def connect(self):
+        self._last_updated = None
         self.store.connect()
 
+    def _internal_field(self, field):
+        """
+        Name of an aliased field, or a field inside one, in the wrapped store
+        """
+        if field in self.aliases:
+            return self.aliases[field]
+        for alias, key in self._prefix_aliases:
+            if field.startswith(alias + "."):
+                return key + field[len(alias):]
+        return field
+
+    def _external_field(self, field):
+        """
+        Name a field of the wrapped store, or a field inside one, is returned
+        as after substitution
+        """
+        if field in self.reverse_aliases:
+            return self.reverse_aliases[field]
+        for key, alias in self._prefix_reverse_aliases:
+            if field.startswith(key + "."):
+                return alias + field[len(key):]
+        return field
+
+    def _internal_properties(self, properties):
+        if not properties:
+            return properties
+        internal = {}
+        for field, value in properties.items():
+            internal[self._internal_field(field)] = value
+            # aliases nested in a requested field, e.g. "c.d" when "c" is requested
+            for alias, key in self.aliases.items():
+                if alias.startswith(field + "."):
+                    internal[key] = value
+        return internal
+
+    def _internal_criteria(self, criteria):
+        """
+        Copy of criteria with aliased field names replaced, including inside
+        $and, $or and $nor
+        """
+        internal = {}
+        for field, value in criteria.items():
+            if field in ("$and", "$or", "$nor"):
+                internal[field] = [self._internal_criteria(c) for c in value]
+            elif field.startswith("$"):
+                internal[field] = value
+            else:
+                internal[self._internal_field(field)] = value
+        return internal
+
+    def _pipeline(self, properties, criteria, sort=None, skip=0, limit=0, **kwargs):
+        """
+        Aggregation pipeline running the query with fields renamed by the
+        server, or None if it can't be pushed down
+        """
+        if not properties or kwargs or not isinstance(self.store, Mongolike):
+            return None
+        if not isinstance(self.store.collection, (Collection, MemoryCollection)):
+            return None
+
+        project = {}
+        for field, value in properties.items():
+            if field == "_id":
+                project["_id"] = value
+                continue
+            internal = self._internal_field(field)
+            # projections of exclusions, operator projections, fields with
+            # aliases inside them, and fields the find path returns under
+            # another name, e.g. the target of an alias, keep their structure
+            # and are substituted client-side
+            if not value or isinstance(value, dict) or \
+                    any(a.startswith(field + ".") for a in self.aliases) or \
+                    any(k.startswith(internal + ".") for k in self.reverse_aliases) or \
+                    self._external_field(internal) != field:
+                return None
+            project[field] = "$" + internal
+
+        pipeline = [{"$match": criteria}]
+        if sort:
+            pipeline.append({"$sort": dict(sort)})
+        if skip:
+            pipeline.append({"$skip": skip})
+        if limit:
+            pipeline.append({"$limit": limit})
+        pipeline.append({"$project": project})
+        return pipeline
+
 
 def lazy_substitute(d, aliases):
     for alias, key in aliases.items():
@@ -146,15 +260,69 @@ def lazy_substitute(d, aliases):
 
 
 def substitute(d, aliases):
-    for alias, key in aliases.items():
-        if has(d, key):
-            set_(d, alias, get(d, key))
-            unset(d, key)
+    _substitute_paths(d, _compile_aliases(aliases))
+
+
+def _compile_aliases(aliases):
+    """
+    Splits the alias paths into (alias parts, key parts) tuples
+    """
+    return [(alias, key, alias.split("."), key.split(".")) for alias, key in aliases.items()]
+
+
+def _substitute_paths(d, paths):
+    """
+    Moves the value at each key to its alias, removing the parents of the key
+    that are left empty
+
+    Args:
+        d (dict): document to modify in place
+        paths (list): (alias, key, alias parts, key parts) from _compile_aliases
+    """
+    if d is None:
+        return
+    for alias, key, alias_parts, key_parts in paths:
+        parents = []
+        node = d
+        for part in key_parts[:-1]:
+            child = node.get(part)
+            if isinstance(child, list):
+                # array indices in the path
+                _substitute_pydash(d, alias, key)
+                break
+            if not isinstance(child, dict):
+                break
+            parents.append((node, part))
+            node = child
+        else:
+            if key_parts[-1] not in node:
+                continue
+            value = node.pop(key_parts[-1])
+            for parent, part in reversed(parents):
+                if parent[part]:
+                    break
+                del parent[part]
+
+            node = d
+            for part in alias_parts[:-1]:
+                child = node.get(part)
+                if not isinstance(child, dict):
+                    child = node[part] = {}
+                node = child
+            node[alias_parts[-1]] = value
+
+
+def _substitute_pydash(d, alias, key):
+    if has(d, key):
+        set_(d, alias, get(d, key))
+        unset(d, key)
 
 
 def unset(d, key):
     pydash.objects.unset(d, key)
     path = to_path(key)
     for i in reversed(range(1, len(path))):
-        if len(get(d, path[:i])) == 0:
+        parent = get(d, path[:i])
+        # parents can already be removed by the recursive unset
+        if parent is not None and len(parent) == 0:
             unset(d, path[:i])
@@ -2,11 +2,12 @@ from abc import ABCMeta, abstractmethod
 import logging
 
 from monty.json import MSONable, MontyDecoder
+from maggma.utils import content_hash
 
 
 class Builder(MSONable, metaclass=ABCMeta):
 
-    def __init__(self, sources, targets, chunk_size=1000):
+    def __init__(self, sources, targets, chunk_size=1000, state_store=None):
         """
         Initialize the builder the framework.
 
@@ -14,10 +15,14 @@ class Builder(MSONable, metaclass=ABCMeta):
             sources([Store]): list of source stores
             targets([Store]): list of target stores
             chunk_size(int): chunk size for processing
+            state_store(Store): optional store to persist the high-water mark of
+                the builder, i.e. the start time of the last successful run, for
+                incremental builds
         """
         self.sources = sources
         self.targets = targets
         self.chunk_size = chunk_size
+        self.state_store = state_store
 
         self.logger = logging.getLogger(type(self).__name__)
         self.logger.addHandler(logging.NullHandler())
@@ -27,9 +32,88 @@ class Builder(MSONable, metaclass=ABCMeta):
         Connect to the builder sources and targets.
         """
         stores = self.sources + self.targets
+        if self.state_store is not None:
+            stores = stores + [self.state_store]
         for s in stores:
             s.connect()
 
+    @property
+    def state_key(self):
+        """
+        Key of this builder's documents in the state store, from the class of
+        the builder and the settings of its sources and targets, so that
+        builders of the same class reading or writing different stores have
+        their own high-water marks
+        """
+        stores = {"sources": [s.as_dict() for s in self.sources],
+                  "targets": [s.as_dict() for s in self.targets]}
+        return "{}.{}:{}".format(type(self).__module__, type(self).__name__, content_hash(stores))
+
+    @property
+    def high_water_mark(self):
+        """
+        Start time of the last successful run of this builder as recorded in the
+        state store. None if there is no state store or no recorded run.
+        """
+        if self.state_store is None:
+            return None
+        doc = self.state_store.query_one(criteria={"builder": self.state_key})
+        return doc.get("high_water_mark") if doc else None
+
+    def save_high_water_mark(self, dt):
+        """
+        Record the start time of a successful run in the state store.
+
+        Args:
+            dt (datetime): start time of the run
+        """
+        if self.state_store is not None:
+            self.state_store.update([{"builder": self.state_key, "high_water_mark": dt}],
+                                    update_lu=False, key="builder")
+
+    def get_new_keys(self, source, target, key=None, criteria=None, include_missing=False):
+        """
+        Returns the keys of documents in source that changed since the last
+        successful run of this builder. Without a recorded high-water mark, the
+        documents newer than the newest document in target are used, as in
+        Store.lu_filter.
+
+        Args:
+            source (Store): store to get the keys from
+            target (Store): store the builder writes the documents to
+            key (str): key to match documents on, defaults to source.key
+            criteria (dict): filter for documents in source
+            include_missing (bool): also return the keys of documents in source
+                that are missing in target
+        """
+        key = key if key else source.key
+        criteria = criteria if criteria else {}
+
+        mark = self.high_water_mark
+        if mark is not None:
+            lu_criteria = {source.lu_field: {"$gt": source.lu_func[1](mark)}}
+        else:
+            lu_criteria = source.lu_filter(target)
+        keys = set(source.distinct(key, criteria={"$and": [criteria, lu_criteria]}))
+
+        if include_missing:
+            all_keys = set(source.distinct(key, criteria=criteria))
+            keys |= all_keys - set(target.distinct(key))
+
+        return list(keys)
+
+    def get_deleted_keys(self, source, target, key=None):
+        """
+        Returns the keys of documents in target that are no longer in source.
+
+        Args:
+            source (Store): store the builder reads the documents from
+            target (Store): store the builder writes the documents to
+            key (str): key to match documents on, defaults to source.key
+        """
+        key = key if key else source.key
+        return list(set(target.distinct(key)) - set(source.distinct(key)))
+
     @abstractmethod
     def get_items(self):
         """
@@ -52,6 +136,19 @@ class Builder(MSONable, metaclass=ABCMeta):
         """
         return item
 
+    def process_items(self, items):
+        """
+        Process a batch of items. Used by processors that dispatch items to the
+        workers in batches. Default behavior is to call process_item on each item.
+
+        Args:
+            items ([dict]): a batch of items
+
+        Returns:
+            list of processed items
+        """
+        return [self.process_item(item) for item in items]
+
     @abstractmethod
     def update_targets(self, items):
         """
@@ -70,10 +167,13 @@ class Builder(MSONable, metaclass=ABCMeta):
         """
         Perform any final clean up.
         """
-        # Close any Mongo connections.
-        for store in (self.sources + self.targets):
+        # Release the stores' connections, shared clients are closed by their last user
+        stores = self.sources + self.targets
+        if self.state_store is not None:
+            stores = stores + [self.state_store]
+        for store in stores:
             try:
-                store.collection.database.client.close()
+                store.close()
             except AttributeError:
                 continue
         # Runner will pass iterable yielded by `self.get_items` as `cursor`. If
@@ -15,6 +15,8 @@ def main():
                         help="Builder file in either json or yaml format. Can contain a list of builders or a predefined Runner")
     parser.add_argument("-n", "--num_workers", type=int, default=0,
                         help="Number of worker processes. Defaults to use as many as available.")
+    parser.add_argument("-b", "--max_builders", type=int, default=1,
+                        help="Maximum number of independent builders to run concurrently. Defaults to 1.")
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help="Controls logging level per number of v's")
     parser.add_argument("--dry_run", action="store_true", default=False,
@@ -37,11 +39,11 @@ def main():
 
     if isinstance(objects, list):
         # If this is a list of builders
-        runner = Runner(objects, num_workers=args.num_workers)
+        runner = Runner(objects, num_workers=args.num_workers, max_builders=args.max_builders)
     elif isinstance(objects, Runner):
         # This is a runner:
         root.info("Changing number of workers from default in input file")
-        runner = Runner(objects.builders,args.num_workers)
+        runner = Runner(objects.builders, args.num_workers, max_builders=args.max_builders)
     else:
         root.error("Couldn't properly read the builder file.")
 
@@ -0,0 +1,334 @@
+# coding: utf-8
+"""
+Differences between two Stores, e.g. two snapshots of a collection.
+"""
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime
+from itertools import groupby
+import logging
+import re
+
+from bson.objectid import ObjectId
+from pydash import get
+from pymongo import ASCENDING
+
+from maggma.memory_engine import sort_value
+from maggma.stores import MongoStore
+from maggma.utils import content_hash
+
+
+class Delta(object):
+    """
+    Threshold for significant changes of a numeric value, parsed from an
+    expression: "+-" is a change of sign, "+-N" a change by more than N and
+    "+-N%" a change by more than N percent of the old value. Adding "=", which
+    must go before "%", also counts changes equal to the threshold.
+    """
+
+    _expr = re.compile(r"^\+-(?:(?P<num>\d+(?:\.\d*)?|\.\d+)(?P<eq>=)?(?P<pct>%)?)?$")
+
+    def __init__(self, s):
+        """
+        Args:
+            s (str): the expression
+
+        Raises:
+            ValueError if the expression is invalid
+        """
+        match = self._expr.match(s.strip())
+        if match is None:
+            raise ValueError("Bad delta expression '{}', expected '+-', '+-N', "
+                             "'+-N=', '+-N%' or '+-N=%'".format(s))
+        self.expr = s.strip()
+        self.threshold = float(match.group("num")) if match.group("num") else None
+        self.equal = bool(match.group("eq"))
+        self.percent = bool(match.group("pct"))
+
+    def cmp(self, old, new):
+        """
+        Whether the change from old to new is significant. Values that are
+        not both numbers are significant when they sort differently, in the
+        order used to match the documents.
+
+        Args:
+            old (float): old value
+            new (float): new value
+
+        Returns:
+            bool
+        """
+        if not (_is_number(old) and _is_number(new)):
+            return _order(old) != _order(new)
+        if self.threshold is None:
+            return _sign(old) != _sign(new)
+        delta = abs(new - old)
+        threshold = self.threshold * abs(old) / 100 if self.percent else self.threshold
+        return delta > threshold or (self.equal and delta == threshold)
+
+    def __str__(self):
+        return self.expr
+
+
+def _sign(x):
+    return (x > 0) - (x < 0)
+
+
+def _is_number(x):
+    return isinstance(x, (int, float)) and not isinstance(x, bool)
+
+
+def _order(value):
+    # unlike sort_value, arrays are compared element by element
+    if isinstance(value, list):
+        return [_order(v) for v in value]
+    return sort_value(value, ASCENDING)
+
+
+class Differ(object):
+    """
+    Finds the documents that are missing from, added to or changed in a
+    new Store compared to an old one. Both Stores are read sorted by key
+    and merge-joined, so only one document of each is held in memory at a
+    time. The key space can be split into ranges that are compared in
+    parallel.
+    """
+
+    #: keys of the diff result
+    MISSING, NEW, CHANGED = "missing", "additional", "changed"
+    #: fields of the CHANGED records
+    CHANGED_PROPERTY = "property"
+    CHANGED_OLD = "old"
+    CHANGED_NEW = "new"
+    CHANGED_DELTA = "delta"
+    CHANGED_MATCH_KEY = "match type"
+    CHANGED_MATCH_EXACT = "exact"
+    CHANGED_MATCH_DELTA = "delta"
+
+    def __init__(self, key="_id", props=None, info=None, fltr=None, deltas=None):
+        """
+        Args:
+            key (str): field matching the documents of the two Stores
+            props (list): fields whose values must be equal
+            info (list): extra fields included in the records of the result
+            fltr (dict): criteria selecting the documents to compare
+            deltas (dict): numeric fields whose values must be equal within
+                a tolerance, as {field: Delta}
+        """
+        self.key = key
+        self.props = list(props or [])
+        self.info = list(info or [])
+        self.fltr = fltr or {}
+        self.deltas = dict(deltas or {})
+        self.logger = logging.getLogger(type(self).__name__)
+        self.logger.addHandler(logging.NullHandler())
+
+    def diff(self, old, new, only_missing=False, only_values=False,
+             ranges=1, num_workers=1, processes=False):
+        """
+        Compares the documents of two Stores.
+
+        Args:
+            old (Store or str): the old Store, or the path of a MongoStore
+                db file
+            new (Store or str): the new Store, or the path of a MongoStore
+                db file
+            only_missing (bool): only find keys missing from the new Store
+            only_values (bool): only find changed documents
+            ranges (int): number of key ranges, split at quantiles of the
+                keys in the old Store
+            num_workers (int): number of key ranges compared at a time
+            processes (bool): compare the key ranges in processes rather
+                than threads, which requires Stores that can be pickled and
+                connected to again, e.g. MongoStores
+
+        Returns:
+            dict with MISSING, NEW and CHANGED lists of records. MISSING and
+            NEW records have the key and info fields of the document, CHANGED
+            records also have the property, the old and the new value, and
+            for numeric properties the delta
+        """
+        old = MongoStore.from_db_file(old) if isinstance(old, str) else old
+        new = MongoStore.from_db_file(new) if isinstance(new, str) else new
+        if old.collection is None:
+            old.connect()
+        if new.collection is None:
+            new.connect()
+
+        criteria = self._ranges(old, ranges)
+        options = dict(only_missing=only_missing, only_values=only_values)
+        if len(criteria) == 1:
+            results = [self._diff_range(old, new, criteria[0], **options)]
+        else:
+            executor_cls = ProcessPoolExecutor if processes else ThreadPoolExecutor
+            with executor_cls(max_workers=num_workers) as executor:
+                futures = [executor.submit(_diff_range, self, old, new, c, processes, options)
+                           for c in criteria]
+                results = [f.result() for f in futures]
+
+        diff = {self.MISSING: [], self.NEW: [], self.CHANGED: []}
+        for result in results:
+            for k, records in result.items():
+                diff[k].extend(records)
+        if only_missing:
+            del diff[self.NEW], diff[self.CHANGED]
+        elif only_values:
+            del diff[self.MISSING], diff[self.NEW]
+        return diff
+
+    def _ranges(self, store, ranges):
+        """
+        Splits the key space into criteria for ranges of about the same
+        number of documents in store
+        """
+        if ranges <= 1:
+            return [self.fltr]
+        n = _count(store, self.fltr)
+        bounds = []
+        for i in range(1, ranges):
+            for d in store.query(properties=[self.key], criteria=self.fltr,
+                                 sort=[(self.key, ASCENDING)], skip=n * i // ranges, limit=1):
+                value = get(d, self.key)
+                if not bounds or bounds[-1] != value:
+                    bounds.append(value)
+
+        # range queries only match keys of the same BSON type
+        bson_types = {_bson_type(b) for b in bounds}
+        if len(bson_types) != 1 or None in bson_types:
+            return [self.fltr]
+        bson_type, = bson_types
+
+        criteria = []
+        for lo, hi in zip([None] + bounds, bounds + [None]):
+            condition = {}
+            if lo is not None:
+                condition["$gte"] = lo
+            if hi is not None:
+                condition["$lt"] = hi
+            criteria.append(condition)
+        # keys of other types are compared as one more range
+        criteria.append({"$not": {"$type": bson_type}})
+        return [{"$and": [self.fltr, {self.key: c}]} if self.fltr else {self.key: c}
+                for c in criteria]
+
+    def _diff_range(self, old, new, criteria, only_missing=False, only_values=False):
+        """
+        Merge-joins the documents of both Stores matching criteria
+        """
+        result = {self.MISSING: [], self.NEW: [], self.CHANGED: []}
+        compare = not only_missing and bool(self.props or self.deltas)
+
+        old_docs = self._keyed(old, criteria)
+        new_docs = self._keyed(new, criteria)
+        o = next(old_docs, None)
+        n = next(new_docs, None)
+        while o is not None or n is not None:
+            if n is None or (o is not None and o[0] < n[0]):
+                if not only_values:
+                    result[self.MISSING].append(self._record(o[1]))
+                o = next(old_docs, None)
+            elif o is None or n[0] < o[0]:
+                if not only_values and not only_missing:
+                    result[self.NEW].append(self._record(n[1]))
+                n = next(new_docs, None)
+            else:
+                if compare:
+                    result[self.CHANGED].extend(self._changes(o[1], n[1], o[2], n[2]))
+                o = next(old_docs, None)
+                n = next(new_docs, None)
+        return result
+
+    def _keyed(self, store, criteria):
+        """
+        Yields (sort value, document, hash of props) of the documents
+        sorted by key, skipping documents without a key and duplicate keys
+        """
+        fields = list(dict.fromkeys([self.key] + self.props + list(self.deltas) + self.info))
+        docs = store.query(properties=fields, criteria=criteria, sort=[(self.key, ASCENDING)])
+        for value, group in groupby(docs, key=lambda d: sort_value(get(d, self.key), ASCENDING)):
+            doc = next(group)
+            if get(doc, self.key) is None:
+                continue
+            if next(group, None) is not None:
+                self.logger.warning("Duplicate key {}, only the first document is compared".format(
+                    get(doc, self.key)))
+            props_hash = content_hash({p: get(doc, p) for p in self.props}) if self.props else None
+            yield value, doc, props_hash
+
+    def _record(self, doc):
+        record = {self.key: get(doc, self.key)}
+        for field in self.info:
+            record[field] = get(doc, field)
+        return record
+
+    def _changes(self, old, new, old_hash, new_hash):
+        """
+        Records of the props and deltas that differ between two documents
+        with the same key
+        """
+        changes = []
+        # equal hashes rule out changes without comparing each property
+        if old_hash != new_hash:
+            for prop in self.props:
+                old_value, new_value = get(old, prop), get(new, prop)
+                if old_value != new_value:
+                    record = self._record(new)
+                    record.update({self.CHANGED_PROPERTY: prop, self.CHANGED_MATCH_KEY: self.CHANGED_MATCH_EXACT,
+                                   self.CHANGED_OLD: old_value, self.CHANGED_NEW: new_value})
+                    changes.append(record)
+
+        for prop, delta in self.deltas.items():
+            old_value, new_value = get(old, prop), get(new, prop)
+            if old_value is None or new_value is None:
+                # a value that appeared or disappeared is always significant
+                significant, difference = old_value is not new_value, None
+            else:
+                significant = delta.cmp(old_value, new_value)
+                difference = (new_value - old_value
+                              if _is_number(old_value) and _is_number(new_value) else None)
+            if significant:
+                record = self._record(new)
+                record.update({self.CHANGED_PROPERTY: prop, self.CHANGED_MATCH_KEY: self.CHANGED_MATCH_DELTA,
+                               self.CHANGED_OLD: old_value, self.CHANGED_NEW: new_value,
+                               self.CHANGED_DELTA: difference})
+                changes.append(record)
+        return changes
+
+
+def _diff_range(differ, old, new, criteria, connect, options):
+    """
+    Compares one key range, in a thread or in a process, where the Stores
+    are connected again
+    """
+    if connect:
+        old.connect()
+        new.connect()
+    try:
+        return differ._diff_range(old, new, criteria, **options)
+    finally:
+        if connect:
+            old.close()
+            new.close()
+
+
+def _count(store, criteria):
+    try:
+        return store.collection.count_documents(criteria)
+    except AttributeError:
+        return sum(1 for _ in store.query(properties=[store.key], criteria=criteria))
+
+
+def _bson_type(value):
+    """
+    $type alias of a key value, None for types that aren't split into ranges
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, datetime):
+        return "date"
+    if isinstance(value, ObjectId):
+        return "objectId"
+    return None
@@ -1,4 +1,6 @@
 import json
+import os
+import threading
 
 from pymongo import MongoClient
 
@@ -25,6 +27,95 @@ def get_database(cred, **mongo_client_kwargs):
     return db
 
 
+class ClientRegistry(object):
+    """
+    Process-level registry of MongoClients, so that stores connecting to the
+    same server with the same credentials share a client and its connection
+    pool. Clients are reference counted and closed when the last store
+    releases them. Clients are never shared across a fork: a process that
+    finds clients from its parent starts a new registry, leaving the parent's
+    clients alone.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # key -> [client, number of references]
+        self._clients = {}
+        self._keys = {}
+
+    def acquire(self, host="localhost", port=27017, username="", password="",
+                auth_source=None, **client_kwargs):
+        """
+        Returns a shared client for the server and credentials, creating it
+        if needed. Each call must be matched by a call to release.
+
+        Args:
+            host (str): hostname for mongo db
+            port (int): tcp port for mongo db
+            username (str): username for mongo db
+            password (str): password for mongo db
+            auth_source (str): database to authenticate against
+            **client_kwargs: further kwargs to MongoClient, part of the key
+
+        Returns:
+            pymongo.MongoClient
+        """
+        if username:
+            client_kwargs.update(username=username, password=password,
+                                 authSource=auth_source or "admin")
+        key = (host, port, tuple(sorted(client_kwargs.items())))
+        with self._lock:
+            self._check_fork()
+            entry = self._clients.get(key)
+            if entry is None:
+                # respect potential multiprocessing fork
+                client = MongoClient(host, port, connect=False, **client_kwargs)
+                entry = self._clients[key] = [client, 0]
+                self._keys[id(client)] = key
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, client):
+        """
+        Releases a client from acquire, closing it if it has no other users.
+        Clients from a parent process and unknown clients are ignored.
+
+        Args:
+            client (pymongo.MongoClient): the client to release
+        """
+        with self._lock:
+            self._check_fork()
+            key = self._keys.get(id(client))
+            if key is None or self._clients[key][0] is not client:
+                return
+            entry = self._clients[key]
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._clients[key]
+                del self._keys[id(client)]
+                client.close()
+
+    def count(self, client):
+        """
+        Number of users of a client
+        """
+        with self._lock:
+            self._check_fork()
+            key = self._keys.get(id(client))
+            return self._clients[key][1] if key is not None else 0
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            # MongoClients are not fork-safe, so children get fresh clients
+            self._pid = os.getpid()
+            self._clients = {}
+            self._keys = {}
+
+
+CLIENTS = ClientRegistry()
+
+
 def get_collection(config):
     """
     Returns collection from config file
@@ -0,0 +1,813 @@
+"""
+A native in-memory collection that implements the part of the pymongo
+Collection interface used by the Stores, as a faster alternative to mongomock
+for large collections.
+
+Documents are kept in a dict by _id. Indexes map the values of their first
+field to the _ids of the documents with that value, and keep a lazily sorted
+list of their scalar values for range queries. Queries use the indexes to
+select candidate documents, which are then matched with mongomock's filter
+implementation, so the results are the same as with mongomock. The other
+Stores that filter documents in Python use filter_applies from here as well.
+"""
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime
+import heapq
+import itertools
+
+from bson.objectid import ObjectId
+import mongomock
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.operations import DeleteMany, DeleteOne, InsertOne, ReplaceOne
+from pymongo.results import (BulkWriteResult, DeleteResult, InsertManyResult,
+                             InsertOneResult, UpdateResult)
+
+
+try:
+    # private mongomock API, the fallback below only uses the public one
+    from mongomock.filtering import filter_applies
+except ImportError:
+    def filter_applies(criteria, doc):
+        """
+        Whether a document matches MongoDB filter criteria
+        """
+        collection = mongomock.MongoClient()["maggma"]["filter"]
+        collection.insert_one(dict(doc))
+        return collection.find_one(criteria, {"_id": 1}) is not None
+
+
+class MemoryClient(object):
+    """
+    Client holding in-memory databases
+    """
+
+    def __init__(self):
+        self._databases = {}
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(name, self)
+        return self._databases[name]
+
+    def close(self):
+        pass
+
+
+class MemoryDatabase(object):
+    """
+    Database holding in-memory collections
+    """
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name, self)
+        return self._collections[name]
+
+
+class MemoryCollection(object):
+    """
+    In-memory collection with hash and sorted secondary indexes
+    """
+
+    def __init__(self, name, database=None):
+        self.name = name
+        self.database = database
+        self.drop()
+
+    def drop(self):
+        # frozen _id -> document
+        self._docs = {}
+        # frozen _id -> insertion number, to return documents in natural order
+        self._order = {}
+        self._counter = itertools.count()
+        self._indexes = {"_id_": _Index([("_id", ASCENDING)], unique=True)}
+
+    # Indexes
+
+    def create_index(self, keys, unique=False, name=None, **kwargs):
+        """
+        Creates an index on one or more fields. Queries use the index on
+        their first field, the other fields only count for uniqueness.
+
+        Args:
+            keys (str or list): field or list of (field, direction) pairs
+            unique (bool): whether to reject documents with duplicate values
+
+        Returns:
+            the name of the index
+        """
+        if isinstance(keys, str):
+            keys = [(keys, ASCENDING)]
+        keys = [(k, ASCENDING) if isinstance(k, str) else tuple(k) for k in keys]
+        name = name or "_".join("{}_{}".format(f, d) for f, d in keys)
+        if name not in self._indexes:
+            index = _Index(keys, unique=unique)
+            for key, doc in self._docs.items():
+                index.check(key, doc)
+                index.add(key, doc)
+            self._indexes[name] = index
+        return name
+
+    def drop_index(self, name):
+        del self._indexes[name]
+
+    def index_information(self):
+        info = {}
+        for name, index in self._indexes.items():
+            info[name] = {"key": list(index.fields)}
+            if index.unique and name != "_id_":
+                info[name]["unique"] = True
+        return info
+
+    # Reads
+
+    def find(self, filter=None, projection=None, sort=None, skip=0, limit=0, **kwargs):
+        return MemoryCursor(self, filter, projection, sort=sort, skip=skip, limit=limit)
+
+    def find_one(self, filter=None, projection=None, *args, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        return next(iter(self.find(filter, projection, *args, **kwargs).limit(1)), None)
+
+    def count_documents(self, filter=None, **kwargs):
+        return sum(1 for _ in self._match(filter))
+
+    def estimated_document_count(self, **kwargs):
+        return len(self._docs)
+
+    def distinct(self, key, filter=None, **kwargs):
+        """
+        Distinct values of key, where array values count as their elements
+        """
+        parts = key.split(".")
+        seen = set()
+        values = []
+        for doc in self._match(filter):
+            for value in _path_values(doc, parts, expand=False):
+                for v in (value if isinstance(value, list) else [value]):
+                    frozen = _freeze(v)
+                    if frozen not in seen:
+                        seen.add(frozen)
+                        values.append(_copy(v))
+        return values
+
+    def aggregate(self, pipeline, **kwargs):
+        """
+        Runs an aggregation pipeline with $match, $project, $group, $sort,
+        $skip, $limit and $unwind stages.
+
+        Returns:
+            iterator of the resulting documents
+        """
+        docs = None
+        for stage in pipeline:
+            (op, spec), = stage.items()
+            if op == "$match":
+                docs = (self._match(spec) if docs is None
+                        else _filter(docs, spec))
+                continue
+            if docs is None:
+                docs = self._match(None)
+            if op == "$project":
+                docs = map(_project, docs, itertools.repeat(spec))
+            elif op == "$group":
+                docs = _group(docs, spec)
+            elif op == "$sort":
+                docs = _sort(docs, list(spec.items()))
+            elif op == "$skip":
+                docs = itertools.islice(docs, spec, None)
+            elif op == "$limit":
+                docs = itertools.islice(docs, spec)
+            elif op == "$unwind":
+                docs = _unwind(docs, spec)
+            else:
+                raise NotImplementedError("{} is not supported by MemoryCollection".format(op))
+        if docs is None:
+            docs = self._match(None)
+        # documents from $group and $project are new, the others must be copied
+        if any("$group" in stage or "$project" in stage for stage in pipeline):
+            return docs
+        return (_copy(d) for d in docs)
+
+    def _match(self, criteria):
+        """
+        Yields the stored documents that match criteria
+        """
+        ids = self._candidates(criteria) if criteria else None
+        if ids is None:
+            docs = list(self._docs.values())
+        else:
+            docs = [self._docs[k] for k in sorted(ids, key=self._order.__getitem__)]
+        if not criteria:
+            return iter(docs)
+        return (d for d in docs if filter_applies(criteria, d))
+
+    def _candidates(self, criteria):
+        """
+        Returns the frozen _ids of the documents that can match criteria
+        according to the indexes, or None if no index applies
+        """
+        best = None
+        for field, condition in criteria.items():
+            if field == "$and":
+                ids_list = [self._candidates(c) for c in condition]
+            elif field.startswith("$"):
+                continue
+            else:
+                ids_list = [index.lookup(condition) for index in self._indexes.values()
+                            if index.fields[0][0] == field]
+            for ids in ids_list:
+                if ids is not None and (best is None or len(ids) < len(best)):
+                    best = ids
+        return best
+
+    # Writes
+
+    def insert_one(self, document, **kwargs):
+        result = self.bulk_write([InsertOne(document)])
+        return InsertOneResult(document["_id"], result.acknowledged)
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        documents = list(documents)
+        self.bulk_write([InsertOne(d) for d in documents], ordered=ordered)
+        return InsertManyResult([d["_id"] for d in documents], True)
+
+    def insert(self, doc_or_docs, **kwargs):
+        if isinstance(doc_or_docs, dict):
+            return self.insert_one(doc_or_docs).inserted_id
+        return self.insert_many(doc_or_docs).inserted_ids
+
+    def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        result = self.bulk_write([ReplaceOne(filter, replacement, upsert=upsert)]).bulk_api_result
+        upserted_id = result["upserted"][0]["_id"] if result["upserted"] else None
+        return UpdateResult({"n": result["nMatched"] + result["nUpserted"],
+                             "nModified": result["nModified"], "upserted": upserted_id}, True)
+
+    def delete_one(self, filter, **kwargs):
+        return DeleteResult({"n": self.bulk_write([DeleteOne(filter)]).deleted_count}, True)
+
+    def delete_many(self, filter, **kwargs):
+        return DeleteResult({"n": self.bulk_write([DeleteMany(filter)]).deleted_count}, True)
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        """
+        Applies InsertOne, ReplaceOne, DeleteOne and DeleteMany requests.
+        Duplicate key errors are reported like MongoDB does with a
+        BulkWriteError, after all requests for unordered writes and after
+        the first error for ordered writes.
+        """
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+                  "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        for n, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    result["nInserted"] += 1
+                elif isinstance(request, ReplaceOne):
+                    doc = next(self._match(request._filter), None)
+                    if doc is not None:
+                        result["nMatched"] += 1
+                        result["nModified"] += self._replace(doc, request._doc)
+                    elif request._upsert:
+                        replacement = dict(request._doc)
+                        self._insert(replacement)
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": n, "_id": replacement["_id"]})
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    docs = list(self._match(request._filter))
+                    for doc in docs[:1] if isinstance(request, DeleteOne) else docs:
+                        self._delete(_freeze(doc["_id"]))
+                        result["nRemoved"] += 1
+                else:
+                    raise NotImplementedError("{} is not supported by MemoryCollection".format(
+                        type(request).__name__))
+            except DuplicateKeyError as exc:
+                result["writeErrors"].append({"index": n, "code": 11000, "errmsg": str(exc),
+                                              "op": getattr(request, "_doc", None)})
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    def _insert(self, document):
+        """
+        Stores a copy of document, adding an _id to document if it has none
+        """
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        doc = _copy(document)
+        key = _freeze(doc["_id"])
+        for index in self._indexes.values():
+            index.check(key, doc)
+        for index in self._indexes.values():
+            index.add(key, doc)
+        self._docs[key] = doc
+        self._order[key] = next(self._counter)
+
+    def _replace(self, old, replacement):
+        """
+        Replaces the stored document old, keeping its _id
+
+        Returns:
+            1 if the document changed, 0 otherwise
+        """
+        key = _freeze(old["_id"])
+        doc = _copy(replacement)
+        doc.pop("_id", None)
+        doc = {"_id": old["_id"], **doc}
+        if doc == old:
+            return 0
+        for index in self._indexes.values():
+            index.check(key, doc)
+        for index in self._indexes.values():
+            index.remove(key, old)
+            index.add(key, doc)
+        self._docs[key] = doc
+        return 1
+
+    def _delete(self, key):
+        doc = self._docs.pop(key)
+        del self._order[key]
+        for index in self._indexes.values():
+            index.remove(key, doc)
+
+
+class MemoryCursor(object):
+    """
+    Lazy cursor over the results of MemoryCollection.find
+    """
+
+    def __init__(self, collection, criteria, projection, sort=None, skip=0, limit=0):
+        if isinstance(projection, (list, tuple)):
+            projection = {p: 1 for p in projection}
+        self._collection = collection
+        self._criteria = criteria
+        self._projection = projection
+        self._sort = _sort_spec(sort) if sort else None
+        self._skip = skip
+        self._limit = limit
+        self._results = None
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._results is None:
+            self._results = self._execute()
+        return next(self._results)
+
+    def _execute(self):
+        docs = self._collection._match(self._criteria)
+        stop = self._skip + self._limit if self._limit else None
+        if self._sort:
+            # only the first documents have to be sorted with a limit
+            docs = _sort(docs, self._sort, stop)
+        for doc in itertools.islice(docs, self._skip, stop):
+            yield _project(doc, self._projection)
+
+    def count(self, with_limit_and_skip=False):
+        """
+        Number of matching documents, like the deprecated pymongo Cursor.count
+
+        Args:
+            with_limit_and_skip (bool): whether to apply the skip and limit
+        """
+        count = self._collection.count_documents(self._criteria)
+        if with_limit_and_skip:
+            count = max(count - self._skip, 0)
+            if self._limit:
+                count = min(count, self._limit)
+        return count
+
+    def close(self):
+        self._results = iter(())
+
+
+class _Index(object):
+    """
+    Index on the values of one or more fields. The values of the first field
+    are mapped to the frozen _ids of the documents, and array values are
+    indexed by their elements as well.
+    """
+
+    def __init__(self, fields, unique=False):
+        self.fields = fields
+        self.unique = unique
+        self._parts = [f.split(".") for f, _ in fields]
+        # frozen value -> set of frozen _ids
+        self._entries = defaultdict(set)
+        # frozen values of all fields -> frozen _id
+        self._unique_entries = {}
+        # sorted (type rank, value) pairs of the scalar values, None if outdated
+        self._sorted = None
+
+    def _keys(self, doc, parts):
+        keys = {_freeze(v) for v in _path_values(doc, parts)}
+        return keys or {None}
+
+    def _unique_keys(self, doc):
+        return set(itertools.product(*(self._keys(doc, parts) for parts in self._parts)))
+
+    def check(self, key, doc):
+        if self.unique:
+            for unique_key in self._unique_keys(doc):
+                owner = self._unique_entries.get(unique_key, key)
+                if owner != key:
+                    raise DuplicateKeyError("E11000 duplicate key error index: {} dup key: {}".format(
+                        [f for f, _ in self.fields], unique_key))
+
+    def add(self, key, doc):
+        for k in self._keys(doc, self._parts[0]):
+            if k not in self._entries:
+                self._sorted = None
+            self._entries[k].add(key)
+        if self.unique:
+            for unique_key in self._unique_keys(doc):
+                self._unique_entries[unique_key] = key
+
+    def remove(self, key, doc):
+        for k in self._keys(doc, self._parts[0]):
+            ids = self._entries.get(k)
+            if ids is not None:
+                ids.discard(key)
+                if not ids:
+                    del self._entries[k]
+                    self._sorted = None
+        if self.unique:
+            for unique_key in self._unique_keys(doc):
+                if self._unique_entries.get(unique_key) == key:
+                    del self._unique_entries[unique_key]
+
+    def lookup(self, condition):
+        """
+        Returns the frozen _ids of the documents that can match condition on
+        the first field, or None if the index can't be used for condition.
+        """
+        if not (isinstance(condition, dict) and condition and
+                all(k.startswith("$") for k in condition)):
+            return self._equal(condition)
+
+        best = None
+        if "$eq" in condition:
+            best = self._equal(condition["$eq"])
+        if "$in" in condition:
+            ids = set()
+            for value in condition["$in"]:
+                found = self._equal(value)
+                if found is None:
+                    ids = None
+                    break
+                ids |= found
+            best = _smallest(best, ids)
+        bounds = {op: v for op, v in condition.items() if op in ("$gt", "$gte", "$lt", "$lte")}
+        if bounds:
+            best = _smallest(best, self._range(bounds))
+        return best
+
+    def _equal(self, value):
+        # null matches missing fields, and regexes match strings
+        if value is None or not isinstance(value, (dict, list, bool) + _SCALARS):
+            return None
+        ids = set(self._entries.get(_freeze(value), ()))
+        # mongomock matches booleans and numbers like Python does
+        if isinstance(value, (int, float)) and value in (0, 1):
+            other = int(value) if isinstance(value, bool) else bool(value)
+            ids |= self._entries.get(_freeze(other), set())
+        return ids
+
+    def _range(self, bounds):
+        ranks = {_rank(v) for v in bounds.values()}
+        if len(ranks) != 1 or not all(isinstance(v, _SCALARS) and not isinstance(v, bool)
+                                      for v in bounds.values()):
+            return None
+        rank = ranks.pop()
+        if self._sorted is None:
+            self._sorted = sorted((_rank(k), k) for k in self._entries if isinstance(k, _SCALARS))
+        # values of other types never match comparisons, as in MongoDB
+        start = bisect_left(self._sorted, (rank,))
+        stop = bisect_left(self._sorted, (rank + 1,))
+        if "$gte" in bounds:
+            start = max(start, bisect_left(self._sorted, (rank, bounds["$gte"]), start, stop))
+        if "$gt" in bounds:
+            start = max(start, bisect_right(self._sorted, (rank, bounds["$gt"]), start, stop))
+        if "$lte" in bounds:
+            stop = min(stop, bisect_right(self._sorted, (rank, bounds["$lte"]), start, stop))
+        if "$lt" in bounds:
+            stop = min(stop, bisect_left(self._sorted, (rank, bounds["$lt"]), start, stop))
+        ids = set()
+        for _, k in self._sorted[start:stop]:
+            ids |= self._entries[k]
+        return ids
+
+
+# values that can be compared and kept in the sorted part of an index,
+# booleans are frozen to tuples and are never in it
+_SCALARS = (int, float, str, datetime, ObjectId)
+
+
+def _rank(value):
+    """
+    Rank of the type of value in the MongoDB sort order
+    """
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, dict):
+        return 3
+    if isinstance(value, list):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def _smallest(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a if len(a) <= len(b) else b
+
+
+def _freeze(value):
+    """
+    Hashable version of a value, which is equal for equal values
+    """
+    if isinstance(value, bool):
+        # True == 1 in Python but not in MongoDB
+        return ("__bool__", value)
+    if isinstance(value, dict):
+        return ("__dict__", tuple((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return ("__list__", tuple(_freeze(v) for v in value))
+    return value
+
+
+def _copy(value):
+    """
+    Faster deepcopy for documents
+    """
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+def _path_values(value, parts, expand=True):
+    """
+    Yields the values at a dot-notation path, following arrays of
+    subdocuments. If expand is True, the elements of arrays at the end of
+    the path are yielded as well as the arrays.
+    """
+    if not parts:
+        yield value
+        if expand and isinstance(value, list):
+            yield from value
+    elif isinstance(value, dict):
+        if parts[0] in value:
+            yield from _path_values(value[parts[0]], parts[1:], expand)
+    elif isinstance(value, list):
+        if parts[0].isdigit() and int(parts[0]) < len(value):
+            yield from _path_values(value[int(parts[0])], parts[1:], expand)
+        for v in value:
+            if isinstance(v, dict):
+                yield from _path_values(v, parts, expand)
+
+
+def _get(doc, path, default=None):
+    """
+    Value at a dot-notation path through subdocuments
+    """
+    for part in path.split("."):
+        if isinstance(doc, dict) and part in doc:
+            doc = doc[part]
+        else:
+            return default
+    return doc
+
+
+def _sort_spec(key_or_list, direction=None):
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or ASCENDING)]
+    return list(key_or_list)
+
+
+def sort_value(value, direction):
+    """
+    Key of a value in the MongoDB sort order, comparable across types.
+    Arrays sort by their smallest element ascending and largest descending.
+    """
+    if isinstance(value, list) and value:
+        keys = [sort_value(v, direction) for v in value]
+        return min(keys) if direction == ASCENDING else max(keys)
+    if isinstance(value, (dict, list)):
+        return (_rank(value), _freeze(value))
+    return (_rank(value), value) if value is not None else (0,)
+
+
+def _sort(docs, spec, limit=None):
+    """
+    Sorts documents by a list of (field, direction) pairs. If limit is given,
+    only the first limit documents are returned.
+    """
+    if len(spec) == 1:
+        (field, direction), = spec
+        key = lambda d: sort_value(_get(d, field), direction)
+        if limit is not None:
+            select = heapq.nsmallest if direction == ASCENDING else heapq.nlargest
+            return iter(select(limit, docs, key=key))
+        return iter(sorted(docs, key=key, reverse=direction == DESCENDING))
+
+    docs = list(docs)
+    for field, direction in reversed(spec):
+        docs.sort(key=lambda d: sort_value(_get(d, field), direction),
+                  reverse=direction == DESCENDING)
+    return iter(docs[:limit])
+
+
+def _project(doc, projection):
+    """
+    Copy of a document with a MongoDB projection applied
+    """
+    if not projection:
+        return _copy(doc)
+    include_id = projection.get("_id", True)
+    fields = [k for k in projection if k != "_id"]
+    if any(projection[k] for k in fields):
+        out = {"_id": doc["_id"]} if include_id and "_id" in doc else {}
+        for field in fields:
+            spec = projection[field]
+            if isinstance(spec, (str, dict)):
+                # computed field, e.g. {"c.d": "$e"}
+                value = _expression(doc, spec)
+                if value is not _MISSING:
+                    _set(out, field, _copy(value))
+            else:
+                _include(doc, out, field.split("."))
+        return out
+
+    out = _copy(doc)
+    for field in fields:
+        _exclude(out, field.split("."))
+    if not include_id:
+        out.pop("_id", None)
+    return out
+
+
+def _filter(docs, criteria):
+    return (d for d in docs if filter_applies(criteria, d))
+
+
+def _include(src, dst, parts):
+    key = parts[0]
+    if key not in src:
+        return
+    value = src[key]
+    if len(parts) == 1:
+        dst[key] = _copy(value)
+    elif isinstance(value, dict):
+        _include(value, dst.setdefault(key, {}), parts[1:])
+    elif isinstance(value, list):
+        subdocs = [v for v in value if isinstance(v, dict)]
+        out = dst.setdefault(key, [{} for _ in subdocs])
+        for s, d in zip(subdocs, out):
+            _include(s, d, parts[1:])
+
+
+def _exclude(doc, parts):
+    if isinstance(doc, list):
+        for d in doc:
+            _exclude(d, parts)
+    elif isinstance(doc, dict) and parts[0] in doc:
+        if len(parts) == 1:
+            del doc[parts[0]]
+        else:
+            _exclude(doc[parts[0]], parts[1:])
+
+
+def _expression(doc, expression):
+    """
+    Evaluates a field path like "$a.b", "$$ROOT", a document of expressions
+    or a constant. Fields that are missing are left out of documents.
+    """
+    if isinstance(expression, str) and expression.startswith("$"):
+        if expression == "$$ROOT":
+            return doc
+        return _get(doc, expression[1:], _MISSING)
+    if isinstance(expression, dict):
+        out = {}
+        for k, v in expression.items():
+            value = _expression(doc, v)
+            if value is not _MISSING:
+                out[k] = value
+        return out
+    return expression
+
+
+_MISSING = object()
+
+
+def _group(docs, spec):
+    """
+    $group stage with the $push, $addToSet, $first, $last, $sum, $min, $max
+    and $avg accumulators, grouping with a hash table
+    """
+    accumulators = {k: next(iter(v.items())) for k, v in spec.items() if k != "_id"}
+    groups = {}
+    for doc in docs:
+        group_id = _expression(doc, spec["_id"])
+        group_id = None if group_id is _MISSING else group_id
+        frozen = _freeze(group_id)
+        group = groups.get(frozen)
+        if group is None:
+            group = groups[frozen] = {"_id": group_id}
+            for field, (op, _) in accumulators.items():
+                group[field] = [] if op in ("$push", "$addToSet") else _MISSING
+            group["__count__"] = defaultdict(int)
+        for field, (op, expression) in accumulators.items():
+            value = _expression(doc, expression)
+            if value is _MISSING and op != "$sum":
+                continue
+            current = group[field]
+            if op == "$push":
+                current.append(_copy(value))
+            elif op == "$addToSet":
+                if value not in current:
+                    current.append(_copy(value))
+            elif op == "$first":
+                if current is _MISSING:
+                    group[field] = _copy(value)
+            elif op == "$last":
+                group[field] = _copy(value)
+            elif op in ("$sum", "$avg"):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    group[field] = (0 if current is _MISSING else current) + value
+                    group["__count__"][field] += 1
+                elif op == "$sum" and current is _MISSING:
+                    group[field] = 0
+            elif op in ("$min", "$max"):
+                smaller = current is not _MISSING and (
+                    sort_value(value, ASCENDING) < sort_value(current, ASCENDING))
+                if current is _MISSING or smaller == (op == "$min"):
+                    group[field] = _copy(value)
+            else:
+                raise NotImplementedError("{} is not supported by MemoryCollection".format(op))
+
+    for group in groups.values():
+        counts = group.pop("__count__")
+        for field, (op, _) in accumulators.items():
+            if op == "$avg" and group[field] is not _MISSING:
+                group[field] /= counts[field]
+            if group[field] is _MISSING:
+                group[field] = None
+        yield group
+
+
+def _unwind(docs, spec):
+    path = spec if isinstance(spec, str) else spec["path"]
+    for doc in docs:
+        values = _get(doc, path[1:])
+        if isinstance(values, list):
+            for value in values:
+                out = _copy(doc)
+                _set(out, path[1:], value)
+                yield out
+        elif values is not None:
+            yield doc
+
+
+def _set(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
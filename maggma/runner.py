@@ -1,25 +1,217 @@
 import logging
 import multiprocessing
 from collections import defaultdict
-from itertools import cycle
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+from itertools import chain, count, islice
 import abc
-
-from multiprocessing import Pool
+import copy
+import cProfile
+import heapq
+import pstats
+import threading
+import time
+
+from queue import Queue
+from threading import Thread
 from monty.json import MSONable
 from maggma.helpers import get_mpi
 from maggma.utils import grouper, reload_msonable_object
 
 
+class ProcessorMetrics(object):
+    """
+    Timings, counts and queue depths of one build. The process_item time is
+    the time spent processing on the workers, the other stages are timed
+    where they run.
+    """
+
+    def __init__(self, num_workers=1, n_slowest=5):
+        """
+        Args:
+            num_workers (int): number of workers processing the items
+            n_slowest (int): number of slowest items to keep
+        """
+        self.num_workers = num_workers
+        self.n_slowest = n_slowest
+        self.stages = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.profile = None
+        # number of samples, sum and maximum of the queue depth
+        self._queue = [0, 0, 0]
+        # min-heap of (seconds, tie breaker, item)
+        self._slowest = []
+        self._tie = count()
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._end = None
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Context manager adding the time spent in it to a stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[stage] += elapsed
+
+    def timed_iter(self, items, stage="get_items"):
+        """
+        Iterates over items, counting them and adding the time spent waiting
+        for them to a stage
+        """
+        iterator = iter(items)
+        while True:
+            with self.timer(stage):
+                item = next(iterator, _DONE)
+            if item is _DONE:
+                return
+            with self._lock:
+                self.counts["read"] += 1
+            yield item
+
+    def record(self, seconds, n_items=1, item=None, stats=None):
+        """
+        Records the processing of n_items items on a worker
+
+        Args:
+            seconds (float): processing time
+            n_items (int): number of items processed
+            item: description of the item, for the slowest items
+            stats (dict): profile of the processing, from _timed_call
+        """
+        with self._lock:
+            self.stages["process_item"] += seconds
+            self.counts["processed"] += n_items
+            if item is None:
+                item = "batch of {} items".format(n_items)
+            entry = (seconds, next(self._tie), item)
+            if len(self._slowest) < self.n_slowest:
+                heapq.heappush(self._slowest, entry)
+            elif self._slowest and seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+            if stats is not None:
+                if self.profile is None:
+                    self.profile = pstats.Stats(_Profile(stats))
+                else:
+                    self.profile.add(_Profile(stats))
+
+    def sample_queue(self, depth):
+        """
+        Records the number of chunks or batches waiting in a queue
+        """
+        with self._lock:
+            self._queue[0] += 1
+            self._queue[1] += depth
+            self._queue[2] = max(self._queue[2], depth)
+
+    def stop(self):
+        self._end = time.perf_counter()
+
+    def report(self):
+        """
+        Returns:
+            dict with the wall time, the time of each stage, the item counts,
+            the throughput, the queue depth, the worker utilization, the
+            slowest items and, if profiled, the functions with the most
+            cumulative time
+        """
+        wall_time = (self._end or time.perf_counter()) - self._start
+        # a consistent snapshot, the metrics may still be recorded by other threads
+        with self._lock:
+            processed = self.counts["processed"]
+            process_time = self.stages["process_item"]
+            stages, counts = dict(self.stages), dict(self.counts)
+            samples, total, maximum = self._queue
+            slowest = sorted(self._slowest, reverse=True)
+        report = {
+            "wall_time": wall_time,
+            "stages": stages,
+            "items": counts,
+            "items_per_second": processed / wall_time if wall_time else 0.0,
+            "queue_depth": {"mean": total / samples, "max": maximum} if samples else None,
+            "worker_utilization": (process_time / (wall_time * self.num_workers)
+                                   if wall_time else 0.0),
+            "slowest_items": [{"item": item, "seconds": seconds}
+                              for seconds, _, item in slowest],
+        }
+        if self.profile is not None:
+            self.profile.sort_stats("cumulative")
+            report["profile"] = [
+                {"function": pstats.func_std_string(func), "calls": stat[1], "cumtime": stat[3]}
+                for func, stat in sorted(self.profile.stats.items(), key=lambda f: -f[1][3])[:20]]
+        return report
+
+
+_DONE = object()
+
+
+class _Profile(object):
+    """
+    Profile stats from another process, in the form pstats.Stats loads
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def _describe(item):
+    """
+    Short description of an item for the slowest items
+    """
+    if isinstance(item, dict):
+        for key in ("task_id", "_id"):
+            if key in item:
+                return "{}={}".format(key, item[key])
+        return "dict with keys {}".format(", ".join(map(str, islice(item, 5))))
+    if isinstance(item, list):
+        return "batch of {} items".format(len(item))
+    description = repr(item)
+    return description if len(description) <= 100 else description[:97] + "..."
+
+
+def _timed_call(func, item, profile=False):
+    """
+    Calls func(item) on a worker, optionally under cProfile
+
+    Returns:
+        (result, seconds, description of item, profile stats or None)
+    """
+    profiler = cProfile.Profile() if profile else None
+    start = time.perf_counter()
+    result = profiler.runcall(func, item) if profiler else func(item)
+    elapsed = time.perf_counter() - start
+    stats = None
+    if profiler:
+        profiler.create_stats()
+        stats = profiler.stats
+    return result, elapsed, _describe(item), stats
+
+
 class BaseProcessor(MSONable, metaclass=abc.ABCMeta):
 
-    def __init__(self, builders):
+    def __init__(self, builders, profile=False):
         """
         Initialize with a list of builders
 
         Args:
             builders(list): list of builders
+            profile (bool): profile process_item on the workers with cProfile,
+                the merged profile is in the metrics report
         """
         self.builders = builders
+        self.profile = profile
+        # ProcessorMetrics of each builder id
+        self.metrics = {}
 
         self.logger = logging.getLogger(type(self).__name__)
         self.logger.addHandler(logging.NullHandler())
@@ -36,6 +228,17 @@ class BaseProcessor(MSONable, metaclass=abc.ABCMeta):
         """
         pass
 
+    def _start_metrics(self, builder_id, num_workers=1):
+        self.metrics[builder_id] = ProcessorMetrics(num_workers)
+        return self.metrics[builder_id]
+
+    def report(self):
+        """
+        Returns:
+            dict of the metrics report of each builder built by this processor
+        """
+        return {builder_id: metrics.report() for builder_id, metrics in self.metrics.items()}
+
 
 class SerialProcessor(BaseProcessor):
     """
@@ -51,24 +254,48 @@ class SerialProcessor(BaseProcessor):
         """
         builder = self.builders[builder_id]
         chunk_size = builder.chunk_size
+        metrics = self._start_metrics(builder_id)
 
         # establish connection to the sources and targets
         builder.connect()
 
-        cursor = builder.get_items()
+        with metrics.timer("get_items"):
+            cursor = builder.get_items()
+
+        for chunk in grouper(metrics.timed_iter(cursor), chunk_size):
+            items = [item for item in chunk if item is not None]
+            self.logger.info("Processing batch of {} items".format(len(items)))
+            processed_items = []
+            for item in items:
+                result, elapsed, description, stats = _timed_call(builder.process_item, item, self.profile)
+                metrics.record(elapsed, item=description, stats=stats)
+                processed_items.append(result)
+            with metrics.timer("update_targets"):
+                builder.update_targets(processed_items)
 
-        for chunk in grouper(cursor, chunk_size):
-            self.logger.info("Processing batch of {} items".format(chunk_size))
-            processed_items = [builder.process_item(
-                item) for item in filter(None, chunk)]
-            builder.update_targets(processed_items)
+        with metrics.timer("finalize"):
+            builder.finalize(cursor)
+        metrics.stop()
 
 
 class MPIProcessor(BaseProcessor):
 
-    def __init__(self, builders):
+    WORK_TAG = 1
+    RESULT_TAG = 2
+
+    def __init__(self, builders, batch_size=1, max_batches=2, profile=False):
+        """
+        Args:
+            builders(list): list of builders
+            batch_size (int): number of items sent to a worker in one message
+            max_batches (int): number of batches each worker can have in flight
+            profile (bool): profile the processing on the workers
+        """
         (self.comm, self.rank, self.size) = get_mpi()
-        super(MPIProcessor, self).__init__(builders)
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.worker_stats = {}
+        super(MPIProcessor, self).__init__(builders, profile=profile)
 
     def process(self, builder_id):
         """
@@ -86,103 +313,290 @@ class MPIProcessor(BaseProcessor):
             self.worker()
 
     def master(self, builder_id):
+        """
+        Distribute batches of items to the workers. Every worker starts with
+        max_batches batches and gets a new one whenever it sends back the
+        results of a batch, so faster workers take on more of the work.
+
+        Args:
+            builder_id (int): the index of the builder in the builders list
+        """
+        from mpi4py import MPI
+
         self.logger.info(
             "Building with MPI. {} workers in the pool.".format(self.size - 1))
 
         builder = self.builders[builder_id]
         chunk_size = builder.chunk_size
+        metrics = self._start_metrics(builder_id, self.size - 1)
 
-        # establish connection to the sources and targets
-        builder.connect()
+        workers = range(1, self.size)
+        in_flight = {wid: 0 for wid in workers}
+        self.worker_stats = {wid: {"items": 0, "batches": 0, "time": 0.0} for wid in workers}
+        requests = []
 
-        # cycle through the workers, there could be less workers than the items
-        # to process
-        worker_id = cycle(range(1, self.size))
-
-        n = 0
-        workers = []
-        # distribute the items to process (in chunks of size chunk_size)
-        cursor = builder.get_items()
-        for item in cursor:
-            if n % chunk_size == 0:
-                self.logger.info(
-                    "processing chunks of size {}".format(chunk_size))
-                processed_chunk = self._process_chunk(chunk_size, workers)
-                builder.update_targets(processed_chunk)
-            packet = (builder_id, item)
-            wid = next(worker_id)
-            workers.append(wid)
-            self.comm.send(packet, dest=wid)
-            n += 1
-
-        # in case the total number of items is not divisible by chunk_size,
-        # process the leftovers.
-        if workers:
-            processed_chunk = self._process_chunk(chunk_size, workers)
-            builder.update_targets(processed_chunk)
-
-        # kill workers
-        for _ in range(self.size - 1):
-            self.comm.send(None, dest=next(worker_id))
+        def send_batch(wid):
+            batch = next(batches, None)
+            if batch is None:
+                return
+            packet = (builder_id, [item for item in batch if item is not None])
+            requests.append(self.comm.isend(packet, dest=wid, tag=self.WORK_TAG))
+            in_flight[wid] += 1
+
+        try:
+            # establish connection to the sources and targets
+            builder.connect()
+
+            with metrics.timer("get_items"):
+                cursor = builder.get_items()
+            batches = grouper(metrics.timed_iter(cursor), self.batch_size)
+
+            for _ in range(self.max_batches):
+                for wid in workers:
+                    send_batch(wid)
+
+            processed_chunk = []
+            while any(in_flight.values()):
+                wid, processed_items, elapsed, stats = self.comm.recv(source=MPI.ANY_SOURCE,
+                                                                      tag=self.RESULT_TAG)
+                metrics.sample_queue(sum(in_flight.values()))
+                in_flight[wid] -= 1
+                if isinstance(processed_items, Exception):
+                    raise RuntimeError("processing failed on rank {}: {}".format(
+                        wid, processed_items))
+                self.worker_stats[wid]["items"] += len(processed_items)
+                self.worker_stats[wid]["batches"] += 1
+                self.worker_stats[wid]["time"] += elapsed
+                metrics.record(elapsed, len(processed_items), stats=stats)
+
+                send_batch(wid)
+                requests = [r for r in requests if not r.Test()]
+
+                processed_chunk.extend(processed_items)
+                while len(processed_chunk) >= chunk_size:
+                    self.logger.info("processing chunks of size {}".format(chunk_size))
+                    with metrics.timer("update_targets"):
+                        builder.update_targets(processed_chunk[:chunk_size])
+                    processed_chunk = processed_chunk[chunk_size:]
+
+            # in case the total number of items is not divisible by chunk_size,
+            # process the leftovers.
+            if processed_chunk:
+                with metrics.timer("update_targets"):
+                    builder.update_targets(processed_chunk)
+        finally:
+            self._stop_workers(in_flight, requests)
+
+        for wid, stats in self.worker_stats.items():
+            rate = stats["items"] / stats["time"] if stats["time"] else 0.0
+            self.logger.info("rank {}: {} items in {} batches, {:.1f} items/s".format(
+                wid, stats["items"], stats["batches"], rate))
 
         # finalize
-        builder.finalize(cursor)
+        with metrics.timer("finalize"):
+            builder.finalize(cursor)
+        metrics.stop()
 
-    def _process_chunk(self, chunk_size, workers):
+    def _stop_workers(self, in_flight, requests):
         """
-        process chunk_size items.
+        Kill the workers. If the build failed, the results of the batches still
+        in flight are received and dropped first, so that no worker is left
+        blocking on a send or a receive.
 
         Args:
-            chunk_size (int):
-            workers (list): lis tpf worker ids
-
-        Returns:
-            list : list of processed items
+            in_flight (dict): number of batches in flight for each worker rank
+            requests (list): pending requests of the batches sent
         """
-        status = []
-        processed_chunk = []
-        self.logger.info("{} items sent for processing".format(chunk_size))
+        from mpi4py import MPI
 
-        # get processed item from the workers
-        while workers:
-            try:
-                processed_item = self.comm.recv()
-                status.append(True)
-                processed_chunk.append(processed_item)
-            except:
-                raise
-            workers.pop()
-
-        if status:
-            if not all(status):
-                raise RuntimeError("processing failed")
-
-        return processed_chunk
+        while any(in_flight.values()):
+            wid = self.comm.recv(source=MPI.ANY_SOURCE, tag=self.RESULT_TAG)[0]
+            in_flight[wid] -= 1
+        MPI.Request.Waitall(requests)
+        for wid in in_flight:
+            self.comm.send(None, dest=wid, tag=self.WORK_TAG)
 
     def worker(self):
         """
         Where shit gets done!
-        Call the builder's process_item method and send back the processed item
+        Call the builder's process_items method on every batch and send back the
+        processed items along with the processing time. The results are sent
+        without blocking so the next batch is processed in the meantime.
+        """
+        request = None
+        while True:
+            packet = self.comm.recv(source=0, tag=self.WORK_TAG)
+            if packet is None:
+                break
+            builder_id, items = packet
+            start = time.perf_counter()
+            stats = None
+            try:
+                processed_items, _, _, stats = _timed_call(
+                    self.builders[builder_id].process_items, items, self.profile)
+            except Exception as exc:
+                self.logger.exception("processing failed")
+                processed_items = exc
+            result = (self.rank, processed_items, time.perf_counter() - start, stats)
+            if request is not None:
+                request.wait()
+            request = self.comm.isend(result, dest=0, tag=self.RESULT_TAG)
+        if request is not None:
+            request.wait()
+
+
+class MPIScatterProcessor(BaseProcessor):
+    """
+    Processor using MPI collective communication. The items are read on rank 0
+    in rounds of batch_size items per rank, scattered to all ranks, rank 0
+    included, and the processed items are gathered back on rank 0 to update the
+    targets. Works best when all items take about the same time to process.
+    """
+
+    def __init__(self, builders, batch_size=1, profile=False):
+        """
+        Args:
+            builders(list): list of builders
+            batch_size (int): number of items each rank processes per round
+            profile (bool): profile the processing on every rank
+        """
+        (self.comm, self.rank, self.size) = get_mpi()
+        self.batch_size = batch_size
+        super(MPIScatterProcessor, self).__init__(builders, profile=profile)
+
+    def process(self, builder_id):
+        """
+        Run the builder using MPI scatter and gather.
 
         Args:
-            comm (MPI.comm): mpi communicator, must be given when using MPI.
+            builder_id (int): the index of the builder in the builders list
         """
+        builder = self.builders[builder_id]
+        chunk_size = builder.chunk_size
+
+        cursor = None
+        batches = None
+        metrics = None
+        # error on rank 0, scattered to every rank to stop the build
+        error = None
+        if self.rank == 0:
+            self.logger.info("Building with MPI scatter/gather on {} ranks.".format(self.size))
+            metrics = self._start_metrics(builder_id, self.size)
+            try:
+                # establish connection to the sources and targets
+                builder.connect()
+                with metrics.timer("get_items"):
+                    cursor = builder.get_items()
+                batches = grouper(metrics.timed_iter(cursor), self.batch_size)
+            except Exception as exc:
+                error = exc
+
+        processed_chunk = []
         while True:
-            packet = self.comm.recv(source=0)
-            if packet is None:
+            parts = None
+            if self.rank == 0 and error is None:
+                try:
+                    parts = [[item for item in batch if item is not None]
+                             for batch in islice(batches, self.size)]
+                except Exception as exc:
+                    error = exc
+                else:
+                    if parts:
+                        parts.extend([] for _ in range(self.size - len(parts)))
+                    else:
+                        # no more items, tell every rank to stop
+                        parts = [None] * self.size
+            if self.rank == 0 and error is not None:
+                parts = [RuntimeError("build failed on rank 0: {}".format(error))] * self.size
+
+            items = self.comm.scatter(parts, root=0)
+            if items is None:
                 break
-            builder_id, item = packet
-            processed_item = self.builders[builder_id].process_item(item)
-            self.comm.ssend(processed_item, 0)
+            if isinstance(items, Exception):
+                raise error if self.rank == 0 else items
+            try:
+                processed_items, elapsed, _, stats = _timed_call(builder.process_items, items,
+                                                                 self.profile)
+            except Exception as exc:
+                self.logger.exception("processing failed")
+                processed_items, elapsed, stats = exc, 0.0, None
+            gathered = self.comm.gather((processed_items, elapsed, stats), root=0)
+
+            if self.rank == 0:
+                try:
+                    for rank, (processed_items, elapsed, stats) in enumerate(gathered):
+                        if isinstance(processed_items, Exception):
+                            raise RuntimeError("processing failed on rank {}: {}".format(
+                                rank, processed_items))
+                        if processed_items:
+                            metrics.record(elapsed, len(processed_items), stats=stats)
+                        processed_chunk.extend(processed_items)
+                    while len(processed_chunk) >= chunk_size:
+                        self.logger.info("processing chunks of size {}".format(chunk_size))
+                        with metrics.timer("update_targets"):
+                            builder.update_targets(processed_chunk[:chunk_size])
+                        processed_chunk = processed_chunk[chunk_size:]
+                except Exception as exc:
+                    error = exc
+
+        if self.rank == 0:
+            # in case the total number of items is not divisible by chunk_size,
+            # process the leftovers.
+            if processed_chunk:
+                with metrics.timer("update_targets"):
+                    builder.update_targets(processed_chunk)
+            with metrics.timer("finalize"):
+                builder.finalize(cursor)
+            metrics.stop()
+
+
+# start method of the pools created from threads, forking a multi-threaded
+# process can deadlock the child on a lock held by another thread
+_THREAD_SAFE_START_METHOD = ("forkserver" if "forkserver" in multiprocessing.get_all_start_methods()
+                             else "spawn")
+
+# builder used by the pool workers in batched mode, set once per worker process
+_worker_builder = None
+_worker_profile = False
+
+
+def _init_worker(builder, profile=False):
+    global _worker_builder, _worker_profile
+    _worker_builder = builder
+    _worker_profile = profile
+
+
+def _process_batch(items):
+    return _timed_call(_worker_builder.process_items, items, _worker_profile)
 
 
 class MultiprocProcessor(BaseProcessor):
 
-    def __init__(self, builders, num_workers):
+    def __init__(self, builders, num_workers, pipelined=False, max_chunks=2, batch_size=None,
+                 profile=False, start_method=None):
+        """
+        Args:
+            builders(list): list of builders
+            num_workers (int): number of processes in the pool
+            pipelined (bool): if True, reading the items, processing them and
+                updating the targets run concurrently as separate stages
+            max_chunks (int): maximum number of processed chunks waiting to be
+                written to the targets in pipelined mode
+            batch_size (int): if set, the items are sent to the workers in
+                batches of this size and processed with Builder.process_items.
+                The workers then stay alive for the whole build.
+            profile (bool): profile the processing in the worker processes
+            start_method (str): multiprocessing start method of the pool, e.g.
+                "fork", "spawn" or "forkserver". Defaults to the platform default.
+        """
         # multiprocessing only if mpi is not used, no mixing
         self.num_workers = (num_workers if num_workers > 0
                             else multiprocessing.cpu_count() - 1)
-        super(MultiprocProcessor, self).__init__(builders)
+        self.pipelined = pipelined
+        self.max_chunks = max_chunks
+        self.batch_size = batch_size
+        self.start_method = start_method
+        super(MultiprocProcessor, self).__init__(builders, profile=profile)
         self.logger.info("Building with multiprocessing, {} workers in the pool"
                          .format(self.num_workers))
 
@@ -197,19 +611,129 @@ class MultiprocProcessor(BaseProcessor):
         builder = self.builders[builder_id]
         chunk_size = builder.chunk_size
         processing_builder = reload_msonable_object(builder)
+        metrics = self._start_metrics(builder_id, self.num_workers)
+
+        # establish connection to the sources and targets
+        builder.connect()
+
+        with metrics.timer("get_items"):
+            cursor = builder.get_items()
+        items = metrics.timed_iter(cursor)
+        if self.pipelined:
+            self._process_pipelined(builder, processing_builder, items, metrics)
+        elif self.batch_size:
+            with self._pool(self.num_workers, initializer=_init_worker,
+                      initargs=(processing_builder, self.profile)) as process_pool:
+                batches = process_pool.imap(_process_batch, self._batches(items))
+                for chunk in grouper(self._recorded(batches, metrics, batched=True), chunk_size,
+                                     fillvalue=_DONE):
+                    processed_items = [item for item in chunk if item is not _DONE]
+                    self.logger.info("Completed {} items".format(len(processed_items)))
+                    with metrics.timer("update_targets"):
+                        builder.update_targets(processed_items)
+        else:
+            process_item = partial(_timed_call, processing_builder.process_item, profile=self.profile)
+            with self._pool(self.num_workers, maxtasksperchild=chunk_size) as process_pool:
+                results = process_pool.imap(process_item, items)
+                for chunk in grouper(self._recorded(results, metrics), chunk_size, fillvalue=_DONE):
+                    processed_items = [item for item in chunk if item is not _DONE]
+                    self.logger.info("Completed {} items".format(len(processed_items)))
+                    with metrics.timer("update_targets"):
+                        builder.update_targets(processed_items)
+
+        with metrics.timer("finalize"):
+            builder.finalize(cursor)
+        metrics.stop()
+
+    def _pool(self, processes, **kwargs):
+        """
+        Process pool using the start method of this processor
+        """
+        return multiprocessing.get_context(self.start_method).Pool(processes, **kwargs)
+
+    @staticmethod
+    def _recorded(results, metrics, batched=False):
+        """
+        Records the timings of results from _timed_call and yields the
+        processed items
+        """
+        for result, elapsed, description, stats in results:
+            if batched:
+                metrics.record(elapsed, len(result), stats=stats)
+                yield from result
+            else:
+                metrics.record(elapsed, item=description, stats=stats)
+                yield result
+
+    def _batches(self, items):
+        """
+        Split the items into lists of batch_size items
+        """
+        for batch in grouper(items, self.batch_size):
+            yield [item for item in batch if item is not None]
 
-        process_pool = Pool(self.num_workers, maxtasksperchild=chunk_size)
-        cursor = builder.get_items()
-        for items in grouper(process_pool.imap(processing_builder.process_item, cursor), chunk_size):
-            self.logger.info("Completed {} items".format(chunk_size))
-            builder.update_targets(items)
+    def _process_pipelined(self, builder, processing_builder, cursor, metrics):
+        """
+        Read, process and write chunks concurrently: the items are read in the
+        calling thread, processed asynchronously in the pool and written to the
+        targets by a writer thread. At most max_chunks processed chunks wait for
+        the writer, which blocks the reader when the targets fall behind.
 
-        builder.finalize(cursor)
+        Args:
+            builder (Builder): the builder that updates the targets
+            processing_builder (Builder): the copy of the builder sent to the pool
+            cursor (iterable): items from builder.get_items()
+            metrics (ProcessorMetrics): metrics of the build
+        """
+        if self.batch_size:
+            pool_kwargs = dict(initializer=_init_worker, initargs=(processing_builder, self.profile))
+        else:
+            pool_kwargs = {}
+            process_item = partial(_timed_call, processing_builder.process_item, profile=self.profile)
+        pending = Queue(maxsize=self.max_chunks)
+        errors = []
+
+        def write():
+            while True:
+                result = pending.get()
+                if result is None:
+                    break
+                # keep draining the queue after a failure so the reader never blocks
+                if errors:
+                    continue
+                try:
+                    items = list(self._recorded(result.get(), metrics, batched=bool(self.batch_size)))
+                    self.logger.info("Completed {} items".format(len(items)))
+                    with metrics.timer("update_targets"):
+                        builder.update_targets(items)
+                except Exception as exc:
+                    errors.append(exc)
+
+        writer = Thread(target=write, daemon=True)
+        writer.start()
+        with self._pool(self.num_workers, **pool_kwargs) as process_pool:
+            try:
+                for chunk in grouper(cursor, builder.chunk_size):
+                    if errors:
+                        break
+                    items = [item for item in chunk if item is not None]
+                    if self.batch_size:
+                        result = process_pool.map_async(_process_batch, list(self._batches(items)))
+                    else:
+                        result = process_pool.map_async(process_item, items)
+                    metrics.sample_queue(pending.qsize())
+                    pending.put(result)
+            finally:
+                pending.put(None)
+                writer.join()
+
+        if errors:
+            raise errors[0]
 
 
 class Runner(MSONable):
 
-    def __init__(self, builders, num_workers=0):
+    def __init__(self, builders, num_workers=0, max_builders=1, processor=None):
         """
         Initialize with a list of builders
 
@@ -217,16 +741,23 @@ class Runner(MSONable):
             builders(list): list of builders
             num_workers (int): number of processes. Used only for multiprocessing.
                 Will be automatically set to (number of cpus - 1) if set to 0.
+            max_builders (int): maximum number of independent builders to run
+                concurrently. The worker processes are split evenly between the
+                builders running at the same time. Used only for multiprocessing.
             processor(BaseProcessor): set this if custom processor is needed(must
                 subclass BaseProcessor though)
         """
         self.builders = builders
         self.num_workers = num_workers
+        self.max_builders = max_builders
         self.logger = logging.getLogger(type(self).__name__)
         self.logger.addHandler(logging.NullHandler())
-        self.processor = MPIProcessor(builders) if self.use_mpi else MultiprocProcessor(builders, num_workers)
+        if processor is None:
+            processor = MPIProcessor(builders) if self.use_mpi else MultiprocProcessor(builders, num_workers)
+        self.processor = processor
         self.dependency_graph = self._get_builder_dependency_graph()
         self.has_run = []  # for bookkeeping builder runs
+        self.metrics = {}  # metrics report of each builder, after run
 
     @property
     def use_mpi(self):
@@ -262,6 +793,29 @@ class Runner(MSONable):
                             links_dict[i].append(j)
         return links_dict
 
+    def _get_builder_levels(self):
+        """
+        Group the builders into levels of the dependency graph. Builders in
+        the same level do not depend on each other and every builder only
+        depends on builders from earlier levels.
+
+        Returns:
+            list of lists of builder indices
+        """
+        levels = []
+        remaining = set(range(len(self.builders)))
+        done = set()
+        while remaining:
+            level = sorted(i for i in remaining
+                           if all(j in done for j in self.dependency_graph.get(i, [])))
+            if not level:
+                raise RuntimeError("Cyclic dependency between builders: {}".format(
+                    sorted(remaining)))
+            levels.append(level)
+            done.update(level)
+            remaining.difference_update(level)
+        return levels
+
     def run(self):
         """
         Does the following:
@@ -275,9 +829,97 @@ class Runner(MSONable):
                 - connect to the targets
                 - update targets
                 - finalize aka cleanup(close all connections etc)
+
+        With max_builders > 1 and multiprocessing, the builders are run level by
+        level and the builders within a level are run concurrently.
+
+        Returns:
+            dict of the metrics report of each builder, see ProcessorMetrics.report
+        """
+        if self.max_builders > 1 and isinstance(self.processor, MultiprocProcessor):
+            for level in self._get_builder_levels():
+                self._run_level(level)
+        else:
+            for i in range(len(self.builders)):
+                self._build_dependencies(i)
+
+        self.metrics = self.processor.report()
+        for builder_id, report in sorted(self.metrics.items()):
+            self.logger.info("builder {}: {} items in {:.2f}s ({:.1f} items/s), {}".format(
+                builder_id, report["items"].get("processed", 0), report["wall_time"],
+                report["items_per_second"],
+                ", ".join("{} {:.2f}s".format(k, v) for k, v in report["stages"].items())))
+        return self.metrics
+
+    def _run_level(self, level):
         """
-        for i in range(len(self.builders)):
-            self._build_dependencies(i)
+        Run the independent builders of a single dependency level concurrently.
+        Builders sharing a Store instance are run in separate rounds, one after
+        the other, since connecting or finalizing a builder closes its stores.
+
+        Args:
+            level (list): builder indices
+        """
+        level = [i for i in level if i not in self.has_run]
+        for builder_ids in self._split_shared_stores(level):
+            self._run_concurrently(builder_ids)
+
+    def _split_shared_stores(self, level):
+        """
+        Split a level into rounds of builders that do not share any Store
+        instance.
+
+        Args:
+            level (list): builder indices
+
+        Returns:
+            list of lists of builder indices
+        """
+        rounds = []
+        for i in level:
+            builder = self.builders[i]
+            stores = builder.sources + builder.targets + [builder.state_store]
+            store_ids = {id(s) for s in stores if s is not None}
+            for builder_ids, used in rounds:
+                if not store_ids & used:
+                    builder_ids.append(i)
+                    used.update(store_ids)
+                    break
+            else:
+                rounds.append(([i], store_ids))
+        return [builder_ids for builder_ids, _ in rounds]
+
+    def _run_concurrently(self, builder_ids):
+        """
+        Run builders concurrently, each from its own thread with its share of
+        the worker processes. The pools of the builders are not forked from the
+        threads, they use the forkserver or spawn start method.
+
+        Args:
+            builder_ids (list): builder indices
+        """
+        if not builder_ids:
+            return
+        n_concurrent = min(self.max_builders, len(builder_ids))
+        num_workers = max(1, self.processor.num_workers // n_concurrent)
+        self.logger.info("building {} concurrently, {} workers each".format(
+            builder_ids, num_workers))
+
+        def run_builder(builder_id):
+            processor = copy.copy(self.processor)
+            processor.num_workers = num_workers
+            if processor.start_method is None:
+                processor.start_method = _THREAD_SAFE_START_METHOD
+            self.logger.info("building: {}".format(builder_id))
+            start = datetime.utcnow()
+            processor.process(builder_id)
+            self._save_high_water_mark(builder_id, start)
+
+        with ThreadPoolExecutor(max_workers=n_concurrent) as executor:
+            futures = [executor.submit(run_builder, i) for i in builder_ids]
+            for i, future in zip(builder_ids, futures):
+                future.result()
+                self.has_run.append(i)
 
     def _build_dependencies(self, builder_id):
         """
@@ -306,4 +948,24 @@ class Runner(MSONable):
 
         """
         self.logger.info("building: {}".format(builder_id))
+        start = datetime.utcnow()
         self.processor.process(builder_id)
+        self._save_high_water_mark(builder_id, start)
+
+    def _save_high_water_mark(self, builder_id, start):
+        """
+        Record the start time of a successful build for incremental builds.
+        Only done once, on rank 0 when running with MPI.
+
+        Args:
+            builder_id (int): builder index
+            start (datetime): start time of the build
+        """
+        builder = self.builders[builder_id]
+        if builder.state_store is not None and getattr(self.processor, "rank", 0) == 0:
+            # the state store was closed by Builder.finalize
+            builder.state_store.connect()
+            try:
+                builder.save_high_water_mark(start)
+            finally:
+                builder.state_store.close()
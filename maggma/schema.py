@@ -1,5 +1,8 @@
 from abc import ABC, abstractmethod
-from jsonschema import validate, ValidationError
+import random
+import threading
+
+from jsonschema import validators
 import pydash
 
 """
@@ -15,7 +18,7 @@ class Schema(ABC):
     added to the Store will call .validate_doc() before being added.
     """
 
-    def init(self, strict=False):
+    def __init__(self, strict=False):
         """
         Args:
             strict (bool): Informs Store how to treat Schema: if
@@ -34,6 +37,14 @@ class Schema(ABC):
         """
         return NotImplementedError
 
+    def is_valid_many(self, docs):
+        """
+        Validates a batch of documents
+
+        Returns (list): is_valid for each document
+        """
+        return [self.is_valid(d) for d in docs]
+
 
 class StandardSchema(Schema):
     """
@@ -74,37 +85,133 @@ class StandardSchema(Schema):
         """
         return {}
 
+    def __init__(self, strict=False, msonable_sample_rate=1.0):
+        """
+        Args:
+            strict (bool): see Schema
+            msonable_sample_rate (float): fraction of the documents whose
+                msonable_keypaths are checked by reconstructing the objects,
+                which is often slower than the JSON validation
+        """
+        super(StandardSchema, self).__init__(strict=strict)
+        self.msonable_sample_rate = msonable_sample_rate
+
+    @property
+    def validator(self):
+        """
+        The compiled JSON schema validator. The schema is checked and
+        compiled once per Schema class and shared by its instances.
+        """
+        cls = type(self)
+        validator = _VALIDATORS.get(cls)
+        if validator is None:
+            with _VALIDATORS_LOCK:
+                validator = _VALIDATORS.get(cls)
+                if validator is None:
+                    schema = self.schema
+                    validator_cls = validators.validator_for(schema)
+                    validator_cls.check_schema(schema)
+                    validator = _VALIDATORS[cls] = validator_cls(schema)
+        return validator
+
+    @property
+    def mongo_schema(self):
+        """
+        The JSON schema translated for MongoDB's $jsonSchema validator,
+        which doesn't support some keywords and the "integer" type
+        """
+        return _to_mongo_schema(self.schema)
+
     def is_valid(self, doc):
+        return self.is_valid_many([doc])[0]
+
+    def is_valid_many(self, docs, json_schema=True):
+        """
+        Validates a batch of documents against the JSON schema and,
+        for a sample of them, the msonable_keypaths
 
-        # JSON validation
-        try:
-            validate(doc, schema=self.schema)
-            valid_schema = True
-        except ValidationError:
-            valid_schema = False
+        Args:
+            docs (list): documents to validate
+            json_schema (bool): whether to validate against the JSON
+                schema, False if the database validates it already
 
-        # MSONable validation
-        def _validate_doc_msonable(doc):
-            """
-            For every keypath, will return True if either
-            keypath does not exist, or keypath does exist
-            and a Python object can be reconstructed.
-            Otherwise will return False.
-            """
+        Returns (list): is_valid for each document
+        """
+        is_valid = self.validator.is_valid if json_schema else None
+        keypaths = list(self.msonable_keypaths.items())
+        rate = getattr(self, "msonable_sample_rate", 1.0)
 
-            for keypath, obj in self.msonable_keypaths.items():
+        results = []
+        for doc in docs:
+            valid = is_valid is None or is_valid(doc)
+            if valid and keypaths and (rate >= 1 or random.random() < rate):
+                valid = _validate_doc_msonable(doc, keypaths)
+            results.append(valid)
+        return results
 
-                dict_to_check = pydash.get(doc, keypath, None)
 
-                if dict_to_check:
-                    try:
-                        obj.from_dict(dict_to_check)
-                    except:
-                        return False
+# compiled validators of the StandardSchema classes
+_VALIDATORS = {}
+_VALIDATORS_LOCK = threading.Lock()
 
-            return True
 
-        valid_msonable = _validate_doc_msonable(doc)
+def _validate_doc_msonable(doc, keypaths):
+    """
+    For every keypath, will return True if either
+    keypath does not exist, or keypath does exist
+    and a Python object can be reconstructed.
+    Otherwise will return False.
+    """
+    for keypath, obj in keypaths:
 
-        return valid_schema and valid_msonable
+        dict_to_check = pydash.get(doc, keypath, None)
 
+        if dict_to_check:
+            try:
+                obj.from_dict(dict_to_check)
+            except:
+                return False
+
+    return True
+
+
+# keywords of JSON schema that $jsonSchema doesn't support
+_MONGO_UNSUPPORTED = {"$schema", "$id", "id", "default", "definitions", "format", "examples"}
+# keywords whose values are data rather than schemas
+_MONGO_DATA = {"enum", "required", "const"}
+# keywords whose values map names to schemas
+_MONGO_MAPPINGS = {"properties", "patternProperties", "dependencies"}
+_MONGO_BSON_TYPES = {"integer": ["int", "long"], "boolean": ["bool"], "number": ["number"],
+                     "string": ["string"], "object": ["object"], "array": ["array"],
+                     "null": ["null"]}
+
+
+def _to_mongo_schema(schema):
+    """
+    Translates a JSON schema for MongoDB's $jsonSchema validator. Keywords
+    that MongoDB ignores are removed and "integer" types become bsonTypes.
+    """
+    if isinstance(schema, list):
+        return [_to_mongo_schema(s) for s in schema]
+    if not isinstance(schema, dict):
+        return schema
+    if "$ref" in schema:
+        raise ValueError("$ref is not supported by MongoDB's $jsonSchema")
+
+    out = {}
+    for keyword, value in schema.items():
+        if keyword in _MONGO_UNSUPPORTED:
+            continue
+        if keyword == "type":
+            types = [value] if isinstance(value, str) else value
+            if "integer" in types:
+                out["bsonType"] = [b for t in types for b in _MONGO_BSON_TYPES[t]]
+            else:
+                out["type"] = value
+        elif keyword in _MONGO_DATA:
+            out[keyword] = value
+        elif keyword in _MONGO_MAPPINGS and isinstance(value, dict):
+            out[keyword] = {k: _to_mongo_schema(v) for k, v in value.items()}
+        else:
+            out[keyword] = _to_mongo_schema(value)
+    return out
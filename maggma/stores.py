@@ -1,18 +1,77 @@
 from abc import ABCMeta, abstractmethod
-from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from itertools import groupby, islice
+import gzip
 import json
+import logging
+import lzma
+import mmap
+import os
+import sqlite3
+import threading
+import zlib
 
 
 import mongomock
 import pymongo
 import gridfs
-from pymongo import MongoClient, DESCENDING
-from pydash import identity
+from bson import BSON, json_util
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from pymongo import DESCENDING, ReplaceOne
+from pymongo.errors import BulkWriteError
+from pydash import identity, get, has, set_
 
 from monty.json import MSONable, jsanitize, MontyDecoder
 from monty.io import zopen
 from monty.serialization import loadfn
-from maggma.utils import LU_KEY_ISOFORMAT
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from maggma.helpers import CLIENTS
+from maggma.memory_engine import (MemoryClient, _freeze, _path_values, _rank, filter_applies,
+                                  sort_value)
+from maggma.utils import LU_KEY_ISOFORMAT, content_hash, bson_sanitize, iter_json, \
+    iter_json_spans, prefetch_map
+
+
+# functions converting documents to BSON-compatible documents, see Store
+ENCODERS = {
+    "jsanitize": lambda d: jsanitize(d, allow_bson=True),
+    "fast": bson_sanitize,
+    "trusted": dict,
+}
+
+# compression codecs for GridFSStore files, name: (compress, decompress)
+COMPRESSORS = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "gzip": (gzip.compress, gzip.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+if lz4 is not None:
+    COMPRESSORS["lz4"] = (lz4.frame.compress, lz4.frame.decompress)
+if zstandard is not None:
+    COMPRESSORS["zstd"] = (lambda data: zstandard.ZstdCompressor().compress(data),
+                           lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+# MongoDB error codes
+NAMESPACE_NOT_FOUND = 26
+DOCUMENT_VALIDATION_FAILURE = 121
 
 
 class Store(MSONable, metaclass=ABCMeta):
@@ -21,18 +80,39 @@ class Store(MSONable, metaclass=ABCMeta):
     Defines the interface for all data going in and out of a Builder
     """
 
-    def __init__(self, key="task_id", lu_field='last_updated', lu_type="datetime"):
+    def __init__(self, key="task_id", lu_field='last_updated', lu_type="datetime",
+                 hash_field=None, encoder="jsanitize", lu_index=False):
         """
         Args:
             key (str): master key to index on
             lu_field (str): 'last updated' field name
             lu_type (tuple): the date/time format for the lu_field. Can be "datetime" or "isoformat"
+            hash_field (str): if set, a hash of the content of each document is
+                stored in this field and updates that do not change the content
+                are skipped, which keeps the lu_field of unchanged documents
+            encoder (str): how documents are made BSON-compatible before they
+                are written. "jsanitize" uses monty's jsanitize, "fast" uses
+                maggma.utils.bson_sanitize, which only converts values that are
+                not BSON types already, and "trusted" writes the documents as
+                they are, for documents that are known to be BSON-compatible
+            lu_index (bool): whether to ensure an index on the lu_field when
+                connecting, e.g. for target stores, which is skipped with a
+                warning if the index cannot be built
         """
+        if encoder not in ENCODERS:
+            raise ValueError("Unknown encoder {}, choose from {}".format(
+                encoder, ", ".join(ENCODERS)))
         self.key = key
         self.lu_field = lu_field
         self.lu_type = lu_type
+        self.hash_field = hash_field
+        self.encoder = encoder
+        self.lu_index = lu_index
+        self._last_updated = None
         self.lu_func = LU_KEY_ISOFORMAT if lu_type == "isoformat" else (identity, identity)
         self.schema = None
+        self.logger = logging.getLogger(type(self).__name__)
+        self.logger.addHandler(logging.NullHandler())
 
     @property
     @abstractmethod
@@ -69,11 +149,55 @@ class Store(MSONable, metaclass=ABCMeta):
 
     @property
     def last_updated(self):
-        doc = next(self.query(properties=[self.lu_field]).sort(
-            [(self.lu_field, pymongo.DESCENDING)]).limit(1), None)
-        # Handle when collection has docs but `NoneType` lu_field.
-        return (self.lu_func[0](doc[self.lu_field]) if (doc and doc[self.lu_field])
-                else datetime.min)
+        """
+        The newest lu_field value in the Store. The value is cached until the
+        next update of, or connection to, the Store.
+        """
+        if self._last_updated is None:
+            doc = next(self.query(properties=[self.lu_field]).sort(
+                [(self.lu_field, pymongo.DESCENDING)]).limit(1), None)
+            # Handle when collection has docs but `NoneType` lu_field.
+            self._last_updated = (self.lu_func[0](doc[self.lu_field]) if (doc and doc[self.lu_field])
+                                  else datetime.min)
+        return self._last_updated
+
+    def _validated(self, docs, **kwargs):
+        """
+        Validates a batch of documents against the Store schema, if any.
+        Invalid documents raise a ValueError if the schema is strict and are
+        logged and dropped otherwise.
+
+        Args:
+            docs (list): encoded documents
+            **kwargs: further kwargs to the schema's is_valid_many
+
+        Returns:
+            (valid documents, number of invalid documents)
+        """
+        if not self.schema:
+            return docs, 0
+        valid = []
+        for d, validates in zip(docs, self.schema.is_valid_many(docs, **kwargs)):
+            if validates:
+                valid.append(d)
+            elif self.schema.strict:
+                raise ValueError('Document failed to validate: {}'.format(d))
+            else:
+                self.logger.error('Document failed to validate: {}'.format(d))
+        return valid, len(docs) - len(valid)
+
+    def _on_connect(self):
+        """
+        Bookkeeping after connecting: clears the cached last_updated and
+        ensures the lu_field index if requested.
+        """
+        self._last_updated = None
+        if self.lu_index:
+            try:
+                self.ensure_index(self.lu_field)
+            except Exception as exc:
+                self.logger.warning("Could not ensure index on {}: {}".format(
+                    self.lu_field, exc))
 
     def lu_filter(self, targets):
         """Creates a MongoDB filter for new documents.
@@ -196,43 +320,224 @@ class Mongolike(object):
         """
         return self.collection.create_index(key, unique=unique, background=True)
 
-    def update(self, docs, update_lu=True, key=None):
+    def update(self, docs, update_lu=True, key=None, ordered=True, batch_size=None,
+               num_threads=1, raise_errors=True):
         """
         Function to update associated MongoStore collection.
 
         Args:
             docs: list of documents
-        """
+            update_lu (bool): whether to set the lu_field to the current time
+            key (str or list): key or keys to match documents on, defaults
+                to the Store key
+            ordered (bool): if False, use unordered bulk writes, which the
+                server can apply in any order and which continue past documents
+                that fail to write
+            batch_size (int): maximum number of documents per bulk write,
+                all documents are sent in a single bulk write if None
+            num_threads (int): number of threads sending the bulk writes
+                concurrently, only used for unordered writes
+            raise_errors (bool): whether to raise a BulkWriteError once all
+                documents have been tried if some failed to write for another
+                reason than validation, otherwise they are only logged and
+                counted as failed
 
-        bulk = self.collection.initialize_ordered_bulk_op()
+        Returns:
+            dict with the number of "upserted", "modified", "unchanged" and
+            "failed" documents
 
+        Raises:
+            BulkWriteError if raise_errors and documents failed to write
+        """
+        writes = []
+
+        encode = ENCODERS[self.encoder]
+        # document-level validation is optional
+        docs, failed = self._validated([encode(d) for d in docs])
         for d in docs:
+            search_doc = {}
+            if isinstance(key,list):
+                search_doc = {k: d[k] for k in key}
+            elif key:
+                search_doc={key: d[key]}
+            else:
+                search_doc = {self.key: d[self.key]}
+            if self.hash_field:
+                d[self.hash_field] = content_hash(
+                    d, exclude=("_id", self.lu_field, self.hash_field))
+            if update_lu:
+                d[self.lu_field] = datetime.utcnow()
+            writes.append((search_doc, d))
+
+        if batch_size:
+            batches = [writes[i:i + batch_size] for i in range(0, len(writes), batch_size)]
+        else:
+            batches = [writes]
 
-            d = jsanitize(d, allow_bson=True)
+        unchanged = 0
+        if self.hash_field:
+            batches = [self._remove_unchanged(batch) for batch in batches]
+            unchanged = len(writes) - sum(len(batch) for batch in batches)
 
-            # document-level validation is optional
-            validates = True
-            if self.schema:
-                validates = self.schema.is_valid(d)
-                if not validates:
-                    if self.schema.strict:
-                        raise ValueError('Document failed to validate: {}'.format(d))
-                    else:
-                        self.logger.error('Document failed to validate: {}'.format(d))
+        if ordered or num_threads <= 1:
+            results = [self._bulk_write(batch, ordered) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                results = list(executor.map(lambda batch: self._bulk_write(batch, ordered),
+                                            batches))
+
+        self._last_updated = None
+
+        summary = {"upserted": 0, "modified": 0, "unchanged": unchanged, "failed": failed}
+        errors = []
+        for result in results:
+            errors.extend(result.pop("errors"))
+            for k in result:
+                summary[k] += result[k]
+        if errors and raise_errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": [],
+                                  "nInserted": 0, "nUpserted": summary["upserted"],
+                                  "nMatched": summary["modified"], "nModified": summary["modified"],
+                                  "nRemoved": 0, "upserted": []})
+        return summary
+
+    def _remove_unchanged(self, writes):
+        """
+        Drop the writes whose content hash matches the stored document.
+        The stored hashes are fetched with a single query.
 
-            if validates:
-                search_doc = {}
-                if isinstance(key,list):
-                    search_doc = {k: d[k] for k in key}
-                elif key:
-                    search_doc={key: d[key]}
+        Args:
+            writes (list): (search_doc, doc) tuples from update
+
+        Returns:
+            list of the writes that change the stored documents
+        """
+        if not writes:
+            return writes
+        fields = list(writes[0][0].keys())
+        if len(fields) == 1:
+            criteria = {fields[0]: {"$in": [search_doc[fields[0]] for search_doc, _ in writes]}}
+        else:
+            criteria = {"$or": [search_doc for search_doc, _ in writes]}
+
+        stored = {}
+        for d in self.query(properties=fields + [self.hash_field], criteria=criteria):
+            try:
+                stored[tuple(get(d, f) for f in fields)] = d.get(self.hash_field)
+            except TypeError:
+                # unhashable key values are always written
+                continue
+
+        changed = []
+        for search_doc, d in writes:
+            try:
+                stored_hash = stored.get(tuple(search_doc[f] for f in fields))
+            except TypeError:
+                stored_hash = None
+            if stored_hash is None or stored_hash != d[self.hash_field]:
+                changed.append((search_doc, d))
+        return changed
+
+    def _bulk_write(self, writes, ordered):
+        """
+        Replace the documents with one bulk write. Errors are raised for
+        ordered writes. Unordered writes try every document, the documents
+        failing to write are logged and returned for update to raise.
+
+        Args:
+            writes (list): (search_doc, doc) tuples from update
+            ordered (bool): whether the bulk write is ordered
+
+        Returns:
+            dict with the number of "upserted", "modified" and "failed"
+            documents, and the write "errors" other than validation failures
+        """
+        if not writes:
+            return {"upserted": 0, "modified": 0, "failed": 0, "errors": []}
+        requests = [ReplaceOne(search_doc, d, upsert=True) for search_doc, d in writes]
+        errors = []
+        try:
+            details = self.collection.bulk_write(requests, ordered=ordered).bulk_api_result
+        except BulkWriteError as exc:
+            details = exc.details
+            # documents rejected by a collection validator are handled like
+            # documents failing the schema in Python
+            invalid = [e for e in details["writeErrors"] if e.get("code") == DOCUMENT_VALIDATION_FAILURE]
+            if invalid and self.schema and self.schema.strict:
+                raise ValueError('Document failed to validate: {}'.format(
+                    writes[invalid[0]["index"]][1])) from exc
+            if ordered and len(invalid) < len(details["writeErrors"]):
+                raise
+            for error in details["writeErrors"]:
+                if error.get("code") == DOCUMENT_VALIDATION_FAILURE:
+                    self.logger.error('Document failed to validate: {}'.format(writes[error["index"]][1]))
                 else:
-                    search_doc = {self.key: d[self.key]}
-                if update_lu:
-                    d[self.lu_field] = datetime.utcnow()
-                bulk.find(search_doc).upsert().replace_one(d)
+                    self.logger.error("Document failed to write: {}".format(error["errmsg"]))
+                    errors.append(error)
+            if ordered and invalid:
+                # ordered writes stop at the invalid document, continue after it
+                rest = self._bulk_write(writes[invalid[0]["index"] + 1:], ordered)
+                return {"upserted": details["nUpserted"] + rest["upserted"],
+                        "modified": details["nModified"] + rest["modified"],
+                        "failed": 1 + rest["failed"], "errors": rest["errors"]}
+        return {"upserted": details["nUpserted"], "modified": details["nModified"],
+                "failed": len(details["writeErrors"]), "errors": errors}
 
-        bulk.execute()
+    def groupby(self, keys, properties=None, criteria=None,
+                allow_disk_use=True, mode="aggregate"):
+        """
+        Simple grouping function that will group documents
+        by keys.
+
+        Args:
+            keys (list or string): fields to group documents
+            properties (list): properties to return in grouped documents,
+                the keys are always included
+            criteria (dict): filter for documents to group
+            allow_disk_use (bool): whether to allow disk use in aggregation
+            mode (str): how groups are formed
+                "aggregate": the server groups the (projected) documents
+                    in an aggregation, so each group must fit in 16MB
+                "ids": like "aggregate", but only the _ids of the
+                    documents are pushed into "docs"
+                "stream": documents are read sorted by the keys and grouped
+                    on the client, so only one group is held in memory at a
+                    time. An index on the keys makes the sort cheap
+
+        Returns:
+            command cursor or generator of grouped documents
+
+            elements of the command cursor have the structure:
+            {'_id': {"KEY_1": value_1, "KEY_2": value_2 ...,
+             'docs': [list_of_documents corresponding to key values]}
+
+        """
+        if isinstance(keys, str):
+            keys = [keys]
+        if properties is not None:
+            properties = list(dict.fromkeys(list(properties) + keys))
+
+        if mode == "stream":
+            cursor = self.query(properties=properties, criteria=criteria,
+                                sort=[(key, pymongo.ASCENDING) for key in keys])
+            return _group_sorted(cursor, keys)
+        if mode not in ("aggregate", "ids"):
+            raise ValueError("Unknown groupby mode {}, choose from aggregate, ids, stream".format(mode))
+
+        pipeline = []
+        if criteria is not None:
+            pipeline.append({"$match": criteria})
+
+        if properties is not None and mode == "aggregate":
+            pipeline.append({"$project": {p: 1 for p in properties}})
+
+        group_id = {key: "${}".format(key) for key in keys}
+        pipeline.append({"$group": {"_id": group_id,
+                                    "docs": {"$push": "$$ROOT" if mode == "aggregate" else "$_id"}
+                                    }
+                         })
+
+        return self.collection.aggregate(pipeline, allowDiskUse=allow_disk_use)
 
     def close(self):
         self.collection.database.client.close()
@@ -244,7 +549,8 @@ class MongoStore(Mongolike, Store):
     """
 
     def __init__(self, database, collection_name, host="localhost", port=27017,
-                 username="", password="", **kwargs):
+                 username="", password="", validation_level=None,
+                 validation_action="error", **kwargs):
         """
         Args:
             database (str): database name
@@ -253,23 +559,81 @@ class MongoStore(Mongolike, Store):
             port (int): tcp port for mongo db
             username (str): username for mongo db
             password (str): password for mongo db
+            validation_level (str): if set, the JSON schema of the Store's
+                StandardSchema is installed as the collection's $jsonSchema
+                validator on connect, with this validationLevel: "strict",
+                "moderate" or "off"
+            validation_action (str): validationAction of the validator,
+                "error" or "warn". With "strict" and "error", documents are
+                only validated against the JSON schema by the server
         """
+        if validation_level not in (None, "strict", "moderate", "off"):
+            raise ValueError("Unknown validation level {}, choose from strict, moderate, off".format(
+                validation_level))
+        if validation_action not in ("error", "warn"):
+            raise ValueError("Unknown validation action {}, choose from error, warn".format(
+                validation_action))
         self.database = database
         self.collection_name = collection_name
         self.host = host
         self.port = port
         self.username = username
         self.password = password
+        self.validation_level = validation_level
+        self.validation_action = validation_action
         self._collection = None
+        self._client = None
+        self._server_validation = False
         self.kwargs = kwargs
         super(MongoStore, self).__init__(**kwargs)
 
     def connect(self):
-        conn = MongoClient(self.host, self.port)
-        db = conn[self.database]
-        if self.username is not "":
-            db.authenticate(self.username, self.password)
-        self._collection = db[self.collection_name]
+        self.close()
+        self._client = CLIENTS.acquire(self.host, self.port, self.username, self.password,
+                                       auth_source=self.database)
+        self._collection = self._client[self.database][self.collection_name]
+        self._install_validator()
+        self._on_connect()
+
+    def _install_validator(self):
+        """
+        Installs the JSON schema of the Store's schema as the collection
+        validator, creating the collection if it doesn't exist
+        """
+        self._server_validation = False
+        if self.validation_level is None or not hasattr(self.schema, "mongo_schema"):
+            return
+        db = self._collection.database
+        options = {"validator": {"$jsonSchema": self.schema.mongo_schema},
+                   "validationLevel": self.validation_level,
+                   "validationAction": self.validation_action}
+        try:
+            try:
+                db.command("collMod", self.collection_name, **options)
+            except pymongo.errors.OperationFailure as exc:
+                if exc.code != NAMESPACE_NOT_FOUND:
+                    raise
+                db.create_collection(self.collection_name, **options)
+        except pymongo.errors.PyMongoError as exc:
+            self.logger.warning("Could not install the schema validator on {}: {}".format(
+                self.collection_name, exc))
+            return
+        self._server_validation = (self.validation_level == "strict" and
+                                   self.validation_action == "error")
+
+    def _validated(self, docs, **kwargs):
+        if self._server_validation:
+            # the server checks the JSON schema, only the rest is checked here
+            kwargs["json_schema"] = False
+        return super(MongoStore, self)._validated(docs, **kwargs)
+
+    def close(self):
+        """
+        Releases the client, which is closed once no other store uses it
+        """
+        if getattr(self, "_client", None) is not None:
+            CLIENTS.release(self._client)
+            self._client = None
 
     def __hash__(self):
         return hash((self.database, self.collection_name, self.lu_field))
@@ -286,45 +650,6 @@ class MongoStore(Mongolike, Store):
         kwargs.pop("aliases", None)
         return cls(**kwargs)
 
-    def groupby(self, keys, properties=None, criteria=None,
-                allow_disk_use=True):
-        """
-        Simple grouping function that will group documents
-        by keys.
-
-        Args:
-            keys (list or string): fields to group documents
-            properties (list): properties to return in grouped documents
-            criteria (dict): filter for documents to group
-            allow_disk_use (bool): whether to allow disk use in aggregation
-
-        Returns:
-            command cursor corresponding to grouped documents
-
-            elements of the command cursor have the structure:
-            {'_id': {"KEY_1": value_1, "KEY_2": value_2 ...,
-             'docs': [list_of_documents corresponding to key values]}
-
-        """
-        pipeline = []
-        if criteria is not None:
-            pipeline.append({"$match": criteria})
-
-        if properties is not None:
-            pipeline.append({"$project": {p: 1 for p in properties}})
-
-        if isinstance(keys, str):
-            keys = [keys]
-
-        group_id = {key: "${}".format(key) for key in keys}
-        pipeline.append({"$group": {"_id": group_id,
-                                    "docs": {"$push": "$$ROOT"}
-                                    }
-                         })
-
-        return self.collection.aggregate(pipeline, allowDiskUse=allow_disk_use)
-
-
 
 class MemoryStore(Mongolike, Store):
     """
@@ -332,29 +657,59 @@ class MemoryStore(Mongolike, Store):
     to a MongoStore
     """
 
-    def __init__(self, name="memory_db", **kwargs):
+    def __init__(self, name="memory_db", engine="mongomock", **kwargs):
+        """
+        Args:
+            name (str): name of the collection
+            engine (str): "mongomock" for a mongomock collection or "native"
+                for a maggma.memory_engine.MemoryCollection, which uses
+                indexes for queries and supports groupby
+        """
+        if engine not in ("mongomock", "native"):
+            raise ValueError("Unknown engine {}, choose from mongomock, native".format(engine))
         self.name = name
+        self.engine = engine
         self._collection = None
         self.kwargs = kwargs
         super(MemoryStore, self).__init__(**kwargs)
 
     def connect(self):
-        self._collection = mongomock.MongoClient().db[self.name]
+        if self.engine == "native":
+            self._collection = MemoryClient()["db"][self.name]
+            # documents are replaced by key in update
+            self.ensure_index(self.key)
+        else:
+            self._collection = mongomock.MongoClient().db[self.name]
+        self._on_connect()
 
     def __hash__(self):
         return hash((self.name, self.lu_field))
 
     def groupby(self, keys, properties=None, criteria=None,
-                allow_disk_use=True):
+                allow_disk_use=True, mode="aggregate"):
         """
-        This is a placeholder for groupby for memorystores,
-        current version of mongomock do not allow for standard
-        aggregation methods, so this method currently raises
-        a NotImplementedError
+        Simple grouping function that will group documents
+        by keys. The aggregation modes are only available with
+        the native engine, as current version of mongomock do not
+        allow for standard aggregation methods, so they raise a
+        NotImplementedError with mongomock
+
+        Args:
+            keys (list or string): fields to group documents
+            properties (list): properties to return in grouped documents
+            criteria (dict): filter for documents to group
+            allow_disk_use (bool): ignored
+            mode (str): "aggregate", "ids" or "stream", see Mongolike.groupby
+
+        Returns:
+            iterator of grouped documents with the same structure
+            as MongoStore.groupby
         """
-        raise NotImplementedError("groupby not available for {}"
-                                  "due to mongomock incompatibility".format(
-            self.__class__))
+        if self.engine != "native" and mode != "stream":
+            raise NotImplementedError("groupby not available for {}"
+                                      "due to mongomock incompatibility".format(
+                self.__class__))
+        return super(MemoryStore, self).groupby(keys, properties, criteria, allow_disk_use, mode)
 
 
 class JSONStore(MemoryStore):
@@ -374,20 +729,741 @@ class JSONStore(MemoryStore):
         super(JSONStore, self).__init__("collection", **kwargs)
 
     def connect(self):
+        """
+        Loads the files into memory. The files are parsed incrementally and
+        may contain a single document, a JSON array of documents or JSON Lines.
+        Compressed files are decompressed as they are read.
+        """
         super(JSONStore, self).connect()
         for path in self.paths:
-            with zopen(path) as f:
-                data = f.read()
-                data = data.decode() if isinstance(data, bytes) else data
-                objects = json.loads(data)
-                objects = [objects] if not isinstance(
-                    objects, list) else objects
-                self.collection.insert_many(objects)
+            with zopen(path, "rt", encoding="utf-8") as f:
+                objects = iter_json(f)
+                batch = list(islice(objects, 1000))
+                while batch:
+                    self.collection.insert_many(batch)
+                    batch = list(islice(objects, 1000))
 
     def __hash__(self):
         return hash((*self.paths, self.lu_field))
 
 
+class IndexedJSONStore(Store):
+    """
+    A read-only Store for large JSON files that are not loaded into memory.
+    On the first connect, each file is scanned once and an index of the
+    position of each document and the values of the key, the lu_field and
+    any index_fields is written next to it as <path>.idx.json. Later
+    connects to unchanged files only read the index. Queries on indexed
+    fields are answered from the index, and only the matching documents are
+    read from the memory-mapped files. Files must not be compressed.
+    """
+
+    def __init__(self, paths, index_fields=None, persist_index=True, **kwargs):
+        """
+        Args:
+            paths (str or list): paths for json files to turn into a Store
+            index_fields (list): fields to keep in the index in addition to
+                the key and the lu_field
+            persist_index (bool): whether to save the index next to the files
+                to reuse it the next time the Store is connected
+        """
+        paths = paths if isinstance(paths, (list, tuple)) else [paths]
+        self.paths = paths
+        self.index_fields = list(index_fields) if index_fields else []
+        self.persist_index = persist_index
+        self.kwargs = kwargs
+        self._entries = None
+        self._maps = []
+        super(IndexedJSONStore, self).__init__(**kwargs)
+
+    @property
+    def collection(self):
+        return None
+
+    @property
+    def _fields(self):
+        return list(dict.fromkeys([self.key, self.lu_field] + self.index_fields))
+
+    def connect(self):
+        """
+        Loads or builds the index of each file and memory-maps the files.
+        """
+        self.close()
+        self._entries = []
+        for n, path in enumerate(self.paths):
+            if path.lower().endswith(_COMPRESSED_EXTENSIONS):
+                raise ValueError("IndexedJSONStore can not read compressed file {}".format(path))
+            self._entries.extend((n, start, end, fields)
+                                 for start, end, fields in self._load_index(path))
+            with open(path, "rb") as f:
+                # empty files can not be mapped
+                self._maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                                  if os.fstat(f.fileno()).st_size else None)
+        self._on_connect()
+
+    def close(self):
+        for m in self._maps:
+            if m is not None:
+                m.close()
+        self._maps = []
+
+    def _load_index(self, path):
+        """
+        Returns the (start, end, fields) entries of the documents in a file,
+        from the saved index if it is up to date.
+        """
+        stat = os.stat(path)
+        header = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "fields": self._fields}
+        index_path = path + ".idx.json"
+        if self.persist_index and os.path.exists(index_path):
+            try:
+                with open(index_path) as f:
+                    index = json.load(f)
+                if all(index.get(k) == v for k, v in header.items()):
+                    return index["entries"]
+            except ValueError:
+                pass
+            self.logger.debug("Rebuilding outdated index {}".format(index_path))
+
+        # with latin-1 each byte is one character, so offsets are byte offsets
+        entries = []
+        with open(path, "rt", encoding="latin-1", newline="") as f, open(path, "rb") as raw:
+            for doc, start, end in iter_json_spans(f):
+                fields = self._index_fields(doc)
+                if not _is_ascii(fields):
+                    # non-ASCII text was decoded as latin-1, parse the document again as UTF-8
+                    raw.seek(start)
+                    fields = self._index_fields(json.loads(raw.read(end - start).decode("utf-8")))
+                entries.append((start, end, fields))
+        if self.persist_index:
+            try:
+                with open(index_path, "w") as f:
+                    json.dump(dict(header, entries=entries), f)
+            except OSError as exc:
+                self.logger.warning("Could not save index {}: {}".format(index_path, exc))
+        return entries
+
+    def _index_fields(self, doc):
+        fields = {}
+        for field in self._fields:
+            value = get(doc, field, _MISSING)
+            if value is not _MISSING:
+                set_(fields, field, value)
+        return fields
+
+    def _read(self, entry):
+        n, start, end, _ = entry
+        return json.loads(self._maps[n][start:end].decode("utf-8"))
+
+    def _is_indexed(self, fields):
+        return all(f.split(".")[0] in self._fields or f in self._fields for f in fields)
+
+    def _matches(self, criteria):
+        """
+        Yields (entry, document) pairs for the documents that match criteria.
+        The document is None if it was not read.
+        """
+        if self._entries is None:
+            raise RuntimeError("IndexedJSONStore must be connected before it is queried")
+        if not criteria:
+            for entry in self._entries:
+                yield entry, None
+        elif self._is_indexed(_criteria_fields(criteria)):
+            for entry in self._entries:
+                if filter_applies(criteria, entry[3]):
+                    yield entry, None
+        else:
+            for entry in self._entries:
+                doc = self._read(entry)
+                if filter_applies(criteria, doc):
+                    yield entry, doc
+
+    def query(self, properties=None, criteria=None, sort=None, skip=0, limit=0, **kwargs):
+        """
+        Function that gets data from the files. Criteria and sorts on
+        indexed fields are evaluated without reading the documents, and
+        projections on indexed fields are returned from the index.
+
+        Args:
+            properties (list or dict): fields to return
+            criteria (dict): filter for query, matches documents
+                against key-value pairs
+            sort (list): (field, direction) pairs to sort by
+            skip (int): number of documents to skip
+            limit (int): maximum number of documents to return, 0 for no limit
+        """
+        if isinstance(properties, dict):
+            properties = [k for k, v in properties.items() if v]
+        matches = list(self._matches(criteria))
+
+        if sort:
+            if not self._is_indexed(f for f, _ in sort):
+                matches = [(entry, doc or self._read(entry)) for entry, doc in matches]
+            for field, direction in reversed(sort):
+                matches.sort(key=lambda m: sort_value(get(m[1] or m[0][3], field), direction),
+                             reverse=direction == DESCENDING)
+        matches = matches[skip:skip + limit if limit else None]
+
+        from_index = properties is not None and self._is_indexed(properties)
+        for entry, doc in matches:
+            if from_index:
+                doc = entry[3]
+            elif doc is None:
+                doc = self._read(entry)
+            yield _project(doc, properties) if properties is not None else doc
+
+    def query_one(self, properties=None, criteria=None, **kwargs):
+        """
+        Function that gets a single document from the files.
+
+        Args:
+            properties (list or dict): fields to return
+            criteria (dict): filter for query, matches documents
+                against key-value pairs
+            **kwargs (kwargs): further kwargs to query
+        """
+        return next(self.query(properties, criteria, limit=1, **kwargs), None)
+
+    def distinct(self, key, criteria=None, **kwargs):
+        """
+        Function get to get all distinct values of a key in the files.
+
+        Args:
+            key (mongolike key): key for which to find distinct values
+            criteria (filter criteria): criteria for filter
+        """
+        return _distinct(self.query(properties=[key], criteria=criteria), key)
+
+    def update(self, docs, update_lu=True, key=None):
+        raise NotImplementedError("IndexedJSONStore is read-only")
+
+    def ensure_index(self, key, unique=False):
+        """
+        Adds key to the index fields and rebuilds the index if connected.
+        """
+        if key not in self._fields:
+            self.index_fields.append(key)
+            if self._entries is not None:
+                self.connect()
+        return True
+
+    @property
+    def last_updated(self):
+        if self._last_updated is None:
+            lus = [self.lu_func[0](e[3][self.lu_field]) for e in self._entries
+                   if e[3].get(self.lu_field)]
+            self._last_updated = max(lus) if lus else datetime.min
+        return self._last_updated
+
+    def __hash__(self):
+        return hash((*self.paths, self.lu_field))
+
+
+class SQLiteStore(Store):
+    """
+    A Store backed by an SQLite database file, for builds without a Mongo
+    server. Documents are stored as JSON with bson.json_util, so datetimes
+    and ObjectIds are kept. The values of indexed fields are kept in a
+    separate table, which is used to select the documents that can match
+    the criteria of a query before they are matched exactly with mongomock's
+    filter implementation. Each thread and process uses its own connection,
+    and the database uses write-ahead logging, so the Store can be used
+    from multiprocessing workers.
+    """
+
+    def __init__(self, path, table="documents", timeout=60, **kwargs):
+        """
+        Args:
+            path (str): path of the database file
+            table (str): name of the table for the documents
+            timeout (float): seconds to wait for the write lock of another
+                connection
+        """
+        self.path = path
+        self.table = table
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self._local = threading.local()
+        # (pid, connection) of every connection opened, to close them all
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        self._indexed = None
+        super(SQLiteStore, self).__init__(**kwargs)
+
+    @property
+    def collection(self):
+        return self._conn
+
+    @property
+    def _conn(self):
+        """
+        The connection of the current thread, which is reopened after a fork
+        """
+        if getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            with self._conns_lock:
+                self._conns.append((os.getpid(), conn))
+        return self._local.conn
+
+    def connect(self):
+        """
+        Creates the tables if needed and indexes the key and the lu_field
+        """
+        conn = self._conn
+        with _transaction(conn):
+            conn.execute('CREATE TABLE IF NOT EXISTS "{0}" (id INTEGER PRIMARY KEY, '
+                         'key TEXT UNIQUE, doc TEXT NOT NULL)'.format(self.table))
+            conn.execute('CREATE TABLE IF NOT EXISTS "{0}_index" (field TEXT NOT NULL, '
+                         'rank INTEGER NOT NULL, value, doc_id INTEGER NOT NULL)'.format(self.table))
+            conn.execute('CREATE INDEX IF NOT EXISTS "{0}_index_value" ON "{0}_index" '
+                         '(field, rank, value)'.format(self.table))
+            conn.execute('CREATE INDEX IF NOT EXISTS "{0}_index_doc" ON "{0}_index" '
+                         '(doc_id)'.format(self.table))
+            conn.execute('CREATE TABLE IF NOT EXISTS "{0}_fields" (field TEXT PRIMARY KEY)'.format(
+                self.table))
+        self._read_indexed(conn)
+        # last_updated and update rely on these
+        for field in (self.key, self.lu_field):
+            self.ensure_index(field)
+        self._on_connect()
+
+    def close(self):
+        """
+        Closes the connections of all threads
+        """
+        with self._conns_lock:
+            for pid, conn in self._conns:
+                if pid == os.getpid():
+                    conn.close()
+            self._conns = []
+        self._local = threading.local()
+
+    def _read_indexed(self, conn):
+        """
+        Reads the indexed fields, which other connections may have added
+        """
+        self._indexed = [f for f, in conn.execute('SELECT field FROM "{}_fields"'.format(self.table))]
+
+    def ensure_index(self, key, unique=False):
+        """
+        Indexes the values of a field for queries. Uniqueness is only
+        enforced for the key of the Store.
+        """
+        if key in self._indexed:
+            return True
+        conn = self._conn
+        with _transaction(conn):
+            self._read_indexed(conn)
+            if key not in self._indexed:
+                conn.execute('INSERT INTO "{}_fields" VALUES (?)'.format(self.table), (key,))
+                rows = []
+                for doc_id, doc in conn.execute('SELECT id, doc FROM "{}"'.format(self.table)):
+                    rows.extend(_sqlite_index_rows([key], doc_id, _json_loads(doc)))
+                conn.executemany('INSERT INTO "{}_index" VALUES (?, ?, ?, ?)'.format(self.table), rows)
+                self._indexed.append(key)
+        return True
+
+    def query(self, properties=None, criteria=None, sort=None, skip=0, limit=0, **kwargs):
+        """
+        Function that gets data from the database.
+
+        Args:
+            properties (list or dict): fields to return
+            criteria (dict): filter for query, matches documents
+                against key-value pairs
+            sort (list): (field, direction) pairs to sort by
+            skip (int): number of documents to skip
+            limit (int): maximum number of documents to return, 0 for no limit
+        """
+        if isinstance(properties, dict):
+            properties = [k for k, v in properties.items() if v]
+        docs = (doc for _, doc in self._select(criteria))
+        if sort:
+            docs = list(docs)
+            for field, direction in reversed(sort):
+                docs.sort(key=lambda d: sort_value(get(d, field), direction),
+                          reverse=direction == DESCENDING)
+        for doc in islice(docs, skip, skip + limit if limit else None):
+            yield _project(doc, properties) if properties is not None else doc
+
+    def query_one(self, properties=None, criteria=None, **kwargs):
+        """
+        Function that gets a single document from the database.
+
+        Args:
+            properties (list or dict): fields to return
+            criteria (dict): filter for query, matches documents
+                against key-value pairs
+            **kwargs (kwargs): further kwargs to query
+        """
+        return next(self.query(properties, criteria, limit=1, **kwargs), None)
+
+    def distinct(self, key, criteria=None, **kwargs):
+        """
+        Function get to get all distinct values of a key in the database.
+
+        Args:
+            key (mongolike key): key for which to find distinct values
+            criteria (filter criteria): criteria for filter
+        """
+        if key == self.key and not criteria:
+            return [_json_loads(k) for k, in self._conn.execute(
+                'SELECT key FROM "{}" WHERE key IS NOT NULL'.format(self.table))]
+        return _distinct(self.query(properties=[key], criteria=criteria), key)
+
+    def _select(self, criteria):
+        """
+        Yields (id, document) pairs for the documents that match criteria,
+        using the index table to select the documents that can match
+        """
+        sql = 'SELECT id, doc FROM "{}"'.format(self.table)
+        params = []
+        where = self._where(criteria) if criteria else None
+        if where:
+            sql += " WHERE " + where[0]
+            params = where[1]
+        for doc_id, doc in self._conn.execute(sql, params):
+            doc = _json_loads(doc)
+            if not criteria or filter_applies(criteria, doc):
+                yield doc_id, doc
+
+    def _where(self, criteria):
+        """
+        Translates the conditions of criteria on indexed fields to an SQL
+        condition that is true for every document that matches criteria.
+
+        Returns:
+            (sql, params) or None if no condition can be translated
+        """
+        clauses = []
+        params = []
+        for field, condition in criteria.items():
+            if field == "$and":
+                parts = [p for p in (self._where(c) for c in condition) if p]
+            elif field == "$or":
+                parts = [self._where(c) for c in condition]
+                if not parts or not all(parts):
+                    continue
+                parts = [("(" + " OR ".join(p[0] for p in parts) + ")",
+                          [v for p in parts for v in p[1]])]
+            elif field in self._indexed:
+                parts = self._field_where(field, condition)
+            else:
+                continue
+            for sql, values in parts:
+                clauses.append(sql)
+                params.extend(values)
+        return (" AND ".join(clauses), params) if clauses else None
+
+    def _field_where(self, field, condition):
+        subquery = 'id IN (SELECT doc_id FROM "{}_index" WHERE field = ? AND '.format(self.table)
+        if not (isinstance(condition, dict) and condition and
+                all(k.startswith("$") for k in condition)):
+            condition = {"$eq": condition}
+
+        parts = []
+        for op, value in condition.items():
+            if op == "$eq":
+                indexed = _sqlite_index_value(value)
+                if indexed:
+                    parts.append((subquery + "rank = ? AND value = ?)", [field, *indexed]))
+            elif op == "$in":
+                by_rank = defaultdict(list)
+                for v in value:
+                    indexed = _sqlite_index_value(v)
+                    if not indexed:
+                        break
+                    by_rank[indexed[0]].append(indexed[1])
+                else:
+                    if not by_rank:
+                        parts.append(("0", []))
+                        continue
+                    sql = " OR ".join("(rank = ? AND value IN (SELECT value FROM json_each(?)))"
+                                      for _ in by_rank)
+                    values = [v for rank, vs in by_rank.items() for v in (rank, json.dumps(vs))]
+                    parts.append((subquery + "(" + sql + "))", [field] + values))
+            elif op in ("$gt", "$gte", "$lt", "$lte") and not isinstance(value, bool):
+                indexed = _sqlite_index_value(value)
+                if indexed:
+                    # bounds are inclusive because datetimes are only indexed to the ms
+                    sql = "rank = ? AND value {} ?)".format(">=" if op.startswith("$gt") else "<=")
+                    parts.append((subquery + sql, [field, *indexed]))
+        return parts
+
+    def update(self, docs, update_lu=True, key=None):
+        """
+        Function to update the database in one transaction.
+
+        Args:
+            docs: list of documents
+            update_lu (bool): whether to set the lu_field to the current time
+            key (str or list): key or keys to match documents on, defaults
+                to the Store key
+
+        Returns:
+            dict with the number of "upserted", "modified", "unchanged" and
+            "failed" documents
+        """
+        key = key or self.key
+        fields = key if isinstance(key, list) else [key]
+        summary = {"upserted": 0, "modified": 0, "unchanged": 0, "failed": 0}
+
+        writes = []
+        encode = ENCODERS[self.encoder]
+        docs, summary["failed"] = self._validated([encode(d) for d in docs])
+        for d in docs:
+            if self.hash_field:
+                d[self.hash_field] = content_hash(
+                    d, exclude=("_id", self.lu_field, self.hash_field))
+            if update_lu:
+                d[self.lu_field] = datetime.utcnow()
+            writes.append(d)
+
+        conn = self._conn
+        table = self.table
+        with _transaction(conn):
+            # another connection may have indexed more fields
+            self._read_indexed(conn)
+            if fields == [self.key]:
+                existing = self._stored_by_key([_sqlite_key(d[self.key]) for d in writes])
+            else:
+                existing = {}
+
+            for d in writes:
+                doc_key = _sqlite_key(d[self.key]) if self.key in d else None
+                if fields == [self.key]:
+                    stored = existing.get(doc_key)
+                else:
+                    stored = next(self._select({f: get(d, f) for f in fields}), None)
+                    stored = stored and (stored[0], stored[1].get(self.hash_field))
+
+                if stored and self.hash_field and stored[1] == d[self.hash_field]:
+                    summary["unchanged"] += 1
+                    continue
+                text = _json_dumps(d)
+                if stored:
+                    doc_id = stored[0]
+                    conn.execute('UPDATE "{}" SET key = ?, doc = ? WHERE id = ?'.format(table),
+                                 (doc_key, text, doc_id))
+                    conn.execute('DELETE FROM "{}_index" WHERE doc_id = ?'.format(table), (doc_id,))
+                    summary["modified"] += 1
+                else:
+                    doc_id = conn.execute('INSERT INTO "{}" (key, doc) VALUES (?, ?)'.format(table),
+                                          (doc_key, text)).lastrowid
+                    if doc_key is not None:
+                        existing[doc_key] = (doc_id, None)
+                    summary["upserted"] += 1
+                conn.executemany('INSERT INTO "{}_index" VALUES (?, ?, ?, ?)'.format(table),
+                                 _sqlite_index_rows(self._indexed, doc_id, d))
+
+        self._last_updated = None
+        return summary
+
+    def _stored_by_key(self, keys):
+        """
+        Returns {key: (id, hash)} for the stored documents with the given keys
+        """
+        hash_sql = "json_extract(doc, ?)" if self.hash_field else "NULL"
+        params = ["$." + self.hash_field] if self.hash_field else []
+        sql = 'SELECT key, id, {} FROM "{}" WHERE key IN (SELECT value FROM json_each(?))'.format(
+            hash_sql, self.table)
+        return {k: (doc_id, doc_hash)
+                for k, doc_id, doc_hash in self._conn.execute(sql, params + [json.dumps(keys)])}
+
+    @property
+    def last_updated(self):
+        if self._last_updated is None:
+            row = self._conn.execute(
+                'SELECT rank, value FROM "{}_index" WHERE field = ? '
+                'ORDER BY rank DESC, value DESC LIMIT 1'.format(self.table), (self.lu_field,)).fetchone()
+            if row is None:
+                self._last_updated = datetime.min
+            else:
+                rank, value = row
+                value = _MS_EPOCH + timedelta(milliseconds=value) if rank == _rank(_MS_EPOCH) else value
+                self._last_updated = self.lu_func[0](value)
+        return self._last_updated
+
+    def __hash__(self):
+        return hash((self.path, self.table, self.lu_field))
+
+
+_JSON_OPTIONS = json_util.JSONOptions(tz_aware=False)
+
+_MS_EPOCH = datetime(1970, 1, 1)
+
+
+def _json_dumps(obj):
+    return json_util.dumps(obj, json_options=_JSON_OPTIONS)
+
+
+def _json_loads(s):
+    return json_util.loads(s, json_options=_JSON_OPTIONS)
+
+
+def _sqlite_key(value):
+    """
+    Text of a key value in the key column. Integral floats are stored as
+    ints, so that keys equal in MongoDB, like 1 and 1.0, are the same key.
+    """
+    def normalize(v):
+        if isinstance(v, float) and v.is_integer():
+            return int(v)
+        if isinstance(v, list):
+            return [normalize(x) for x in v]
+        if isinstance(v, dict):
+            return {k: normalize(x) for k, x in v.items()}
+        return v
+    return _json_dumps(normalize(value))
+
+
+@contextmanager
+def _transaction(conn):
+    """
+    Runs a block in a transaction that holds the write lock from the start
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _sqlite_index_value(value):
+    """
+    Returns the (type rank, SQLite value) a scalar is indexed as, or None if
+    it is not indexed
+    """
+    if isinstance(value, bool):
+        return _rank(value), int(value)
+    if isinstance(value, (int, float)):
+        return (_rank(value), value) if abs(value) < 2 ** 63 else None
+    if isinstance(value, str):
+        return _rank(value), value
+    if isinstance(value, ObjectId):
+        return _rank(value), str(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return _rank(value), (value - _MS_EPOCH) // timedelta(milliseconds=1)
+    return None
+
+
+def _sqlite_index_rows(fields, doc_id, doc):
+    """
+    Rows of the index table for the scalar values of fields in doc,
+    including the elements of arrays
+    """
+    rows = set()
+    for field in fields:
+        for value in _path_values(doc, field.split(".")):
+            indexed = _sqlite_index_value(value)
+            if indexed:
+                rows.add((field, indexed[0], indexed[1], doc_id))
+    return rows
+
+
+def _pack_arrays(obj):
+    """
+    Replaces numpy arrays with documents holding their raw data
+    """
+    if np is not None and isinstance(obj, np.ndarray) and obj.dtype.kind in "biufc":
+        return {"@ndarray": True, "dtype": obj.dtype.str, "shape": list(obj.shape),
+                "data": Binary(np.ascontiguousarray(obj).tobytes())}
+    if isinstance(obj, dict):
+        return {k: _pack_arrays(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_pack_arrays(v) for v in obj]
+    return obj
+
+
+def _unpack_arrays(obj):
+    """
+    Reverses _pack_arrays
+    """
+    if isinstance(obj, dict):
+        if obj.get("@ndarray") is True and np is not None:
+            return np.frombuffer(obj["data"], dtype=obj["dtype"]).reshape(obj["shape"]).copy()
+        return {k: _unpack_arrays(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_unpack_arrays(v) for v in obj]
+    return obj
+
+
+def _group_sorted(docs, keys):
+    """
+    Groups documents sorted by keys into the structure of Mongolike.groupby
+    """
+    for _, group in groupby(docs, key=lambda d: tuple(_freeze(get(d, k)) for k in keys)):
+        group = list(group)
+        yield {"_id": {k: get(group[0], k) for k in keys if has(group[0], k)}, "docs": group}
+
+
+def _distinct(docs, key):
+    """
+    Distinct values of key in docs, where array values count as their elements
+    """
+    seen = set()
+    values = []
+    for doc in docs:
+        value = get(doc, key, _MISSING)
+        for v in (value if isinstance(value, list) else [value]):
+            frozen = _freeze(v)
+            if v is not _MISSING and frozen not in seen:
+                seen.add(frozen)
+                values.append(v)
+    return values
+
+
+_COMPRESSED_EXTENSIONS = (".gz", ".z", ".bz2", ".xz", ".lzma")
+
+_MISSING = object()
+
+
+def _is_ascii(value):
+    """Whether all the strings in a value, including the dict keys, are ASCII."""
+    if isinstance(value, str):
+        try:
+            value.encode("ascii")
+        except UnicodeEncodeError:
+            return False
+        return True
+    if isinstance(value, list):
+        return all(_is_ascii(v) for v in value)
+    if isinstance(value, dict):
+        return all(_is_ascii(k) and _is_ascii(v) for k, v in value.items())
+    return True
+
+
+def _criteria_fields(criteria):
+    """Returns the fields used in a mongo filter."""
+    fields = []
+    for k, v in criteria.items():
+        if k in ("$and", "$or", "$nor"):
+            for c in v:
+                fields.extend(_criteria_fields(c))
+        else:
+            # other top-level operators like $where are never indexed
+            fields.append(k)
+    return fields
+
+
+def _project(doc, properties):
+    out = {}
+    for p in properties:
+        value = get(doc, p, _MISSING)
+        if value is not _MISSING:
+            set_(out, p, value)
+    return out
+
+
 class DatetimeStore(MemoryStore):
     """Utility store intended for use with `Store.lu_filter`."""
 
@@ -411,15 +1487,50 @@ class GridFSStore(Store):
     """
 
     def __init__(self, database, collection_name, host="localhost", port=27017,
-                 username="", password="", **kwargs):
-
+                 username="", password="", num_threads=4, compression=None,
+                 encoding="json", replace=True, **kwargs):
+        """
+        Args:
+            database (str): database name
+            collection_name (str): name of the GridFS collection
+            host (str): hostname for mongo db
+            port (int): tcp port for mongo db
+            username (str): username for mongo db
+            password (str): password for mongo db
+            num_threads (int): number of threads reading and writing files
+                concurrently. Reads in query run ahead of the caller by up
+                to twice this number of files
+            compression (str): codec new files are compressed with, one of
+                COMPRESSORS: "zlib", "gzip", "lzma", and "lz4" or "zstd"
+                if the lz4 or zstandard packages are installed. None to
+                store files uncompressed
+            encoding (str): how documents are serialized, "json" or "bson".
+                With "bson", numpy arrays are stored as raw binary data
+                and read back as arrays, and datetimes are kept
+            replace (bool): whether update removes the older files with
+                the same key, otherwise every update adds a new version
+
+        The compression and encoding of each file are stored in its metadata,
+        so files written with other settings can still be read.
+        """
+        if compression is not None and compression not in COMPRESSORS:
+            raise ValueError("Unknown or unavailable compression {}, choose from {}".format(
+                compression, ", ".join(COMPRESSORS)))
+        if encoding not in ("json", "bson"):
+            raise ValueError("Unknown encoding {}, choose from json, bson".format(encoding))
         self.database = database
         self.collection_name = collection_name
         self.host = host
         self.port = port
         self.username = username
         self.password = password
+        self.num_threads = num_threads
+        self.compression = compression
+        self.encoding = encoding
+        self.replace = replace
         self._collection = None
+        self._executor = None
+        self._client = None
         self.kwargs = kwargs
 
         if "key" not in kwargs:
@@ -428,34 +1539,93 @@ class GridFSStore(Store):
         super(GridFSStore, self).__init__(**kwargs)
 
     def connect(self):
-        conn = MongoClient(self.host, self.port)
-        db = conn[self.database]
-        if self.username is not "":
-            db.authenticate(self.username, self.password)
+        self._release_client()
+        self._client = CLIENTS.acquire(self.host, self.port, self.username, self.password,
+                                       auth_source=self.database)
+        db = self._client[self.database]
 
         self._collection = gridfs.GridFS(db, self.collection_name)
         self._files_collection = db["{}.files".format(self.collection_name)]
         self._chunks_collection = db["{}.chunks".format(self.collection_name)]
+        if self._executor is None and self.num_threads > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_threads)
+        if self.key != "_oid":
+            # for finding the newest file of a key, and the older ones to replace
+            try:
+                self._files_collection.create_index(
+                    [(self.key, pymongo.ASCENDING), ("uploadDate", pymongo.DESCENDING)],
+                    background=True)
+            except Exception as exc:
+                self.logger.warning("Could not ensure index on {}: {}".format(self.key, exc))
+        self._on_connect()
+
+    @property
+    def last_updated(self):
+        """
+        The newest lu_field value of the files. The value is cached until the
+        next update of, or connection to, the Store.
+        """
+        if self._last_updated is None:
+            doc = self._files_collection.find_one({self.lu_field: {"$exists": True}},
+                                                  {self.lu_field: 1},
+                                                  sort=[(self.lu_field, pymongo.DESCENDING)])
+            self._last_updated = (self.lu_func[0](doc[self.lu_field]) if (doc and doc[self.lu_field])
+                                  else datetime.min)
+        return self._last_updated
+
+    def _map(self, func, items):
+        """
+        Applies func to items in the thread pool, in order
+        """
+        if self._executor is None:
+            return map(func, items)
+        return prefetch_map(func, items, self._executor, 2 * self.num_threads)
 
     @property
     def collection(self):
         # TODO: Should this return the real MongoCollection or the GridFS
         return self._collection
 
-    def query(self, properties=None, criteria=None, **kwargs):
+    def query(self, properties=None, criteria=None, metadata_only=False, **kwargs):
         """
         Function that gets data from GridFS. This store ignores all
-        property projections as its designed for whole document access
+        property projections as its designed for whole document access,
+        unless metadata_only is set
 
         Args:
             properties (list or dict): This will be ignored by the GridFS
-                Store
+                Store, except with metadata_only
             criteria (dict): filter for query, matches documents
                 against key-value pairs
+            metadata_only (bool): if True, return the documents of the
+                .files collection, projected to properties, without
+                reading the files
             **kwargs (kwargs): further kwargs to Collection.find
         """
-        for f in self.collection.find(filter=criteria, **kwargs).sort('uploadDate', pymongo.DESCENDING):
-            yield json.loads(f.read())
+        if metadata_only:
+            if isinstance(properties, list):
+                properties = {p: 1 for p in properties}
+            for doc in self._files_collection.find(criteria, properties, **kwargs).sort(
+                    'uploadDate', pymongo.DESCENDING):
+                yield doc
+            return
+
+        files = self.collection.find(criteria or {}, **kwargs).sort('uploadDate', pymongo.DESCENDING)
+        for doc in self._map(self._read, files):
+            yield doc
+
+    def _read(self, f):
+        metadata = f.metadata or {}
+        data = f.read()
+        compression = metadata.get("compression")
+        if compression:
+            if compression not in COMPRESSORS:
+                raise ValueError("File {} is compressed with {}, which is not available".format(
+                    f._id, compression))
+            data = COMPRESSORS[compression][1](data)
+        if metadata.get("encoding") == "bson":
+            return _unpack_arrays(BSON(data).decode())
+        return json.loads(data)
 
     def query_one(self, properties=None, criteria=None, sort=(('uploadDate', pymongo.DESCENDING),), **kwargs):
         """
@@ -468,11 +1638,13 @@ class GridFSStore(Store):
                 Store
             criteria (dict): filter for query, matches documents
                 against key-value pairs
+            sort (tuple): (field, direction) pairs to sort the files by,
+                the newest file is returned by default
             **kwargs (kwargs): further kwargs to Collection.find
         """
-        f = self.collection.find_one(filter=criteria, **kwargs)
+        f = self.collection.find_one(criteria or {}, sort=list(sort), **kwargs)
         if f:
-            return json.loads(f.read())
+            return self._read(f)
         else:
             return None
 
@@ -520,24 +1692,95 @@ class GridFSStore(Store):
     def update(self, docs, update_lu=True, key=None):
         """
         Function to update associated MongoStore collection.
+        The files are written concurrently by the thread pool. If
+        replace is set, the files previously stored for the same keys
+        are then removed with bulk deletes.
 
         Args:
             docs: list of documents
+            update_lu (bool): whether to set the lu_field to the current time,
+                the lu_field is also stored in the file document
+            key (str or list): key or keys to match files on
         """
+        written = list(self._map(lambda d: self._put(d, key, update_lu), docs))
+        if self.replace:
+            self._remove_older(written)
+        self._last_updated = None
 
-        for d in docs:
-            search_doc = {}
-            if isinstance(key, list):
-                search_doc = {k: d[k] for k in key}
-            elif key:
-                search_doc = {key: d[key]}
-            elif self.key is "_oid":
-                pass
-            else:
-                search_doc = {self.key: d[self.key]}
+    def _search_doc(self, d, key):
+        if isinstance(key, list):
+            return {k: d[k] for k in key}
+        elif key:
+            return {key: d[key]}
+        elif self.key == "_oid":
+            return {}
+        return {self.key: d[self.key]}
+
+    def _remove_older(self, written):
+        """
+        Deletes the files and chunks of each key that are older than the
+        newest file written for it. Files uploaded after it, e.g. by another
+        writer of the same key, are kept.
+
+        Args:
+            written (list): (search_doc, file id) pairs of the new files
+        """
+        newest = {}
+        for search_doc, file_id in written:
+            if search_doc:
+                newest[_freeze(search_doc)] = (search_doc, file_id)
+        if not newest:
+            return
+        keep = {file_id for _, file_id in newest.values()}
+        # files written twice for the same key by this update
+        replaced = [file_id for search_doc, file_id in written
+                    if search_doc and file_id not in keep]
+        upload_dates = {f["_id"]: f["uploadDate"] for f in self._files_collection.find(
+            {"_id": {"$in": list(keep)}}, {"uploadDate": 1})}
+        older = [dict(search_doc, uploadDate={"$lt": upload_dates[file_id]})
+                 for search_doc, file_id in newest.values() if file_id in upload_dates]
+
+        for n in range(0, max(len(older), 1), 1000):
+            criteria = {"$or": older[n:n + 1000] + ([{"_id": {"$in": replaced}}] if n == 0 else [])}
+            old_ids = [f["_id"] for f in self._files_collection.find(criteria, {"_id": 1})
+                       if f["_id"] not in keep]
+            if old_ids:
+                # like GridFS.delete, the files go first so readers never see
+                # a file without its chunks
+                self._files_collection.delete_many({"_id": {"$in": old_ids}})
+                self._chunks_collection.delete_many({"files_id": {"$in": old_ids}})
+
+    def _put(self, d, key, update_lu=True):
+        """
+        Writes one file
 
+        Returns:
+            (search_doc, file id) pair
+        """
+        search_doc = self._search_doc(d, key)
+        fields = dict(search_doc)
+        if update_lu:
+            d = dict(d)
+            d[self.lu_field] = datetime.utcnow()
+        if self.lu_field in d:
+            fields[self.lu_field] = d[self.lu_field]
+
+        if self.encoding == "bson":
+            data = BSON.encode(bson_sanitize(_pack_arrays(d)))
+        else:
             data = json.dumps(jsanitize(d)).encode("UTF-8")
-            self.collection.put(data, **search_doc)
+        if self.compression:
+            data = COMPRESSORS[self.compression][0](data)
+        metadata = {"encoding": self.encoding, "compression": self.compression}
+        return search_doc, self.collection.put(data, metadata=metadata, **fields)
 
     def close(self):
-        self.collection.database.client.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._release_client()
+
+    def _release_client(self):
+        if getattr(self, "_client", None) is not None:
+            CLIENTS.release(self._client)
+            self._client = None
@@ -104,6 +104,47 @@ class TestAliasingStore(unittest.TestCase):
         self.assertEqual(list(self.aliasingstore.store.query(criteria={"task_id": "mp-4"}))[0]["e"], 5)
         self.assertEqual(list(self.aliasingstore.store.query(criteria={"task_id": "mp-5"}))[0]["g"]["h"], 6)
 
+    def test_query_properties(self):
+        docs = [{"task_id": i, "b": i, "e": 2 * i, "g": {"h": 3 * i, "i": i}, "x": i % 2} for i in range(10)]
+        native = MemoryStore("test", engine="native")
+        native.connect()
+        pushed = AliasingStore(native, self.aliasingstore.aliases)
+        for store in [self.aliasingstore, pushed]:
+            store.store.collection.insert_many([dict(d) for d in docs])
+
+        self.assertIsNotNone(pushed._pipeline({"a": 1}, {}))
+        self.assertIsNone(self.aliasingstore._pipeline({"a": 1}, {}))
+        # "g" contains the aliased "g.h"
+        self.assertIsNone(pushed._pipeline({"g": 1}, {}))
+        # "b" is returned as "a" by the find path
+        self.assertIsNone(pushed._pipeline({"b": 1}, {}))
+        self.assertIsNone(pushed._pipeline({"x": {"$slice": 1}}, {}))
+
+        queries = [(["a", "c.d", "f", "x"], {"a": {"$gt": 3}}),
+                   ({"c": 1, "_id": 0}, {"$or": [{"f": 3}, {"c.d": 4}]}),
+                   (["g", "task_id"], {"task_id": 2}),
+                   ({"a": 0, "_id": 0}, {"x": 1}),
+                   (["b", "e", "x"], {"x": 0}),
+                   (["g.h", "g.i"], {"x": 1})]
+        for properties, criteria in queries:
+            cursors = [store.query(properties, dict(criteria), sort=[("a", -1)], limit=3)
+                       for store in [self.aliasingstore, pushed]]
+            # both paths return the same type
+            self.assertEqual(type(cursors[0]), type(cursors[1]))
+            results = [list(cursor) for cursor in cursors]
+            for d in results[0] + results[1]:
+                d.pop("_id", None)
+            self.assertEqual(results[0], results[1])
+
+        self.assertEqual([d["c"]["d"] for d in pushed.query(["c.d"], {"a": {"$lt": 2}}, sort=[("a", 1)])],
+                         [0, 2])
+        self.assertEqual([d["f"] for d in pushed.query(["f"], skip=8, sort=[("f", 1)])], [24, 27])
+        self.assertEqual(pushed.query_one(["f"], {"a": 1})["f"], 3)
+        self.assertEqual(sorted(pushed.distinct("f", {"c.d": {"$lt": 5}})), [0, 3, 6])
+
+        pushed.ensure_index("c.d")
+        self.assertIn("e_1", native.collection.index_information())
+
     def test_substitute(self):
         aliases = {"a": "b", "c.d": "e", "f": "g.h"}
 
@@ -120,6 +161,14 @@ class TestAliasingStore(unittest.TestCase):
         substitute(d, aliases)
         self.assertTrue("f" in d)
 
+        d = {"e": 1, "g": {"h": 2}, "c": {"x": 3}}
+        substitute(d, aliases)
+        self.assertEqual(d, {"c": {"x": 3, "d": 1}, "f": 2})
+
+        d = {"l": [{"m": 5}]}
+        substitute(d, {"n": "l.0.m"})
+        self.assertEqual(d, {"n": 5})
+
         d = None
         substitute(d, aliases)
         self.assertTrue(d is None)
@@ -0,0 +1,91 @@
+import unittest
+
+from maggma.diff import Delta, Differ
+from maggma.stores import MemoryStore
+
+
+class DeltaTests(unittest.TestCase):
+
+    def test_delta(self):
+        self.assertTrue(Delta("+-").cmp(1, -1))
+        self.assertFalse(Delta("+-").cmp(1, 5))
+        self.assertFalse(Delta("+-2").cmp(1, 3))
+        self.assertTrue(Delta("+-2=").cmp(1, 3))
+        self.assertTrue(Delta("+-1.5").cmp(1, 3))
+        self.assertFalse(Delta("+-10%").cmp(100, 110))
+        self.assertTrue(Delta("+-10=%").cmp(100, 110))
+        self.assertEqual(str(Delta("+-10=%")), "+-10=%")
+        # values that are not numbers only change when they sort differently
+        self.assertTrue(Delta("+-2").cmp(1, "1"))
+        self.assertTrue(Delta("+-").cmp("a", "b"))
+        self.assertFalse(Delta("+-").cmp("a", "a"))
+        self.assertTrue(Delta("+-").cmp(True, 1))
+        self.assertTrue(Delta("+-10%").cmp([1, 2], [1, 3]))
+        self.assertFalse(Delta("+-10%").cmp({"a": [1]}, {"a": [1]}))
+        for expr in ["", "2", "+-x", "+-10%="]:
+            self.assertRaises(ValueError, Delta, expr)
+
+
+class DifferTests(unittest.TestCase):
+
+    def setUp(self):
+        self.old = MemoryStore("old")
+        self.new = MemoryStore("new")
+        self.old.connect()
+        self.new.connect()
+        self.old.update([{"task_id": "mp-{:03d}".format(i), "a": i, "e": float(i), "x": "old"}
+                         for i in range(100) if i % 10 != 3])
+        self.new.update([{"task_id": "mp-{:03d}".format(i), "a": i if i % 7 else -i,
+                          "e": i + (0.5 if i % 20 == 0 else 0.1), "x": "new"}
+                         for i in range(100) if i % 10 != 5])
+        # keys of other types
+        self.old.update([{"task_id": 5, "a": 5}, {"task_id": 6, "a": 6}])
+        self.new.update([{"task_id": 6, "a": 7}])
+
+    def test_diff(self):
+        differ = Differ(key="task_id", props=["a"], info=["x"], deltas={"e": Delta("+-0.2")})
+        expected = differ.diff(self.old, self.new)
+        # numbers sort before strings, like in MongoDB
+        self.assertEqual(expected["missing"][0], {"task_id": 5, "x": None})
+        self.assertEqual([d["task_id"] for d in expected["missing"][1:]],
+                         ["mp-{:03d}".format(i) for i in range(5, 100, 10)])
+        self.assertEqual(len(expected["additional"]), 10)
+        self.assertEqual(expected["additional"][0], {"task_id": "mp-003", "x": "new"})
+
+        changed = {(d["task_id"], d["property"]): d for d in expected["changed"]}
+        self.assertEqual(changed[("mp-007", "a")]["old"], 7)
+        self.assertEqual(changed[("mp-007", "a")]["new"], -7)
+        self.assertEqual(changed[(6, "a")]["match type"], "exact")
+        self.assertEqual(changed[("mp-020", "e")]["match type"], "delta")
+        self.assertAlmostEqual(changed[("mp-020", "e")]["delta"], 0.5)
+        # 12 negated "a" of mp-* and task_id 6, 5 changes of "e" above 0.2
+        self.assertEqual(len(changed), 13 + 5)
+        # mp-000 changes neither
+        self.assertNotIn(("mp-000", "a"), changed)
+
+        for ranges in [2, 7]:
+            result = differ.diff(self.old, self.new, ranges=ranges, num_workers=3)
+            for k, records in expected.items():
+                self.assertEqual(sorted(map(repr, result[k])), sorted(map(repr, records)))
+
+        result = Differ(key="task_id", props=["a"], fltr={"a": {"$lt": 50}}).diff(
+            self.old, self.new, only_values=True, ranges=3)
+        self.assertEqual(list(result), ["changed"])
+        self.assertEqual(len(result["changed"]), 7)
+
+        result = Differ(key="task_id").diff(self.old, self.new, only_missing=True)
+        self.assertEqual(list(result), ["missing"])
+        self.assertEqual(len(result["missing"]), 11)
+
+    def test_diff_non_numeric_delta(self):
+        self.new.update([{"task_id": "mp-001", "e": "n/a"}, {"task_id": "mp-002", "e": 2}])
+        differ = Differ(key="task_id", deltas={"e": Delta("+-0.2")})
+        changed = {d["task_id"]: d for d in differ.diff(self.old, self.new)["changed"]}
+        self.assertEqual(changed["mp-001"]["new"], "n/a")
+        self.assertIsNone(changed["mp-001"]["delta"])
+        # 2 and 2.0 are equal numbers
+        self.assertNotIn("mp-002", changed)
+
+
+if __name__ == "__main__":
+    unittest.main()
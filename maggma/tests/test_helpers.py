@@ -0,0 +1,58 @@
+import os
+import unittest
+from unittest import mock
+
+from maggma.helpers import CLIENTS, ClientRegistry
+from maggma.stores import MongoStore
+
+
+class ClientRegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = ClientRegistry()
+
+    def test_acquire_release(self):
+        client = self.registry.acquire("localhost", 27017)
+        self.assertIs(self.registry.acquire("localhost", 27017), client)
+        self.assertEqual(self.registry.count(client), 2)
+
+        self.assertIsNot(self.registry.acquire("localhost", 27018), client)
+        other = self.registry.acquire("localhost", 27017, "user", "pass", auth_source="db")
+        self.assertIsNot(other, client)
+        self.assertIs(self.registry.acquire("localhost", 27017, "user", "pass", auth_source="db"), other)
+
+        with mock.patch.object(client, "close") as close:
+            self.registry.release(client)
+            close.assert_not_called()
+            self.registry.release(client)
+            close.assert_called_once_with()
+        self.assertEqual(self.registry.count(client), 0)
+        self.assertIsNot(self.registry.acquire("localhost", 27017), client)
+
+    def test_fork(self):
+        client = self.registry.acquire("localhost", 27017)
+        with mock.patch("maggma.helpers.os.getpid", return_value=os.getpid() + 1):
+            child_client = self.registry.acquire("localhost", 27017)
+            self.assertIsNot(child_client, client)
+            with mock.patch.object(client, "close") as close:
+                # clients of the parent are left alone
+                self.registry.release(client)
+                close.assert_not_called()
+            self.assertEqual(self.registry.count(child_client), 1)
+
+    def test_stores(self):
+        stores = [MongoStore("maggma_test", name) for name in ["a", "b"]]
+        with mock.patch.object(MongoStore, "_on_connect"):
+            for store in stores:
+                store.connect()
+        client = stores[0].collection.database.client
+        self.assertIs(stores[1].collection.database.client, client)
+        stores[0].close()
+        stores[0].close()
+        self.assertEqual(CLIENTS.count(client), 1)
+        stores[1].close()
+        self.assertEqual(CLIENTS.count(client), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
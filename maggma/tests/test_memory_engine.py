@@ -0,0 +1,87 @@
+import unittest
+from datetime import datetime
+
+import mongomock
+import pymongo
+from pymongo.errors import BulkWriteError
+from pymongo.operations import ReplaceOne
+from maggma.memory_engine import MemoryClient
+
+
+class MemoryCollectionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.docs = [{"_id": i, "task_id": i, "a": i % 4, "b": {"c": str(i % 3)}, "tags": ["t{}".format(i % 2)],
+                      "d": None if i % 5 else datetime(2018, 1, 1 + i % 7), "flag": i % 2 == 0}
+                     for i in range(50)]
+        self.coll = MemoryClient()["db"]["test"]
+        self.mock = mongomock.MongoClient()["db"]["test"]
+        for coll in [self.coll, self.mock]:
+            coll.insert_many([dict(d) for d in self.docs])
+
+    def assertSameResults(self, criteria, projection=None):
+        expected = list(self.mock.find(criteria, projection))
+        self.assertEqual(list(self.coll.find(criteria, projection)), expected)
+
+    def test_find(self):
+        queries = [{"a": 1}, {"a": {"$in": [1, 2]}}, {"a": {"$gt": 1, "$lte": 3}}, {"b.c": "2"},
+                   {"tags": "t1"}, {"d": None}, {"d": {"$gte": datetime(2018, 1, 3)}},
+                   {"flag": True}, {"a": True}, {"$and": [{"a": 1}, {"task_id": {"$lt": 20}}]},
+                   {"$or": [{"a": 1}, {"task_id": 2}]}, {"b": {"c": "1"}}, {"a": {"$gt": "1"}}]
+        for indexed in [False, True]:
+            if indexed:
+                for field in ["a", "b.c", "tags", "d", "flag", "task_id"]:
+                    self.coll.create_index(field)
+            for criteria in queries:
+                self.assertSameResults(criteria)
+        self.assertSameResults({"a": 1}, {"b.c": 1, "_id": 0})
+        self.assertSameResults({"a": 1}, {"b": 0, "tags": 0})
+        self.assertEqual(self.coll.find_one({"task_id": 3}, ["a"])["a"], 3)
+        self.assertIsNone(self.coll.find_one({"task_id": 100}))
+
+        self.assertEqual([d["task_id"] for d in self.coll.find().sort(
+            [("a", pymongo.DESCENDING), ("task_id", pymongo.ASCENDING)]).skip(2).limit(3)],
+            [11, 15, 19])
+        self.assertEqual(self.coll.find_one(sort=[("task_id", pymongo.DESCENDING)])["task_id"], 49)
+        self.assertEqual(self.coll.find({"a": 1}).count(), 13)
+        self.assertEqual(self.coll.find({"a": 1}).skip(10).limit(5).count(with_limit_and_skip=True), 3)
+        self.assertEqual(self.coll.find({"a": 1}).limit(5).count(with_limit_and_skip=True), 5)
+        self.assertEqual(sorted(self.coll.distinct("b.c")), ["0", "1", "2"])
+        self.assertEqual(sorted(self.coll.distinct("tags", {"a": 1})), ["t1"])
+
+        # returned documents are copies
+        self.coll.find_one({"task_id": 1})["b"]["c"] = "x"
+        self.assertEqual(self.coll.find_one({"task_id": 1})["b"]["c"], "1")
+
+    def test_write(self):
+        self.coll.create_index("task_id", unique=True)
+        self.assertIn("task_id_1", self.coll.index_information())
+
+        requests = [ReplaceOne({"task_id": 1}, {"task_id": 1, "a": 10}, upsert=True),
+                    ReplaceOne({"task_id": 2}, {"task_id": 3}, upsert=True),
+                    ReplaceOne({"task_id": 100}, {"task_id": 100, "a": 10}, upsert=True)]
+        with self.assertRaises(BulkWriteError) as context:
+            self.coll.bulk_write(requests, ordered=False)
+        details = context.exception.details
+        self.assertEqual([e["index"] for e in details["writeErrors"]], [1])
+        self.assertEqual((details["nModified"], details["nUpserted"]), (1, 1))
+        self.assertEqual(self.coll.distinct("task_id", {"a": 10}), [1, 100])
+        self.assertEqual(self.coll.count_documents({"a": {"$gte": 10}}), 2)
+
+        self.assertEqual(self.coll.delete_many({"a": 10}).deleted_count, 2)
+        self.assertEqual(self.coll.count_documents({}), 49)
+        self.assertIsNone(self.coll.find_one({"a": {"$gte": 10}}))
+
+    def test_aggregate(self):
+        pipeline = [{"$match": {"task_id": {"$lt": 20}}}, {"$project": {"a": 1, "task_id": 1}},
+                    {"$group": {"_id": {"a": "$a"}, "docs": {"$push": "$$ROOT"},
+                                "n": {"$sum": 1}, "max": {"$max": "$task_id"}}}]
+        groups = {g["_id"]["a"]: g for g in self.coll.aggregate(pipeline)}
+        self.assertEqual(sorted(groups), [0, 1, 2, 3])
+        self.assertEqual(groups[1]["n"], 5)
+        self.assertEqual(groups[1]["max"], 17)
+        self.assertEqual([d["task_id"] for d in groups[1]["docs"]], [1, 5, 9, 13, 17])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,17 @@
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 
+from datetime import datetime, timedelta
+
+from monty.serialization import dumpfn, loadfn
 from maggma.stores import MemoryStore
 from maggma.builder import Builder
-from maggma.runner import Runner
+from maggma.runner import Runner, MultiprocProcessor, ProcessorMetrics, SerialProcessor
 
 __author__ = 'Kiran Mathew'
 __email__ = 'kmathew@lbl.gov'
@@ -27,6 +35,55 @@ class Bldr(Builder):
         pass
 
 
+class RecordingBldr(Builder):
+    """
+    Builder that records the order in which the targets are updated
+    """
+
+    updated = []
+
+    def __init__(self, sources, targets, chunk_size=1000, n=3, state_store=None):
+        super(RecordingBldr, self).__init__(sources, targets, chunk_size, state_store)
+        self.n = n
+
+    def get_items(self):
+        return range(self.n)
+
+    def process_item(self, item):
+        return item * 2
+
+    def update_targets(self, items):
+        RecordingBldr.updated.append((self.targets[0].name, sorted(items)))
+
+
+class FailingBldr(RecordingBldr):
+    """
+    Builder that fails to process item 7
+    """
+
+    def process_item(self, item):
+        if item == 7:
+            raise ValueError("cannot process item 7")
+        return super(FailingBldr, self).process_item(item)
+
+
+def run_mpi_build(filename, processor_class, builder_class="RecordingBldr", **processor_kwargs):
+    """
+    Run a RecordingBldr with an MPI processor and dump the updates from
+    rank 0 to filename. Must be launched with mpiexec.
+    """
+    import maggma.runner
+
+    RecordingBldr.updated = []
+    builders = [globals()[builder_class]([MemoryStore("0")], [MemoryStore("1")], chunk_size=4, n=25)]
+    processor = getattr(maggma.runner, processor_class)(builders, **processor_kwargs)
+    Runner(builders, processor=processor).run()
+    if processor.rank == 0:
+        stats = getattr(processor, "worker_stats", {})
+        dumpfn({"updated": RecordingBldr.updated,
+                "stats": {str(k): v for k, v in stats.items()}}, filename)
+
+
 class TestRunner(unittest.TestCase):
 
     def setUp(self):
@@ -39,3 +96,191 @@ class TestRunner(unittest.TestCase):
         rnr = Runner(self.builders)
         ans = {1: [0]}
         self.assertDictEqual(rnr.dependency_graph, ans)
+
+    def test_builder_levels(self):
+        stores = [MemoryStore(str(i)) for i in range(5)]
+        builders = [Bldr([stores[0]], [stores[1]]),
+                    Bldr([stores[2]], [stores[3]]),
+                    Bldr([stores[1], stores[3]], [stores[4]])]
+        rnr = Runner(builders)
+        self.assertEqual(rnr._get_builder_levels(), [[0, 1], [2]])
+
+        builders.append(Bldr([stores[4]], [stores[0]]))
+        rnr = Runner(builders)
+        self.assertRaises(RuntimeError, rnr._get_builder_levels)
+
+    def test_concurrent_builders(self):
+        RecordingBldr.updated = []
+        stores = [MemoryStore(str(i)) for i in range(5)]
+        builders = [RecordingBldr([stores[0]], [stores[1]], chunk_size=3),
+                    RecordingBldr([stores[2]], [stores[3]], chunk_size=3),
+                    RecordingBldr([stores[1], stores[3]], [stores[4]], chunk_size=3)]
+        rnr = Runner(builders, num_workers=2, max_builders=2)
+        rnr.run()
+        self.assertEqual(sorted(rnr.has_run), [0, 1, 2])
+        self.assertEqual(len(RecordingBldr.updated), 3)
+        self.assertEqual(RecordingBldr.updated[-1], ("4", [0, 2, 4]))
+
+    def test_concurrent_builders_shared_store(self):
+        RecordingBldr.updated = []
+        stores = [MemoryStore(str(i)) for i in range(4)]
+        builders = [RecordingBldr([stores[0]], [stores[1]], chunk_size=3),
+                    RecordingBldr([stores[0]], [stores[2]], chunk_size=3),
+                    RecordingBldr([stores[3]], [stores[3]], chunk_size=3)]
+        rnr = Runner(builders, num_workers=2, max_builders=3)
+        self.assertEqual(rnr._split_shared_stores([0, 1, 2]), [[0, 2], [1]])
+        rnr.run()
+        self.assertEqual(sorted(rnr.has_run), [0, 1, 2])
+        self.assertEqual(sorted(RecordingBldr.updated),
+                         [("1", [0, 2, 4]), ("2", [0, 2, 4]), ("3", [0, 2, 4])])
+
+    def test_pipelined_multiproc(self):
+        RecordingBldr.updated = []
+        stores = [MemoryStore(str(i)) for i in range(2)]
+        builders = [RecordingBldr([stores[0]], [stores[1]], chunk_size=2)]
+        processor = MultiprocProcessor(builders, 2, pipelined=True, max_chunks=1)
+        processor.process(0)
+        self.assertEqual(RecordingBldr.updated, [("1", [0, 2]), ("1", [4])])
+
+    def test_batched_multiproc(self):
+        stores = [MemoryStore(str(i)) for i in range(2)]
+        builders = [RecordingBldr([stores[0]], [stores[1]], chunk_size=2)]
+        self.assertEqual(builders[0].process_items([1, 2]), [2, 4])
+
+        for pipelined in [False, True]:
+            RecordingBldr.updated = []
+            processor = MultiprocProcessor(builders, 2, pipelined=pipelined, batch_size=2)
+            processor.process(0)
+            self.assertEqual(RecordingBldr.updated, [("1", [0, 2]), ("1", [4])])
+
+    def test_metrics(self):
+        stores = [MemoryStore(str(i)) for i in range(2)]
+        builders = [RecordingBldr([stores[0]], [stores[1]], chunk_size=2, n=5)]
+        processors = [SerialProcessor(builders, profile=True),
+                      MultiprocProcessor(builders, 2, profile=True),
+                      MultiprocProcessor(builders, 2, pipelined=True, batch_size=2)]
+        for processor in processors:
+            RecordingBldr.updated = []
+            report = Runner(builders, processor=processor).run()[0]
+            self.assertEqual(RecordingBldr.updated, [("1", [0, 2]), ("1", [4, 6]), ("1", [8])])
+            self.assertEqual(report["items"], {"read": 5, "processed": 5})
+            self.assertEqual(set(report["stages"]),
+                             {"get_items", "process_item", "update_targets", "finalize"})
+            self.assertGreater(report["items_per_second"], 0)
+            self.assertLessEqual(len(report["slowest_items"]), 5)
+
+        self.assertEqual(sorted(d["item"] for d in processors[0].report()[0]["slowest_items"]),
+                         ["0", "1", "2", "3", "4"])
+        for processor in processors[:2]:
+            profile = processor.report()[0]["profile"]
+            self.assertTrue(any("process_item" in f["function"] and f["calls"] == 5 for f in profile))
+        self.assertIsNotNone(report["queue_depth"])
+        self.assertEqual(report["slowest_items"][0]["item"], "batch of 2 items")
+
+    def test_metrics_threads(self):
+        metrics = ProcessorMetrics(num_workers=4)
+
+        def work():
+            for _ in metrics.timed_iter(range(2000)):
+                metrics.record(0.0)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.report()["items"], {"read": 8000, "processed": 8000})
+
+    def test_incremental(self):
+        source, target, state = MemoryStore("source"), MemoryStore("target"), MemoryStore("state")
+        builder = RecordingBldr([source], [target], state_store=state)
+        builder.connect()
+        now = datetime.utcnow()
+        source.update([{"task_id": i} for i in range(4)])
+        target.update([{"task_id": i} for i in range(1, 6)], update_lu=False)
+        target.update([{"task_id": 1, "last_updated": now + timedelta(days=1)}], update_lu=False)
+
+        self.assertEqual(builder.high_water_mark, None)
+        self.assertEqual(sorted(builder.get_new_keys(source, target)), [])
+        self.assertEqual(sorted(builder.get_new_keys(source, target, include_missing=True)), [0])
+        self.assertEqual(sorted(builder.get_deleted_keys(source, target)), [4, 5])
+
+        builder.save_high_water_mark(now - timedelta(days=1))
+        self.assertEqual(sorted(builder.get_new_keys(source, target)), [0, 1, 2, 3])
+        builder.save_high_water_mark(now + timedelta(days=1))
+        self.assertEqual(builder.get_new_keys(source, target), [])
+
+        RecordingBldr.updated = []
+        Runner([builder], processor=SerialProcessor([builder])).run()
+        self.assertGreater(builder.high_water_mark, now - timedelta(seconds=1))
+        self.assertLess(builder.high_water_mark, now + timedelta(days=1))
+
+    def test_state_key(self):
+        stores = [MemoryStore(str(i)) for i in range(3)]
+        state = MemoryStore("state")
+        builder1 = RecordingBldr([stores[0]], [stores[1]], state_store=state)
+        builder2 = RecordingBldr([stores[0]], [stores[2]], state_store=state)
+        self.assertNotEqual(builder1.state_key, builder2.state_key)
+        self.assertEqual(builder1.state_key,
+                         RecordingBldr([MemoryStore("0")], [MemoryStore("1")]).state_key)
+
+        builder1.connect()
+        builder1.save_high_water_mark(datetime(2018, 1, 1))
+        self.assertEqual(builder1.high_water_mark, datetime(2018, 1, 1))
+        self.assertIsNone(builder2.high_water_mark)
+
+
+def _has_mpi():
+    try:
+        import mpi4py
+    except ImportError:
+        return False
+    return shutil.which("mpiexec") is not None
+
+
+@unittest.skipIf(not _has_mpi(), "mpi4py or mpiexec not available")
+class TestMPIProcessor(unittest.TestCase):
+
+    def _mpiexec(self, processor_class, check=True, **processor_kwargs):
+        # allow more ranks than cores, with OpenMPI before 5 and with PRRTE
+        env = dict(os.environ, OMPI_ALLOW_RUN_AS_ROOT="1", OMPI_ALLOW_RUN_AS_ROOT_CONFIRM="1",
+                   OMPI_MCA_rmaps_base_oversubscribe="1",
+                   PRTE_MCA_rmaps_default_mapping_policy=":oversubscribe")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "out.json")
+            code = ("from maggma.tests.test_runner import run_mpi_build; "
+                    "run_mpi_build({!r}, {!r}, **{!r})".format(filename, processor_class,
+                                                               processor_kwargs))
+            process = subprocess.run(["mpiexec", "-n", "4", sys.executable, "-c", code],
+                                     env=env, check=check, timeout=120,
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if not check:
+                return process
+            return loadfn(filename)
+
+    def test_mpiexec(self):
+        out = self._mpiexec("MPIProcessor", batch_size=3, max_batches=2)
+        self.assertEqual(sorted(i for _, items in out["updated"] for i in items),
+                         [2 * i for i in range(25)])
+        self.assertTrue(all(len(items) == 4 for _, items in out["updated"][:-1]))
+        self.assertEqual(sum(s["items"] for s in out["stats"].values()), 25)
+        self.assertEqual(sorted(out["stats"].keys()), ["1", "2", "3"])
+
+    def test_mpiexec_failure(self):
+        # the job fails instead of leaving the workers waiting for batches
+        process = self._mpiexec("MPIProcessor", check=False, builder_class="FailingBldr",
+                                batch_size=3, max_batches=2)
+        self.assertNotEqual(process.returncode, 0)
+        self.assertIn(b"cannot process item 7", process.stderr)
+
+    def test_mpiexec_scatter(self):
+        out = self._mpiexec("MPIScatterProcessor", batch_size=2)
+        self.assertEqual(sorted(i for _, items in out["updated"] for i in items),
+                         [2 * i for i in range(25)])
+        self.assertTrue(all(len(items) == 4 for _, items in out["updated"][:-1]))
+
+    def test_mpiexec_scatter_failure(self):
+        process = self._mpiexec("MPIScatterProcessor", check=False, builder_class="FailingBldr",
+                                batch_size=2)
+        self.assertNotEqual(process.returncode, 0)
+        self.assertIn(b"cannot process item 7", process.stderr)
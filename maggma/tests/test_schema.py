@@ -1,7 +1,32 @@
 import unittest
 from maggma.schema import StandardSchema
+from maggma.stores import MemoryStore
 from monty.json import MSONable
 
+
+class LatticeMock(MSONable):
+    def __init__(self, a):
+        self.a = a
+
+
+class SampleSchema(StandardSchema):
+    @property
+    def schema(self):
+        return {
+            "type": "object",
+            "properties":
+                {
+                    "task_id": {"type": "string"},
+                    "successful": {"type": "boolean"}
+                },
+            "required": ["task_id", "successful"]
+        }
+
+    @property
+    def msonable_keypaths(self):
+        return {"lattice": LatticeMock}
+
+
 class SchemaTests(unittest.TestCase):
 
     def test_standardschema(self):
@@ -56,4 +81,48 @@ class SchemaTests(unittest.TestCase):
         self.assertTrue(schema.is_valid(valid_doc))
         self.assertFalse(schema.is_valid(invalid_doc_msonable))
         self.assertFalse(schema.is_valid(invalid_doc_missing_key))
-        self.assertFalse(schema.is_valid(invalid_doc_wrong_type))
\ No newline at end of file
+        self.assertFalse(schema.is_valid(invalid_doc_wrong_type))
+
+    def test_is_valid_many(self):
+        docs = [{"task_id": "mp-{}".format(i), "successful": i % 3 != 0, "lattice": LatticeMock(i).as_dict()}
+                for i in range(10)]
+        docs[1]["successful"] = "yes"
+        docs[2]["lattice"] = ["I am not a lattice!"]
+
+        schema = SampleSchema()
+        self.assertEqual(schema.is_valid_many(docs), [True, False, False] + [True] * 7)
+        self.assertIs(SampleSchema().validator, schema.validator)
+
+        # the msonable_keypaths are not checked for unsampled documents
+        self.assertTrue(SampleSchema(msonable_sample_rate=0).is_valid(docs[2]))
+        self.assertFalse(SampleSchema(msonable_sample_rate=0).is_valid(docs[1]))
+
+    def test_store_update(self):
+        store = MemoryStore("test", key="task_id")
+        store.connect()
+        store.schema = SampleSchema()
+        docs = [{"task_id": "mp-1", "successful": True}, {"task_id": "mp-2"}]
+        self.assertEqual(store.update(docs)["failed"], 1)
+        self.assertEqual(store.distinct("task_id"), ["mp-1"])
+
+        store.schema = SampleSchema(strict=True)
+        with self.assertRaises(ValueError):
+            store.update(docs)
+
+    def test_mongo_schema(self):
+        class IntegerSchema(SampleSchema):
+            @property
+            def schema(self):
+                return {
+                    "$schema": "http://json-schema.org/draft-04/schema#",
+                    "type": "object",
+                    "properties": {"nsites": {"type": "integer", "default": 1},
+                                   "format": {"type": ["string", "null"], "format": "date-time"}},
+                    "required": ["format"]
+                }
+
+        self.assertEqual(IntegerSchema().mongo_schema, {
+            "type": "object",
+            "properties": {"nsites": {"bsonType": ["int", "long"]},
+                           "format": {"type": ["string", "null"]}},
+            "required": ["format"]})
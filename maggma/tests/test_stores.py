@@ -1,6 +1,11 @@
 import os
 import glob
+import multiprocessing
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 import numpy as np
 import mongomock.collection
 import pymongo.collection
@@ -81,6 +86,30 @@ class TestMongoStore(unittest.TestCase):
         data = list(self.mongostore.groupby(["e", "d"]))
         self.assertEqual(len(data), 3)
 
+        for mode in ["ids", "stream"]:
+            data = {g["_id"]["d"]: g["docs"] for g in self.mongostore.groupby(
+                "d", properties=["f"], mode=mode)}
+            self.assertEqual(len(data[9]), 3)
+        self.assertEqual(sorted(d["f"] for d in data[9]), [9, 10, 11])
+
+    def test_server_validation(self):
+        from maggma.tests.test_schema import SampleSchema
+        self.mongostore.collection.drop()
+        store = MongoStore("maggma_test", "test", validation_level="strict", key="task_id")
+        store.schema = SampleSchema()
+        store.connect()
+        self.assertTrue(store._server_validation)
+        docs = [{"task_id": "mp-1", "successful": True}, {"task_id": "mp-2"},
+                {"task_id": "mp-3", "successful": False}]
+        self.assertEqual(store.update(docs)["failed"], 1)
+        self.assertEqual(sorted(store.distinct("task_id")), ["mp-1", "mp-3"])
+
+        store.schema = SampleSchema(strict=True)
+        with self.assertRaises(ValueError):
+            store.update(docs)
+        with self.assertRaises(ValueError):
+            MongoStore("maggma_test", "test", validation_level="lenient")
+
     def test_from_db_file(self):
         ms = MongoStore.from_db_file(os.path.join(db_dir, "db.json"))
         self.assertEqual(ms.collection_name,"tmp")
@@ -104,6 +133,126 @@ class TestMemoryStore(unittest.TestCase):
     def test_groupby(self):
         self.assertRaises( NotImplementedError, self.memstore.groupby, "a")
 
+        memstore = MemoryStore(engine="native")
+        memstore.connect()
+        memstore.update([{"task_id": i, "a": i % 3, "b": i} for i in range(10)])
+        groups = {g["_id"]["a"]: g["docs"] for g in memstore.groupby("a", properties=["a", "b"])}
+        self.assertEqual([d["b"] for d in groups[1]], [1, 4, 7])
+        self.assertEqual(memstore.query_one(criteria={"task_id": 4})["a"], 1)
+        groups = list(memstore.groupby("a", criteria={"b": {"$lt": 6}}, mode="ids"))
+        self.assertEqual(sorted(len(g["docs"]) for g in groups), [2, 2, 2])
+
+        # streaming groups by sorting does not need aggregation
+        self.memstore.connect()
+        self.memstore.update([{"task_id": i, "a": i % 3, "b": {"c": i % 2}} for i in range(10)])
+        groups = list(self.memstore.groupby(["a", "b.c"], properties=["task_id"], mode="stream"))
+        self.assertEqual([g["_id"] for g in groups[:2]], [{"a": 0, "b.c": 0}, {"a": 0, "b.c": 1}])
+        self.assertEqual([d["task_id"] for d in groups[0]["docs"]], [0, 6])
+        self.assertEqual(set(groups[0]["docs"][0]), {"_id", "task_id", "a", "b"})
+
+    def test_update(self):
+        self.memstore.connect()
+        result = self.memstore.update([{"task_id": i, "b": i} for i in range(10)])
+        self.assertEqual(result, {"upserted": 10, "modified": 0, "unchanged": 0, "failed": 0})
+
+        self.memstore.ensure_index("b", unique=True)
+        docs = [{"task_id": 8, "b": 8}, {"task_id": 9, "b": 1},
+                {"task_id": 10, "b": 10}, {"task_id": 11, "b": 2}]
+        # duplicate keys are raised once every document has been tried
+        with self.assertRaises(BulkWriteError) as context:
+            self.memstore.update(docs, ordered=False, batch_size=1, num_threads=2)
+        self.assertEqual(len(context.exception.details["writeErrors"]), 2)
+        self.assertEqual(self.memstore.collection.count_documents({}), 11)
+
+        docs = [{"task_id": 12, "b": 3}, {"task_id": 13, "b": 13}]
+        result = self.memstore.update(docs, ordered=False, raise_errors=False)
+        self.assertEqual(result, {"upserted": 1, "modified": 0, "unchanged": 0, "failed": 1})
+        self.assertEqual(self.memstore.collection.count_documents({}), 12)
+
+        self.assertRaises(BulkWriteError, self.memstore.update, docs, batch_size=2)
+        self.assertEqual(self.memstore.update([]),
+                         {"upserted": 0, "modified": 0, "unchanged": 0, "failed": 0})
+
+    def test_update_validation_errors(self):
+        # a server validator rejecting the documents without "ok"
+        def bulk_write(requests, ordered=True):
+            errors = []
+            written = 0
+            for i, request in enumerate(requests):
+                if "ok" in request._doc:
+                    written += 1
+                    continue
+                errors.append({"index": i, "code": 121, "errmsg": "Document failed validation"})
+                if ordered:
+                    break
+            details = {"writeErrors": errors, "nUpserted": written, "nModified": 0}
+            if errors:
+                raise BulkWriteError(details)
+            return mock.Mock(bulk_api_result=details)
+
+        self.memstore.connect()
+        docs = [{"task_id": 1, "ok": 1}, {"task_id": 2}, {"task_id": 3, "ok": 1}, {"task_id": 4}]
+        with mock.patch.object(self.memstore.collection, "bulk_write", side_effect=bulk_write) as write:
+            for ordered in [True, False]:
+                result = self.memstore.update(docs, ordered=ordered)
+                self.assertEqual(result, {"upserted": 2, "modified": 0, "unchanged": 0, "failed": 2})
+            self.assertEqual(write.call_count, 3)
+
+            self.memstore.schema = mock.Mock(strict=True)
+            self.memstore.schema.is_valid_many.side_effect = lambda docs: [True] * len(docs)
+            with self.assertRaises(ValueError):
+                self.memstore.update(docs)
+
+    def test_update_hash(self):
+        memstore = MemoryStore(hash_field="_hash")
+        memstore.connect()
+        t0 = datetime(2018, 1, 1)
+        memstore.update([{"task_id": i, "a": {"b": i}, "last_updated": t0} for i in range(5)],
+                        update_lu=False)
+
+        result = memstore.update([{"task_id": i, "a": {"b": i}} for i in range(5)])
+        self.assertEqual(result, {"upserted": 0, "modified": 0, "unchanged": 5, "failed": 0})
+        self.assertEqual(memstore.last_updated, t0)
+
+        result = memstore.update([{"task_id": i, "a": {"b": 1}} for i in range(6)], batch_size=4)
+        self.assertEqual(result, {"upserted": 1, "modified": 4, "unchanged": 1, "failed": 0})
+        self.assertGreater(memstore.last_updated, t0)
+        self.assertEqual(memstore.query_one(criteria={"task_id": 1})["last_updated"], t0)
+
+    def test_encoder(self):
+        self.assertRaises(ValueError, MemoryStore, encoder="unknown")
+        for encoder in ["jsanitize", "fast", "trusted"]:
+            memstore = MemoryStore(encoder=encoder)
+            memstore.connect()
+            doc = {"task_id": 1, "a": {"b": [1, 2]}}
+            memstore.update([doc])
+            self.assertEqual(memstore.query_one(criteria={"task_id": 1})["a"], {"b": [1, 2]})
+            self.assertNotIn("last_updated", doc)
+
+    def test_last_updated(self):
+        self.memstore.connect()
+        self.assertNotIn("last_updated_1", self.memstore.collection.index_information())
+        memstore = MemoryStore(lu_index=True)
+        memstore.connect()
+        self.assertIn("last_updated_1", memstore.collection.index_information())
+        # the index is only a courtesy, connecting works without it
+        memstore = MemoryStore(lu_index=True)
+        with mock.patch.object(MemoryStore, "ensure_index", side_effect=RuntimeError("denied")):
+            memstore.connect()
+        self.assertEqual(memstore.last_updated, datetime.min)
+
+        t0 = datetime(2018, 1, 1)
+        self.memstore.update([{"task_id": 1, "last_updated": t0}], update_lu=False)
+        self.assertEqual(self.memstore.last_updated, t0)
+        # writes that bypass update are not seen until the next update or connect
+        self.memstore.collection.insert_one({"task_id": 2, "last_updated": t0.replace(month=2)})
+        self.assertEqual(self.memstore.last_updated, t0)
+        self.memstore.update([{"task_id": 3, "last_updated": t0.replace(month=3)}],
+                             update_lu=False)
+        self.assertEqual(self.memstore.last_updated, t0.replace(month=3))
+        self.memstore.connect()
+        self.assertEqual(self.memstore.last_updated, datetime.min)
+
 
 class TestJsonStore(unittest.TestCase):
 
@@ -120,6 +269,210 @@ class TestJsonStore(unittest.TestCase):
         jsonstore.connect()
         self.assertEqual(len(list(jsonstore.query())), 20)
 
+    def test_json_lines(self):
+        docs = [{"task_id": i, "a": [i] * 3} for i in range(2500)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for filename in ["docs.jsonl", "docs.jsonl.gz"]:
+                path = os.path.join(tmp_dir, filename)
+                with zopen(path, "wt") as f:
+                    f.write("\n".join(json.dumps(d) for d in docs))
+                jsonstore = JSONStore(path)
+                jsonstore.connect()
+                self.assertEqual(jsonstore.collection.count_documents({}), 2500)
+                self.assertEqual(jsonstore.query_one(criteria={"task_id": 2499})["a"], [2499] * 3)
+
+    def test_utf8(self):
+        # JSON files are UTF-8 whatever the locale
+        docs = [{"task_id": i, "name": "\u00e9l\u00e9ment \u6750\u6599 {}".format(i)} for i in range(3)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for filename in ["docs.json", "docs.json.gz"]:
+                path = os.path.join(tmp_dir, filename)
+                with zopen(path, "wt", encoding="utf-8") as f:
+                    json.dump(docs, f, ensure_ascii=False)
+                jsonstore = JSONStore(path)
+                jsonstore.connect()
+                self.assertEqual(jsonstore.query_one(criteria={"task_id": 2})["name"], docs[2]["name"])
+
+
+class TestIndexedJSONStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "docs.json")
+        self.docs = [{"task_id": i, "name": "\u00e9l\u00e9ment {}".format(i),
+                      "data": {"n": i % 3}, "last_updated": "2018-01-0{}T00:00:00.000".format(1 + i % 5)}
+                     for i in range(20)]
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.docs, f, ensure_ascii=False, indent=2)
+        self.store = IndexedJSONStore(self.path, index_fields=["data"], lu_type="isoformat")
+        self.store.connect()
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def test_query(self):
+        self.assertEqual(list(self.store.query()), self.docs)
+        self.assertEqual(self.store.query_one(criteria={"task_id": 5}), self.docs[5])
+        self.assertEqual(self.store.query_one(criteria={"name": "\u00e9l\u00e9ment 7"}), self.docs[7])
+        self.assertEqual([d["task_id"] for d in self.store.query(criteria={"data.n": 1})],
+                         [1, 4, 7, 10, 13, 16, 19])
+        self.assertEqual(list(self.store.query(properties=["data.n"], criteria={"task_id": 2})),
+                         [{"data": {"n": 2}}])
+        self.assertEqual([d["task_id"] for d in self.store.query(
+            sort=[("data.n", pymongo.DESCENDING), ("task_id", pymongo.ASCENDING)], skip=1, limit=3)],
+            [5, 8, 11])
+        self.assertEqual(sorted(self.store.distinct("data.n")), [0, 1, 2])
+        self.assertEqual(self.store.distinct("task_id", criteria={"name": {"$regex": "1$"}}), [1, 11])
+        self.assertEqual(self.store.last_updated, datetime(2018, 1, 5))
+        self.assertRaises(NotImplementedError, self.store.update, self.docs)
+
+    def test_index(self):
+        index_path = self.path + ".idx.json"
+        with open(index_path) as f:
+            index = json.load(f)
+        self.assertEqual(len(index["entries"]), 20)
+
+        # the saved index is used as long as the file is unchanged
+        index["entries"][0][2]["data"]["n"] = 5
+        with open(index_path, "w") as f:
+            json.dump(index, f)
+        store = IndexedJSONStore(self.path, index_fields=["data"])
+        store.connect()
+        self.assertEqual(store.distinct("task_id", criteria={"data.n": 5}), [0])
+
+        store.ensure_index("name")
+        self.assertEqual(store.distinct("task_id", criteria={"data.n": 5}), [])
+        self.assertEqual(list(store.query(properties=["name"], criteria={"task_id": 0})),
+                         [{"name": "\u00e9l\u00e9ment 0"}])
+        with open(index_path) as f:
+            self.assertIn("name", json.load(f)["fields"])
+        store.close()
+
+    def test_non_ascii(self):
+        docs = [{"task_id": "\u00e9-{}".format(i), "name": "\u03a9 \u6750\u6599 {}".format(i)}
+                for i in range(3)]
+        for ensure_ascii in [True, False]:
+            path = os.path.join(self.tmp_dir.name, "non_ascii_{}.json".format(ensure_ascii))
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(docs, f, ensure_ascii=ensure_ascii)
+            store = IndexedJSONStore(path, index_fields=["name"])
+            store.connect()
+            self.assertEqual(store.distinct("task_id"), [d["task_id"] for d in docs])
+            self.assertEqual(store.query_one(criteria={"name": "\u03a9 \u6750\u6599 1"}), docs[1])
+            self.assertEqual(list(store.query(properties=["name"], criteria={"task_id": "\u00e9-2"})),
+                             [{"name": docs[2]["name"]}])
+            store.close()
+
+    def test_sort_mixed_types(self):
+        values = [1, 1.5, 0.5, {"a": 2}, {"a": 1}, "s", None]
+        path = os.path.join(self.tmp_dir.name, "mixed.json")
+        with open(path, "w") as f:
+            json.dump([{"task_id": i, "x": x} for i, x in enumerate(values)], f)
+        store = IndexedJSONStore(path)
+        store.connect()
+        # numbers of both types together, then strings and objects, like MongoDB
+        self.assertEqual([d["x"] for d in store.query(sort=[("x", pymongo.ASCENDING)])],
+                         [None, 0.5, 1, 1.5, "s", {"a": 1}, {"a": 2}])
+        store.close()
+
+def _sqlite_update(args):
+    store, docs = args
+    store.connect()
+    return store.update(docs)["upserted"]
+
+
+class TestSQLiteStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = SQLiteStore(os.path.join(self.tmp_dir.name, "test.db"), hash_field="_hash")
+        self.store.connect()
+        self.t0 = datetime(2018, 1, 1)
+        self.store.update([{"task_id": i, "a": i % 3, "tags": ["t{}".format(i % 2)],
+                            "b": {"c": str(i)}, "last_updated": self.t0 + timedelta(days=i)}
+                           for i in range(10)], update_lu=False)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def test_query(self):
+        self.store.ensure_index("a")
+        self.store.ensure_index("tags")
+        for criteria, expected in [({"a": 1}, [1, 4, 7]), ({"a": 1, "task_id": {"$gt": 4}}, [7]),
+                                   ({"task_id": {"$in": [2, 3, 11]}}, [2, 3]), ({"tags": "t1"}, [1, 3, 5, 7, 9]),
+                                   ({"b.c": "5"}, [5]), ({"$or": [{"a": 2}, {"b.c": "1"}]}, [1, 2, 5, 8]),
+                                   ({"last_updated": {"$gte": self.t0 + timedelta(days=8)}}, [8, 9]),
+                                   ({"a": {"$ne": 0}, "task_id": {"$lte": 2}}, [1, 2])]:
+            self.assertEqual([d["task_id"] for d in self.store.query(criteria=criteria)], expected)
+        self.assertIsNone(self.store._where({"b.c": "5"}))
+
+        doc = self.store.query_one(properties=["b.c"], criteria={"task_id": 3})
+        self.assertEqual(doc, {"b": {"c": "3"}})
+        self.assertEqual([d["task_id"] for d in self.store.query(
+            sort=[("a", pymongo.DESCENDING), ("task_id", pymongo.ASCENDING)], limit=3)], [2, 5, 8])
+        self.assertEqual(self.store.distinct("task_id"), list(range(10)))
+        self.assertEqual(sorted(self.store.distinct("tags", criteria={"a": 0})), ["t0", "t1"])
+        self.assertEqual(self.store.last_updated, self.t0 + timedelta(days=9))
+
+        # numbers of both types sort together, like in MongoDB
+        self.store.update([{"task_id": i, "x": x} for i, x in enumerate([1, 1.5, 0.5, {"a": 1}])])
+        self.assertEqual([d.get("x") for d in self.store.query(
+            criteria={"task_id": {"$lt": 4}}, sort=[("x", pymongo.ASCENDING)])],
+            [0.5, 1, 1.5, {"a": 1}])
+
+    def test_update(self):
+        result = self.store.update([{"task_id": 1, "a": 1, "tags": ["t1"], "b": {"c": "1"}},
+                                    {"task_id": 2, "a": 5}, {"task_id": 10}, {"task_id": 10, "a": 1}])
+        self.assertEqual(result, {"upserted": 1, "modified": 2, "unchanged": 1, "failed": 0})
+        self.assertEqual(self.store.query_one(criteria={"task_id": 1})["last_updated"],
+                         self.t0 + timedelta(days=1))
+        self.assertEqual([d["task_id"] for d in self.store.query(criteria={"a": 1})], [1, 4, 7, 10])
+        self.assertGreater(self.store.last_updated, self.t0 + timedelta(days=9))
+
+        self.store.update([{"task_id": 20, "b": {"c": "3"}}], key="b.c")
+        self.assertIsNone(self.store.query_one(criteria={"task_id": 3}))
+        self.assertEqual(self.store.query_one(criteria={"b.c": "3"})["task_id"], 20)
+
+        # numeric keys are matched by value, like in MongoDB
+        count = len(self.store.distinct("task_id"))
+        result = self.store.update([{"task_id": 5.0, "a": 2}, {"task_id": 10.5}])
+        self.assertEqual(result, {"upserted": 1, "modified": 1, "unchanged": 0, "failed": 0})
+        self.assertEqual(self.store.query_one(criteria={"task_id": 5})["task_id"], 5.0)
+        self.assertEqual(len(self.store.distinct("task_id")), count + 1)
+
+        # nothing is written if an update fails
+        self.assertRaises(sqlite3.IntegrityError, self.store.update,
+                          [{"task_id": 30, "b": {"c": "5"}}, {"task_id": 4, "b": {"c": "6"}}], key="b.c")
+        self.assertIsNone(self.store.query_one(criteria={"task_id": 30}))
+
+    def test_multiprocessing(self):
+        with multiprocessing.Pool(2) as pool:
+            upserted = pool.map(_sqlite_update, [(self.store, [{"task_id": i}]) for i in range(10, 20)])
+        self.assertEqual(sum(upserted), 10)
+        self.assertEqual(len(self.store.distinct("task_id")), 20)
+
+    def test_index_from_other_connection(self):
+        other = SQLiteStore(self.store.path)
+        other.connect()
+        other.ensure_index("a")
+        # the store writes the index rows of fields indexed by other connections
+        self.store.update([{"task_id": 10, "a": 1}])
+        self.assertEqual([d["task_id"] for d in other.query(criteria={"a": 1})], [1, 4, 7, 10])
+        self.store.ensure_index("a")
+        self.assertEqual([d["task_id"] for d in self.store.query(criteria={"a": 1})], [1, 4, 7, 10])
+        other.close()
+
+    def test_close(self):
+        conns = []
+        thread = threading.Thread(target=lambda: conns.append(self.store.collection))
+        thread.start()
+        thread.join()
+        self.store.close()
+        self.assertRaises(sqlite3.ProgrammingError, conns[0].execute, "SELECT 1")
+        self.assertEqual(self.store._conns, [])
+
 
 class TestGridFSStore(unittest.TestCase):
 
@@ -146,6 +499,87 @@ class TestGridFSStore(unittest.TestCase):
 
         self.assertEqual(self.gStore.query_one(criteria={"task_id": "mp-3"}), None)
 
+    def test_threads(self):
+        gStore = GridFSStore("maggma_test", "test", key="task_id", num_threads=4)
+        gStore.connect()
+        docs = [{"task_id": "mp-{}".format(i), "data": list(range(i))} for i in range(20)]
+        gStore.update(docs)
+        results = {d["task_id"]: d["data"] for d in gStore.query()}
+        self.assertEqual(results, {d["task_id"]: d["data"] for d in docs})
+        gStore.close()
+
+    def test_codecs(self):
+        data = np.random.rand(4, 64)
+        docs = {}
+        for compression in [None] + sorted(COMPRESSORS):
+            for encoding in ["json", "bson"]:
+                task_id = "{}-{}".format(compression, encoding)
+                gStore = GridFSStore("maggma_test", "test", key="task_id",
+                                     compression=compression, encoding=encoding)
+                gStore.connect()
+                gStore.update([{"task_id": task_id, "data": data, "n": 1}])
+                docs[task_id] = gStore.query_one(criteria={"task_id": task_id})
+                f = gStore._files_collection.find_one({"task_id": task_id})
+                self.assertEqual(f["metadata"], {"compression": compression, "encoding": encoding})
+
+        # files are decoded according to their metadata
+        for task_id, doc in docs.items():
+            self.assertEqual(self.gStore.query_one(criteria={"task_id": task_id})["n"], 1)
+            nptu.assert_almost_equal(doc["data"], data, 7)
+        self.assertIsInstance(docs["zlib-bson"]["data"], np.ndarray)
+        self.assertLess(self.gStore._files_collection.find_one({"task_id": "lzma-bson"})["length"],
+                        self.gStore._files_collection.find_one({"task_id": "None-json"})["length"])
+        self.assertRaises(ValueError, GridFSStore, "maggma_test", "test", compression="rar")
+
+    def test_replace(self):
+        for n in range(3):
+            self.gStore.update([{"task_id": "mp-1", "n": n}, {"task_id": "mp-2", "n": n},
+                                {"task_id": "mp-2", "n": n + 10}])
+        self.assertEqual(self.gStore._files_collection.count_documents({}), 2)
+        self.assertEqual(self.gStore._chunks_collection.count_documents({}), 2)
+        self.assertEqual(self.gStore.query_one(criteria={"task_id": "mp-2"})["n"], 12)
+        self.assertIn("task_id_1_uploadDate_-1", self.gStore._files_collection.index_information())
+
+        gStore = GridFSStore("maggma_test", "test", key="task_id", replace=False)
+        gStore.connect()
+        gStore.update([{"task_id": "mp-1", "n": 5}])
+        self.assertEqual(gStore.query_one(criteria={"task_id": "mp-1"})["n"], 5)
+        self.assertEqual(gStore.query_one(criteria={"task_id": "mp-1"},
+                                          sort=[("uploadDate", pymongo.ASCENDING)])["n"], 2)
+
+        files = list(gStore.query(properties=["task_id"], criteria={"task_id": "mp-1"},
+                                  metadata_only=True))
+        self.assertEqual(len(files), 2)
+        self.assertEqual(set(files[0]), {"_id", "task_id"})
+
+        # a file uploaded by another writer of the same key afterwards is kept
+        written = self.gStore._put({"task_id": "mp-1", "n": 20}, None)
+        time.sleep(0.01)
+        self.gStore._put({"task_id": "mp-1", "n": 30}, None)
+        self.gStore._remove_older([written])
+        self.assertEqual(self.gStore._files_collection.count_documents({"task_id": "mp-1"}), 2)
+        self.assertEqual(self.gStore.query_one(criteria={"task_id": "mp-1"})["n"], 30)
+
+    def test_last_updated(self):
+        gStore = GridFSStore("maggma_test", "test", key="task_id", lu_index=True)
+        gStore.connect()
+        self.assertIn("last_updated_1", gStore._files_collection.index_information())
+        self.assertEqual(self.gStore.last_updated, datetime.min)
+
+        t0 = datetime(2018, 1, 1)
+        self.gStore.update([{"task_id": "mp-1", "last_updated": t0}], update_lu=False)
+        self.assertEqual(self.gStore.last_updated, t0)
+        self.gStore.update([{"task_id": "mp-2", "last_updated": t0.replace(month=3)}],
+                           update_lu=False)
+        self.assertEqual(self.gStore.last_updated, t0.replace(month=3))
+        dt_store = DatetimeStore(t0.replace(month=2))
+        dt_store.connect()
+        self.assertEqual(self.gStore.distinct("task_id", criteria=self.gStore.lu_filter(dt_store)),
+                         ["mp-2"])
+
+        self.gStore.update([{"task_id": "mp-3"}])
+        self.assertGreater(self.gStore.last_updated, t0.replace(month=3))
+
     def test_distinct(self):
         self.gStore.update([{"task_id": "mp-1", "data": "Something"}])
         self.gStore.update([{"task_id": "mp-2", "data": "Something"}])
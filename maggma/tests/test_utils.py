@@ -1,5 +1,21 @@
+import io
+import json
+import time
 import unittest
-from maggma.utils import get_mongolike, make_mongolike, put_mongolike, recursive_update
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from bson.objectid import ObjectId
+from monty.json import MSONable, jsanitize
+from maggma.utils import get_mongolike, make_mongolike, put_mongolike, recursive_update, \
+    bson_sanitize, iter_json, prefetch_map
+
+
+class MSONableMock(MSONable):
+
+    def __init__(self, a):
+        self.a = a
 
 
 class UtilsTests(unittest.TestCase):
@@ -38,3 +54,59 @@ class UtilsTests(unittest.TestCase):
 
         recursive_update(d, {"a": {"b": [7]}})
         self.assertEqual(d["a"]["b"], [7])
+
+
+    def test_bson_sanitize(self):
+        d = {"a": [1, 2.5, "x", None, True], 1: {"b": (3, 4)}, "c": datetime.utcnow(),
+             "d": ObjectId(), "e": np.array([[1.0, 2.0]])}
+        self.assertEqual(bson_sanitize(d), jsanitize(d, allow_bson=True))
+        self.assertEqual(bson_sanitize({"f": np.int64(3)}), {"f": 3})
+
+        msonable = bson_sanitize({"m": MSONableMock(MSONableMock(1))})
+        self.assertEqual(msonable["m"]["a"]["a"], 1)
+        self.assertEqual(msonable["m"]["@class"], "MSONableMock")
+
+    def test_iter_json(self):
+        docs = [{"a": i, "b": [1.5, {"c": "x" * i}]} for i in range(20)] + [12345, "s"]
+        texts = [json.dumps(docs), json.dumps(docs, indent=2),
+                 "\n".join(json.dumps(d) for d in docs) + "\n"]
+        for text in texts:
+            for block_size in [1, 7, 65536]:
+                self.assertEqual(list(iter_json(io.StringIO(text), block_size)), docs)
+
+        self.assertEqual(list(iter_json(io.StringIO('{"a": 1}'), 3)), [{"a": 1}])
+        self.assertEqual(list(iter_json(io.StringIO(" [ ] "))), [])
+        self.assertRaises(ValueError, list, iter_json(io.StringIO('[{"a": 1}, {"b": '), 4))
+        for text in ["[1,,2]", "[1 2]", "[,1]", "[1,]", '[{"a": 1} {"b": 2}]']:
+            for block_size in [1, 65536]:
+                self.assertRaises(ValueError, list, iter_json(io.StringIO(text), block_size))
+
+        # malformed values fail without reading the rest of the stream
+        values = [1, -2.5e-3, "\u00e9\\\"", True, None, float("inf"), {"a": [{}]}]
+        for block_size in [1, 3]:
+            self.assertEqual(list(iter_json(io.StringIO(json.dumps(values)), block_size)), values)
+        tail = "," + ",".join(['{"b": 1}'] * 10000) + "]"
+        for text in ['[{"a": 1}, x', '[{"a": x}', '[{"a": 1}, {"a": [1, 2 3]}']:
+            f = io.StringIO(text + tail)
+            self.assertRaises(ValueError, list, iter_json(f, 64))
+            self.assertLess(f.tell(), 1000)
+
+    def test_prefetch_map(self):
+        submitted = []
+
+        def square(x):
+            time.sleep(0.01 * (x % 3))
+            return x * x
+
+        def items():
+            for i in range(20):
+                submitted.append(i)
+                yield i
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = prefetch_map(square, items(), executor, 4)
+            self.assertEqual(next(results), 0)
+            # only prefetch items are read ahead of the consumer
+            self.assertEqual(len(submitted), 5)
+            self.assertEqual(list(results), [i * i for i in range(1, 20)])
+
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+
+from maggma.stores import MemoryStore
+from maggma.validation import ChangedCollection, load_state, save_state, validate_collections
+
+
+class ValidationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.t0 = datetime(2018, 1, 1)
+        self.db = {}
+        for name in ["a", "b", "bad"]:
+            store = MemoryStore(name)
+            store.connect()
+            store.update([{"task_id": i, "last_updated": self.t0.replace(day=1 + i)} for i in range(3)],
+                         update_lu=False)
+            self.db[name] = store.collection
+        self.colls = [("a", ["x", "y"]), ("b", ["x"]), ("bad", ["x", "bad"])]
+        self.barrier = None
+
+    def _validate(self, coll, coll_name, section):
+        if self.barrier is not None and coll_name == "a":
+            # both sections of "a" have to run at the same time to pass
+            self.barrier.wait()
+        if section == "bad":
+            raise KeyError("bad section")
+        return section, sorted(d["task_id"] for d in coll.find())
+
+    def test_changed_collection(self):
+        coll = ChangedCollection(self.db["a"], {"last_updated": {"$gt": self.t0}})
+        self.assertEqual(sorted(d["task_id"] for d in coll.find()), [1, 2])
+        self.assertEqual([d["task_id"] for d in coll.find({"task_id": {"$lt": 2}})], [1])
+        self.assertIsNone(coll.find_one({"task_id": 0}))
+        self.assertEqual(coll.count(), 2)
+        self.assertEqual(coll.count({"task_id": 2}), 1)
+        self.assertEqual(coll.name, "a")
+
+    def test_state_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fname = os.path.join(tmp_dir, "state.json")
+            self.assertEqual(load_state(fname), {})
+            state = {"a": self.t0, "b": 5}
+            save_state(fname, state)
+            self.assertEqual(load_state(fname), state)
+            self.assertEqual(os.listdir(tmp_dir), ["state.json"])
+
+    def test_validate_collections(self):
+        self.barrier = threading.Barrier(2, timeout=10)
+        results, errors, state = validate_collections(self.db, self.colls, self._validate, workers=3,
+                                                      state={"bad": self.t0})
+        # the sections of each collection, in order
+        self.assertEqual(results, {"a": [("x", [0, 1, 2]), ("y", [0, 1, 2])], "b": [("x", [0, 1, 2])]})
+        # any error of a section fails its collection only
+        self.assertEqual(errors, {"bad": "'bad section'"})
+        # the failed collection is validated from the same point next time
+        self.assertEqual(state, {"a": self.t0.replace(day=3), "b": self.t0.replace(day=3), "bad": self.t0})
+
+        # only the documents changed since the last run are validated again
+        self.barrier = None
+        self.db["a"].insert_one({"task_id": 3, "last_updated": self.t0.replace(day=10)})
+        self.db["a"].update_one({"task_id": 0}, {"$set": {"last_updated": self.t0.replace(day=9)}})
+        results, errors, state = validate_collections(self.db, self.colls[:2], self._validate, state=state)
+        self.assertEqual(results, {"a": [("x", [0, 3]), ("y", [0, 3])], "b": [("x", [])]})
+        self.assertEqual(state["a"], self.t0.replace(day=10))
+
+        # without a state every document is validated
+        results, errors, state = validate_collections(self.db, self.colls[:1], self._validate)
+        self.assertEqual(results, {"a": [("x", [0, 1, 2, 3]), ("y", [0, 1, 2, 3])]})
+        self.assertEqual(state, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
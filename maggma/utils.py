@@ -1,7 +1,18 @@
 # coding: utf-8
+from collections import deque
+import hashlib
 import itertools
+import json
+import re
 from datetime import datetime, timedelta
 
+from bson.objectid import ObjectId
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 def dt_to_isoformat_ceil_ms(dt):
     """Helper to account for Mongo storing datetimes with only ms precision."""
@@ -100,3 +111,201 @@ def reload_msonable_object(obj):
     """
     obj_class = obj.__class__
     return obj_class.from_dict(obj.as_dict())
+
+
+def prefetch_map(func, iterable, executor, prefetch):
+    """
+    Like map, but func runs in an executor on up to prefetch items ahead of
+    the item being consumed. Results are yielded in order.
+
+    Args:
+        func (callable): function to apply
+        iterable: items to apply func to, consumed as results are yielded
+        executor (Executor): executor running func
+        prefetch (int): maximum number of items submitted at a time
+    """
+    iterator = iter(iterable)
+    pending = deque(executor.submit(func, item) for item in itertools.islice(iterator, prefetch))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            for item in itertools.islice(iterator, 1):
+                pending.append(executor.submit(func, item))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def content_hash(d, exclude=()):
+    """
+    Hash of the content of a document that does not depend on the key order.
+
+    Args:
+        d (dict): the document
+        exclude (list): top-level keys to leave out of the hash
+    """
+    content = {k: v for k, v in d.items() if k not in exclude}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+_JSON_WHITESPACE = re.compile(r"\s*")
+
+# first characters of JSON values, including the NaN and Infinity of json
+_JSON_VALUE_START = frozenset('{["-0123456789tfnNI')
+
+# a value cut off at the end of the buffer fails to parse within this many
+# characters of the end, e.g. "-Infinit", unless it is in a string
+_JSON_MAX_TOKEN = 12
+
+
+def iter_json(f, block_size=65536):
+    """
+    Incrementally parse the JSON values in a text stream. Supports a single
+    value, a top-level JSON array, whose elements are yielded one by one, and
+    JSON Lines, i.e. whitespace-separated values. Only the value being parsed
+    and one block of text are held in memory.
+
+    Args:
+        f: file-like object opened in text mode
+        block_size (int): number of characters read at a time
+
+    Yields:
+        the parsed values
+    """
+    for obj, _, _ in iter_json_spans(f, block_size):
+        yield obj
+
+
+def iter_json_spans(f, block_size=65536):
+    """
+    Same as iter_json, but also yields where each value is in the stream.
+
+    Args:
+        f: file-like object opened in text mode
+        block_size (int): number of characters read at a time
+
+    Yields:
+        (value, start, end) tuples, where start and end are character offsets
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    # offset of buf[0] in the stream
+    base = 0
+    pos = 0
+    eof = False
+    in_array = None
+    # in an array, whether the next token must be a comma, after an element,
+    # or an element, after a comma
+    expect_comma = False
+    expect_value = False
+
+    while True:
+        pos = _JSON_WHITESPACE.match(buf, pos).end()
+
+        if pos == len(buf):
+            if eof:
+                break
+            data = f.read(block_size)
+            eof = not data
+            buf, base, pos = buf[pos:] + data, base + pos, 0
+            continue
+
+        if in_array is None:
+            in_array = buf[pos] == "["
+            if in_array:
+                pos += 1
+                expect_comma = expect_value = False
+            continue
+        if in_array and buf[pos] == "]":
+            if expect_value:
+                raise ValueError("Expecting value at character {}".format(base + pos))
+            in_array = None
+            pos += 1
+            continue
+        if in_array and buf[pos] == ",":
+            if not expect_comma:
+                raise ValueError("Expecting value at character {}".format(base + pos))
+            expect_comma, expect_value = False, True
+            pos += 1
+            continue
+        if expect_comma:
+            raise ValueError("Expecting ',' delimiter at character {}".format(base + pos))
+        if buf[pos] not in _JSON_VALUE_START:
+            raise ValueError("Expecting value at character {}".format(base + pos))
+
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+            # a number at the end of the buffer might be cut off
+            incomplete = end == len(buf) and not eof
+        except json.JSONDecodeError as err:
+            # only read on if the error can be due to the end of the buffer,
+            # rather than buffering the rest of a malformed stream
+            if eof or (err.pos < len(buf) - _JSON_MAX_TOKEN
+                       and not err.msg.startswith("Unterminated string")):
+                raise
+            incomplete = True
+
+        if incomplete:
+            # read at least as much as is buffered to avoid re-parsing large values too often
+            data = f.read(max(block_size, len(buf) - pos))
+            eof = not data
+            buf, base, pos = buf[pos:] + data, base + pos, 0
+            continue
+
+        yield obj, base + pos, base + end
+        pos = end
+        if in_array:
+            expect_comma, expect_value = True, False
+
+
+# types that BSON encodes as they are
+_BSON_NATIVE = (str, bool, int, float, type(None), datetime, bytes, ObjectId)
+
+# cache of the conversion function for each type seen by bson_sanitize
+_SANITIZERS = {t: None for t in _BSON_NATIVE}
+
+
+def bson_sanitize(obj):
+    """
+    Fast alternative to jsanitize(obj, allow_bson=True) for documents that are
+    mostly BSON-compatible already. The conversion for each type is looked up
+    once and cached, values of native BSON types are returned as they are,
+    numpy arrays and scalars are converted to Python types and MSONable objects
+    are converted with as_dict. Other objects are converted to strings.
+
+    Args:
+        obj: document or value to sanitize
+    """
+    try:
+        sanitizer = _SANITIZERS[type(obj)]
+    except KeyError:
+        sanitizer = _SANITIZERS[type(obj)] = _get_sanitizer(type(obj))
+    return obj if sanitizer is None else sanitizer(obj)
+
+
+def _sanitize_dict(d):
+    return {k if type(k) is str else str(k): v if type(v) in _BSON_NATIVE else bson_sanitize(v)
+            for k, v in d.items()}
+
+
+def _sanitize_list(l):
+    return [v if type(v) in _BSON_NATIVE else bson_sanitize(v) for v in l]
+
+
+def _get_sanitizer(cls):
+    """
+    Returns the function bson_sanitize uses for objects of class cls,
+    None if they are returned as they are.
+    """
+    if issubclass(cls, _BSON_NATIVE):
+        return None
+    if issubclass(cls, dict):
+        return _sanitize_dict
+    if issubclass(cls, (list, tuple)):
+        return _sanitize_list
+    if np is not None and issubclass(cls, (np.ndarray, np.generic)):
+        return lambda obj: obj.tolist()
+    if hasattr(cls, "as_dict"):
+        return lambda obj: _sanitize_dict(obj.as_dict())
+    return str
@@ -0,0 +1,131 @@
+# coding: utf-8
+"""
+Concurrent and incremental validation of the collections of a database,
+independent of the validator that checks the documents.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+
+import pymongo
+from bson import json_util
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class ChangedCollection(object):
+    """
+    Collection whose queries are restricted to documents matching criteria,
+    e.g. the documents updated since the last validation.
+    """
+
+    def __init__(self, coll, criteria):
+        """
+        Args:
+            coll (Collection): the collection
+            criteria (dict): criteria added to every query
+        """
+        self._coll = coll
+        self._criteria = criteria
+
+    def _and(self, spec):
+        return {"$and": [spec, self._criteria]} if spec else self._criteria
+
+    def find(self, spec=None, *args, **kwargs):
+        return self._coll.find(self._and(spec), *args, **kwargs)
+
+    def find_one(self, spec=None, *args, **kwargs):
+        return self._coll.find_one(self._and(spec), *args, **kwargs)
+
+    def count(self, spec=None, **kwargs):
+        return self._coll.count_documents(self._and(spec), **kwargs)
+
+    def count_documents(self, spec=None, **kwargs):
+        return self._coll.count_documents(self._and(spec), **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._coll, name)
+
+
+def newest(coll, lu_field):
+    """
+    Returns the newest lu_field value in a collection, or None if no document
+    has one
+    """
+    doc = coll.find_one({lu_field: {"$exists": True}}, {lu_field: 1},
+                        sort=[(lu_field, pymongo.DESCENDING)])
+    return doc[lu_field] if doc else None
+
+
+def load_state(fname):
+    """
+    Returns the newest lu_field value validated in each collection, as saved
+    in a state file, or an empty state if the file does not exist
+    """
+    if not os.path.exists(fname):
+        return {}
+    with open(fname) as f:
+        return json_util.loads(f.read(), json_options=json_util.JSONOptions(tz_aware=False))
+
+
+def save_state(fname, state):
+    """
+    Saves the state to a file, replacing it only once it is written
+    """
+    tmp = fname + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(json_util.dumps(state))
+    os.replace(tmp, fname)
+
+
+def validate_collections(db, colls, validate, workers=1, state=None, lu_field="last_updated"):
+    """
+    Validates the constraint sections of collections concurrently. Any error
+    while validating a section is recorded for its collection and does not
+    stop the other sections or collections.
+
+    With a state, i.e. the newest lu_field value validated in each collection,
+    only the documents changed since then are validated.
+
+    Args:
+        db (Database): database of the collections, or a dict of collections
+            by name
+        colls (list): (collection name, list of constraint sections) pairs
+        validate (callable): validates one section, called as
+            validate(collection, collection name, section)
+        workers (int): number of threads validating sections concurrently
+        state (dict): newest lu_field value validated in each collection, all
+            documents are validated if None
+        lu_field (str): field holding the time documents were last updated
+
+    Returns:
+        (dict of the results of the sections of each validated collection,
+         in the order of the sections,
+         dict of the error message of each failed collection,
+         new state, updated for the validated collections)
+    """
+    new_state = dict(state) if state is not None else {}
+    newest_lu = {}
+    futures = []
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for coll_name, sections in colls:
+            coll = db[coll_name]
+            if state is not None:
+                newest_lu[coll_name] = newest(coll, lu_field)
+                if coll_name in state:
+                    coll = ChangedCollection(coll, {lu_field: {"$gt": state[coll_name]}})
+            futures.append([executor.submit(validate, coll, coll_name, section)
+                            for section in sections])
+
+    results, errors = {}, {}
+    for (coll_name, _), coll_futures in zip(colls, futures):
+        try:
+            results[coll_name] = [future.result() for future in coll_futures]
+        except Exception as err:
+            logger.error("Validating collection {}: {}".format(coll_name, err))
+            errors[coll_name] = str(err)
+            continue
+        if newest_lu.get(coll_name) is not None:
+            new_state[coll_name] = newest_lu[coll_name]
+    return results, errors, new_state
@@ -21,7 +21,8 @@ if __name__ == "__main__":
         zip_safe=False,
         install_requires=['pymongo>=3.4.0', 'mongomock>=3.8.0', 'monty>=0.9.8',
                           'smoqe==0.1.3', 'PyYAML==3.12', 'pydash==4.1.0'],
-        extras_require={"mpi": ["mpi4py>=2.0.0"]},
+        extras_require={"mpi": ["mpi4py>=2.0.0"],
+                        "compression": ["lz4>=1.0.0", "zstandard>=0.9.0"]},
         classifiers=["Programming Language :: Python :: 3",
                      "Programming Language :: Python :: 3.6",
                      'Development Status :: 2 - Pre-Alpha',